@@ -1,40 +1,120 @@
-import pandas as pd
-import openpyxl
-import re
-import os
+from facet_index import FacetIndex
+from formula_compiler import compile_sheet_formulas
+from formula_graph import FormulaGraph
+from metrics import CALCULATE_STAGE_SECONDS, FORMULA_DEPTH, MATCH_TIER, ROWS_SCANNED
+from model_cache import cached_model, load_model
+from result_cache import ResultCache, canonical_input
+from sheet_schema import BreakdownColumn, SheetSchema
+from workbook_loader import load_workbook_data
+import time
 import traceback
-from datetime import datetime
+from log_pipeline import get_logger
 
 class WHExcelHandler:
-    def __init__(self, file_path):
+    # Sheets an uploaded workbook must have, with the titles of their header row
+    REQUIRED_HEADERS = {'WAHL WH fee': ('From', 'To')}
+
+    def __init__(self, file_path, base=None):
+        # `base`: path of an earlier version of the workbook whose model is
+        # cached (the same path if it was edited in place), reused as it is when the fee sheet did not change
         self.file_path = file_path
+        self.logger = get_logger('wh_cost', 'wh_cost_logs.txt', prefix='[WH] ')
+        self.result_cache = ResultCache()
+        self.route_options_cache = None
+        compiled = {}
+        self.schemas = {}
+        self.facet_index = {}
         try:
-            self.wb = openpyxl.load_workbook(self.file_path, data_only=True)
-            self.wb_formula = openpyxl.load_workbook(self.file_path, data_only=False)
-            self._log(f"Loaded WH workbook: {file_path}")
+            model = load_model(self.file_path, 'wh', lambda: self._build_model(base), self._log)
+            self.wb = model['wb']
+            self.schemas = model['schemas']
+            compiled = model['compiled_formulas']
+            self.facet_index = model['facet_index']
         except Exception as e:
             self._log(f"Error loading WH workbook {file_path}: {e}")
             self.wb = None
-            self.wb_formula = None
-        self.route_options_cache = None
+        self.formula_graph = self._build_formula_graph(compiled)
+
+    def _build_model(self, base=None):
+        """Parse the workbook and compile the fee sheet formulas (cached on disk)."""
+        previous = cached_model(base, 'wh') if base else None
+        # One pass over the xlsx gives both cached values and formulas
+        self.wb = load_workbook_data(self.file_path, sheets=['WAHL WH fee'],
+                                     reuse=previous['wb'] if previous else None)
+        self._log(f"Loaded WH workbook: {self.file_path}")
+        if 'WAHL WH fee' in self.wb.reused:
+            self._log(f"WAHL WH fee unchanged since {base}, reusing its model")
+            self.schemas = previous['schemas']
+            return {'wb': self.wb, 'schemas': self.schemas, 'compiled_formulas': previous['compiled_formulas'],
+                    'facet_index': previous['facet_index']}
+        compiled = {}
+        if 'WAHL WH fee' in self.wb.sheetnames:
+            self.schemas = {'WAHL WH fee': self._build_schema(self.wb['WAHL WH fee'])}
+            compiled = compile_sheet_formulas(self.wb['WAHL WH fee'], self._log)
+        return {'wb': self.wb, 'schemas': self.schemas, 'compiled_formulas': compiled,
+                'facet_index': self._build_facet_index()}
+
+    def _build_schema(self, ws):
+        """Header lookups, input field columns and cost item columns of the fee sheet."""
+        header_row, col_info = self._scan_header_info(ws)
+        col_titles = {}
+        for c in range(1, ws.max_column + 1):
+            header = ws.value(header_row, c)
+            if header:
+                col_titles[c] = str(header).strip()
+        input_cols = [(col_info[name], name) for name in self.INPUT_FIELDS if col_info.get(name)]
+
+        # Cost items are the columns after the last input field, with their
+        # standard rates ('65000HKD/Month' etc.) in the row under the header
+        start_col = col_info.get('total invoice value (RMB)', 12) + 1
+        breakdown = []
+        for c in range(start_col, ws.max_column + 1):
+            header = ws.value(header_row, c)
+            if header and str(header).strip() != '':
+                breakdown.append(BreakdownColumn(c, str(header), False, ws.value(header_row + 1, c)))
+        return SheetSchema(header_row, col_info, col_titles, input_cols, breakdown)
+
+    def _build_formula_graph(self, compiled):
+        """Put the compiled fee sheet formulas into a dependency graph once at load."""
+        if not self.wb or 'WAHL WH fee' not in self.wb.sheetnames:
+            return FormulaGraph({}, {}, self._cell_number)
+        header_names = self.schemas['WAHL WH fee'].col_titles
+        graph = FormulaGraph(compiled, header_names, self._cell_number, self._log, trace=self.logger.debug)
+        self._log(f"Compiled {len(compiled)} formulas in WAHL WH fee ({len(graph.cyclic)} on cycles)")
+        return graph
+
+    def _cell_number(self, r, c):
+        v = self.wb['WAHL WH fee'].value(r, c)
+        try: return float(v) if v else 0.0
+        except: return 0.0
+
+    def carry_over(self, previous):
+        """Take over the route options and cached results of `previous`, the
+        handler of an earlier version of this workbook, if the fee sheet
+        did not change."""
+        if not self.wb or not previous.wb or 'WAHL WH fee' not in self.wb.sheets:
+            return
+        source = self.wb['WAHL WH fee'].source
+        if source is None or 'WAHL WH fee' not in previous.wb.sheets or previous.wb['WAHL WH fee'].source != source:
+            return
+        if previous.route_options_cache and not self.route_options_cache:
+            self.route_options_cache = previous.route_options_cache
+        carried = self.result_cache.adopt(previous.result_cache, lambda key: True)
+        self._log(f"Carried over {carried} cached results from the previous workbook")
 
     def _log(self, msg):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] [WH] {msg}\n"
-        print(log_entry.strip())
-        
-        # Write to log file in working directory
-        log_file = os.path.join(os.getcwd(), 'wh_cost_logs.txt')
-        try:
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(log_entry)
-        except Exception as e:
-            print(f"Error writing to log file: {e}")
+        # Queued and written by the background log writer (see log_pipeline);
+        # per-row traces go straight to self.logger.debug
+        self.logger.info(msg)
 
     def _find_header_info(self, ws):
+        schema = self.schemas[ws.title]
+        return schema.header_row, schema.header_cols
+
+    def _scan_header_info(self, ws):
         # Search first 5 rows for From and To
         for r in range(1, 6):
-            row_values = [ws.cell(r, c).value for c in range(1, 20)]
+            row_values = [ws.value(r, c) for c in range(1, 20)]
             if 'From' in row_values and 'To' in row_values:
                 info = {}
                 for idx, val in enumerate(row_values):
@@ -63,8 +143,8 @@ class WHExcelHandler:
         node_counter = 0
         
         for r in range(header_row + 1, ws.max_row + 1):
-            f_val = ws.cell(r, from_col).value
-            t_val = ws.cell(r, to_col).value
+            f_val = ws.value(r, from_col)
+            t_val = ws.value(r, to_col)
             if not f_val or not t_val: continue
             
             frm = str(f_val).strip()
@@ -86,7 +166,7 @@ class WHExcelHandler:
                 'from': frm,
                 'to': to,
                 'excel_row': r,
-                'own': str(ws.cell(r, col_info.get('Own', 1)).value or '')
+                'own': str(ws.value(r, col_info.get('Own', 1)) or '')
             })
         
         self.route_options_cache = options
@@ -94,82 +174,90 @@ class WHExcelHandler:
 
     INPUT_FIELDS = ['Import Truck times', 'Export Truck times', 'pallet', 'CBM', 'Month Qty', 'total invoice value (RMB)']
 
-    def get_node_fields(self, node, location_str, current_inputs=None):
+    def _build_facet_index(self):
+        """Per node, its differentiator fields with all their options and a
+        FacetIndex of its rows, for get_node_fields()."""
+        index = {}
         options = self.get_route_options()
-        if node not in options: return []
-        
+        if not options: return index
+
         ws = self.wb['WAHL WH fee']
         header_row, col_info = self._find_header_info(ws)
-        details = options[node]['details']
-        
         own_idx = col_info.get('Own', 1)
         invoice_idx = col_info.get('total invoice value (RMB)', 12)
         exclude = ['From', 'To', 'Method', 'TOTAL Cost(HKD)']
 
-        # 1. Identify "Differentiators" - fixed for the node
-        differentiators = []
+        columns = []
         for c in range(own_idx, invoice_idx + 1):
-            header = ws.cell(header_row, c).value
+            header = ws.value(header_row, c)
             header_str = str(header).strip() if header else ""
             if not header_str or header_str in exclude or header_str in self.INPUT_FIELDS:
                 continue
-            
-            vals = set()
-            for d in details:
-                v = ws.cell(d['excel_row'], c).value
-                if v is not None and str(v).strip().upper() != 'N/A' and str(v).strip() != '':
-                    vals.add(str(v).strip())
-            
-            # Show field if it has ANY content (not just multiple values)
-            if len(vals) > 0:
-                all_opts = sorted(list(vals))
-                print(f"[DEBUG] Node {node}: Field '{header_str}' has {len(all_opts)} options: {all_opts}")
-                differentiators.append({
-                    "name": header_str,
-                    "col_idx": c,
-                    "all_options": all_opts  # Store all possible values
-                })
+            columns.append((c, header_str))
+        input_cols = self.schemas['WAHL WH fee'].input_cols
+
+        for node, info in options.items():
+            rows = [d['excel_row'] for d in info['details']]
+            facet = FacetIndex(rows)
+            for pos, r in enumerate(rows):
+                # Differentiators by the value a selection is compared with,
+                # input fields by whether the row has a value at all
+                for c, header_str in columns:
+                    facet.add(c, pos, str(ws.value(r, c) or '').strip())
+                for c, header_str in input_cols:
+                    v = ws.value(r, c)
+                    facet.add(header_str, pos, v is not None and str(v).strip().upper() != 'N/A')
 
-        print(f"[DEBUG] Node {node}: Found {len(details)} detail rows, {len(differentiators)} differentiator fields")
+            # 1. Identify "Differentiators" - fixed for the node
+            differentiators = []
+            for c, header_str in columns:
+                vals = set()
+                for r in rows:
+                    v = ws.value(r, c)
+                    if v is not None and str(v).strip().upper() != 'N/A' and str(v).strip() != '':
+                        vals.add(str(v).strip())
+                # Show field if it has ANY content (not just multiple values)
+                if vals:
+                    differentiators.append((header_str, c, sorted(vals)))
+            index[node] = {"facet": facet, "differentiators": differentiators}
+        return index
+
+    def get_node_fields(self, node, location_str, current_inputs=None):
+        options = self.get_route_options()
+        if node not in options or node not in self.facet_index: return []
+        
+        ws = self.wb['WAHL WH fee']
+        facet = self.facet_index[node]["facet"]
+        differentiators = self.facet_index[node]["differentiators"]
+        self.logger.debug("Node %s: Found %s detail rows, %s differentiator fields", node, len(facet.rows), len(differentiators))
         
         fields = []
         # Differentiators ALWAYS show ALL their options (not filtered by other selections)
-        for diff in differentiators:
+        for name, c, all_options in differentiators:
             fields.append({
-                "name": diff['name'],
-                "display_name": diff['name'],
-                "options": diff['all_options'],  # Always show all options
+                "name": name,
+                "display_name": name,
+                "options": list(all_options),  # Always show all options
                 "type": "select"
             })
 
         # 2. Get Input Fields - filtered based on ALL current selections
-        matching_rows = details
+        matching = facet.all
         if current_inputs:
-            print(f"[DEBUG] Filtering rows based on current inputs: {current_inputs}")
-            for d_info in differentiators:
-                val = current_inputs.get(d_info['name'])
+            self.logger.debug("Filtering rows based on current inputs: %s", current_inputs)
+            for name, c, _ in differentiators:
+                val = current_inputs.get(name)
                 if val:
-                    before_count = len(matching_rows)
-                    matching_rows = [r for r in matching_rows if str(ws.cell(r['excel_row'], d_info['col_idx']).value or '').strip() == str(val).strip()]
-                    print(f"[DEBUG]   Filter by {d_info['name']}='{val}': {before_count} -> {len(matching_rows)} rows")
+                    matching &= facet.bits(c, str(val).strip())
+                    self.logger.debug("  Filter by %s='%s': %s rows left", name, val, facet.count(matching, facet.all))
         
-        # If matching_rows is empty (conflict), we use all rows of node to avoid empty UI
-        effective_rows = matching_rows if matching_rows else details
-        print(f"[DEBUG] Using {len(effective_rows)} rows to determine available input fields")
+        # If no row matches (conflict), we use all rows of node to avoid empty UI
+        effective = matching if matching else facet.all
+        first_row = facet.first_row(effective)
 
-        for header_str in self.INPUT_FIELDS:
-            c = col_info.get(header_str)
-            if not c: continue
-            
-            has_val = False
-            for r in effective_rows:
-                v = ws.cell(r['excel_row'], c).value
-                if v is not None and str(v).strip().upper() != 'N/A':
-                    has_val = True
-                    break
-            
-            if has_val:
-                val = ws.cell(effective_rows[0]['excel_row'], c).value
+        for c, header_str in self.schemas['WAHL WH fee'].input_cols:
+            if facet.bits(header_str, True) & effective:
+                val = ws.value(first_row, c)
                 fields.append({
                     "name": header_str,
                     "display_name": header_str,
@@ -180,6 +268,32 @@ class WHExcelHandler:
         return fields
 
     def calculate(self, selections):
+        # Repeat quotes are answered from the result cache, which keeps and
+        # hands out its own copies, so callers may change what they get
+        key = self._selection_key(selections)
+        if key is not None:
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                self.logger.debug("WH CALCULATION served from result cache: %s", selections)
+                return cached
+        result = self._calculate(selections)
+        if key is not None:
+            self.result_cache.put(key, result)
+        return result
+
+    def _selection_key(self, selections):
+        """Hashable canonical form of calculate() selections, None if there is none."""
+        try:
+            key = tuple(
+                (sel.get('node'), tuple(sorted((k, canonical_input(v)) for k, v in sel.get('inputs', {}).items())))
+                for sel in selections
+            )
+            hash(key)
+            return key
+        except (AttributeError, TypeError):
+            return None
+
+    def _calculate(self, selections):
         results = []
         total_total_cost = 0
         
@@ -188,7 +302,7 @@ class WHExcelHandler:
         self._log("=" * 60)
         
         ws = self.wb['WAHL WH fee']
-        ws_formula = self.wb_formula['WAHL WH fee']
+        formulas = self.formula_graph.formulas
         header_row, col_info = self._find_header_info(ws)
         options = self.get_route_options()
         
@@ -206,19 +320,24 @@ class WHExcelHandler:
                 self._log(f"  Attempting to match inputs: {inputs}")
                 self._log(f"  Available rows for Node {node_id}: {len(details)} rows")
                 
+                match_started = time.perf_counter()
                 matched_row = None
+                tier = 'no_match'
+                scanned = 0
                 for d in details:
+                    scanned += 1
                     r = d['excel_row']
                     match = True
                     for k, v in inputs.items():
                         c_idx = col_info.get(k)
                         if c_idx:
-                            cell_val = str(ws.cell(r, c_idx).value or '').strip()
+                            cell_val = str(ws.value(r, c_idx) or '').strip()
                             if cell_val != str(v).strip():
                                 match = False
                                 break
                     if match:
                         matched_row = r
+                        tier = 'strict'
                         self._log(f"  ✓ Exact match found at Excel Row {r}")
                         break
                 
@@ -228,6 +347,7 @@ class WHExcelHandler:
                     self._log(f"  Numeric fields to ignore: {self.INPUT_FIELDS}")
                     
                     for d in details:
+                        scanned += 1
                         r = d['excel_row']
                         match = True
                         match_details = []
@@ -239,7 +359,7 @@ class WHExcelHandler:
                             
                             c_idx = col_info.get(k)
                             if c_idx:
-                                cell_val = str(ws.cell(r, c_idx).value or '').strip()
+                                cell_val = str(ws.value(r, c_idx) or '').strip()
                                 expected_val = str(v).strip()
                                 if cell_val == expected_val:
                                     match_details.append(f"{k}='{cell_val}'✓")
@@ -248,13 +368,18 @@ class WHExcelHandler:
                                     match = False
                                     break
                         
-                        self._log(f"    Row {r}: {', '.join(match_details)} -> {'MATCH' if match else 'NO MATCH'}")
+                        self.logger.debug("    Row %s: %s -> %s", r, ', '.join(match_details), 'MATCH' if match else 'NO MATCH')
                         
                         if match:
                             matched_row = r
+                            tier = 'fallback'
                             self._log(f"  ✓ Fallback match found at Excel Row {r}")
                             break
                 
+                CALCULATE_STAGE_SECONDS.observe(time.perf_counter() - match_started, 'wh', 'match')
+                MATCH_TIER.inc('wh', tier)
+                ROWS_SCANNED.observe(scanned, 'wh')
+                
                 if not matched_row:
                     error_msg = f"无法找到匹配的Excel行。请检查您的选择组合。\n当前输入: {inputs}\n可用的行组合:"
                     for d in details:
@@ -264,7 +389,7 @@ class WHExcelHandler:
                             if k not in self.INPUT_FIELDS:
                                 c_idx = col_info.get(k)
                                 if c_idx:
-                                    val = ws.cell(r, c_idx).value
+                                    val = ws.value(r, c_idx)
                                     row_info.append(f"{k}='{val}'")
                         error_msg += f"\n  Row {r}: {', '.join(row_info)}"
                     
@@ -275,7 +400,7 @@ class WHExcelHandler:
                 self._log(f"  Matched Excel Row: {matched_row}")
                 
                 cost_col = col_info.get('TOTAL Cost(HKD)')
-                calc_cost, breakdown = self._recalculate_formula(ws, ws_formula, matched_row, cost_col, inputs, col_info, header_row)
+                calc_cost, breakdown = self._recalculate_formula(ws, formulas, matched_row, cost_col, inputs, header_row)
                 
                 results.append({
                     "node": node_id,
@@ -294,134 +419,47 @@ class WHExcelHandler:
             "total_cost": total_total_cost
         }
 
-    def _recalculate_formula(self, ws, ws_formula, row, col, user_inputs, col_info, header_row):
-        formula = ws_formula.cell(row, col).value
+    def _recalculate_formula(self, ws, formulas, row, col, user_inputs, header_row):
+        compiled = formulas.get((row, col))
         # If it's not a formula, just return the value
-        if not formula or not isinstance(formula, str) or not formula.startswith('='):
-            val = ws.cell(row, col).value
+        if compiled is None:
+            val = ws.value(row, col)
             return float(val) if val else 0.0, {"base": [], "variable": []}
 
-        self._log(f"  Recalculating TOTAL Cost formula: {formula}")
-        evaluated_val = self._evaluate_formula(ws, ws_formula, formula, row, user_inputs, col_info, header_row)
+        self._log(f"  Recalculating TOTAL Cost formula: {compiled.source}")
+        
+        # Cost item columns, from the one after the inputs to the last one
+        item_cols = self.schemas[ws.title].breakdown
+        
+        # TOTAL Cost and every cost item share one evaluation, so each
+        # referenced formula cell is computed at most once per request
+        started = time.perf_counter()
+        values = self.formula_graph.evaluate([(row, col)] + [(row, item.col) for item in item_cols if (row, item.col) in formulas], user_inputs)
+        CALCULATE_STAGE_SECONDS.observe(time.perf_counter() - started, 'wh', 'formula')
+        FORMULA_DEPTH.observe(self.formula_graph.depth.get((row, col), 0), 'wh')
+        evaluated_val = values[(row, col)]
         self._log(f"  Final Calculated Result: {evaluated_val:.4f}")
         
         # Build breakdown for display
-        # Scan from column 13 (M) to the last column with content
         breakdown = {"base": [], "variable": []}
         
-        # Start from column 13 (standard cost items start here)
-        start_col = 13
-        # End at the last column in the worksheet
-        end_col = ws.max_column + 1
-        
-        self._log(f"  Scanning cost item columns: {start_col} to {end_col-1}")
+        self._log(f"  Scanning cost item columns: {[item.col for item in item_cols]}")
         
-        for c in range(start_col, end_col):
-            header = ws.cell(header_row, c).value
-            if not header or str(header).strip() == '': 
-                continue
-            
-            item_formula = ws_formula.cell(row, c).value
-            if item_formula and isinstance(item_formula, str) and item_formula.startswith('='):
-                val = self._evaluate_formula(ws, ws_formula, item_formula, row, user_inputs, col_info, header_row)
+        started = time.perf_counter()
+        for c, header, variable, standard_rate in item_cols:
+            item = formulas.get((row, c))
+            if item is not None:
+                item_formula = item.source
+                val = values[(row, c)]
             else:
-                val = ws.cell(row, c).value
+                item_formula = val = ws.value(row, c)
             
             if val is not None and val != 0:
-                # Row 3 contains the standard rates like '65000HKD/Month' etc.
-                standard_rate = ws.cell(3, c).value
-                breakdown["base"].append({
-                    "name": str(header),
+                breakdown["variable" if variable else "base"].append({
+                    "name": header,
                     "row1": str(standard_rate) if standard_rate else (item_formula if item_formula else ""),
                     "row2": f"{val:.2f}" if isinstance(val, (int, float)) else str(val)
                 })
+        CALCULATE_STAGE_SECONDS.observe(time.perf_counter() - started, 'wh', 'breakdown')
         
         return evaluated_val, breakdown
-
-    def _evaluate_formula(self, ws, ws_formula, formula, row, user_inputs, col_info, header_row):
-        if not formula or not isinstance(formula, str): return 0.0
-        if not formula.startswith('='):
-            try: return float(formula)
-            except: return 0.0
-            
-        expr = formula[1:].strip()
-        
-        # Handle SUM(Range)
-        sum_matches = re.findall(r'SUM\(([A-Z]+)(\d+):([A-Z]+)(\d+)\)', expr)
-        for start_col_str, start_row_str, end_col_str, end_row_str in sum_matches:
-            start_col = openpyxl.utils.column_index_from_string(start_col_str)
-            end_col = openpyxl.utils.column_index_from_string(end_col_str)
-            s_row = int(start_row_str)
-            e_row = int(end_row_str)
-            
-            sum_val = 0.0
-            for r in range(s_row, e_row + 1):
-                for c in range(start_col, end_col + 1):
-                    cell_f = ws_formula.cell(r, c).value
-                    if cell_f and isinstance(cell_f, str) and cell_f.startswith('='):
-                        sum_val += self._evaluate_formula(ws, ws_formula, cell_f, r, user_inputs, col_info, header_row)
-                    else:
-                        header_name = self._get_header_name(ws, header_row, c)
-                        if header_name and header_name in user_inputs:
-                            try: sum_val += float(user_inputs[header_name])
-                            except: pass
-                        else:
-                            val = ws.cell(r, c).value
-                            try: sum_val += float(val) if val else 0.0
-                            except: pass
-            
-            expr = expr.replace(f'SUM({start_col_str}{start_row_str}:{end_col_str}{end_row_str})', str(sum_val))
-
-        # Handle Cell references
-        cell_refs = re.findall(r'([A-Z]+)(\d+)', expr)
-        # Sort by length descending to avoid replacing A10 before A1
-        cell_refs.sort(key=lambda x: len(x[0]+x[1]), reverse=True)
-        
-        for col_str, row_str in cell_refs:
-            c_idx = openpyxl.utils.column_index_from_string(col_str)
-            r_idx = int(row_str)
-            
-            header_name = self._get_header_name(ws, header_row, c_idx)
-            val = None
-            
-            if header_name and header_name in user_inputs and r_idx == row:
-                try: 
-                    val = float(user_inputs[header_name])
-                    self._log(f"      Replacing {col_str}{row_str} with User Input '{header_name}': {val}")
-                except: 
-                    val = 0.0
-            else:
-                cell_f = ws_formula.cell(r_idx, c_idx).value
-                if cell_f and isinstance(cell_f, str) and cell_f.startswith('='):
-                    val = self._evaluate_formula(ws, ws_formula, cell_f, r_idx, user_inputs, col_info, header_row)
-                    self._log(f"      Formula at {col_str}{row_str} evaluated to: {val}")
-                else:
-                    v = ws.cell(r_idx, c_idx).value
-                    try: 
-                        val = float(v) if v else 0.0
-                        self._log(f"      Value at {col_str}{row_str} is: {val}")
-                    except: 
-                        val = 0.0
-            
-            # Match whole word to avoid replacing A10 when we meant A1
-            pattern = r'\b' + col_str + row_str + r'\b'
-            if re.search(pattern, expr):
-                expr = re.sub(pattern, str(val), expr)
-                self._log(f"      [Formula Step] {col_str}{row_str} -> {val}")
-
-        try:
-            # Basic sanitization
-            safe_expr = expr.replace('^', '**')
-            # Only allow mathematical ops
-            if all(c in '0123456789.+-*/() *' for c in safe_expr):
-                result = eval(safe_expr)
-                return float(result)
-            else:
-                self._log(f"Warning: Unsafe expression detected: {expr}")
-                return 0.0
-        except Exception as e:
-            self._log(f"Error evaluating {expr}: {e}")
-            return 0.0
-
-    def _get_header_name(self, ws, header_row, col):
-        return str(ws.cell(header_row, col).value).strip() if ws.cell(header_row, col).value else None
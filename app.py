@@ -1,48 +1,228 @@
-from flask import Flask, request, jsonify, send_from_directory
+import time
+# Measured up to the end of the imports and reported at startup
+_import_started = time.perf_counter()
+
+from flask import Flask, Request, Response, g, request, jsonify, send_from_directory, stream_with_context, url_for
 from flask_cors import CORS
 from excel_handler import ExcelHandler
+from bulk_jobs import BulkJobManager
+from cost_sweep import sweep_costs
+from lane_costs import cost_frontier
+from metrics import HTTP_REQUEST_SECONDS, HTTP_REQUESTS, REGISTRY
+from route_planner import plan_routes
+from model_registry import ModelRegistry, UnknownWorkbook
+from profiling import CalculateProfiler, ProfileForbidden, profile_requested
+from warmup import Warmup
+from workbook_loader import InvalidWorkbook, check_workbook
 import os
+import tempfile
+import uuid
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__, static_folder='frontend/dist')
-CORS(app)
+CORS(app, expose_headers=['X-Workbook-Id', 'X-Workbook-Version'])
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', os.path.join(BASE_DIR, 'uploads'))
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Bigger request bodies get a 413 before they are read
+MAX_UPLOAD_MB = float(os.environ.get('MAX_UPLOAD_MB', 50))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 2 ** 20)
+
+class UploadRequest(Request):
+    """Streams uploaded files to a temp file in the upload folder whatever
+    their size, so keeping one is a hard link rather than a copy."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile('wb+', dir=UPLOAD_FOLDER, prefix='.incoming-')
+
+app.request_class = UploadRequest
+
 import sys
 sys.path.append(os.path.join(BASE_DIR, 'WH Cost'))
 from wh_excel_handler import WHExcelHandler
 
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+# With LAZY_STARTUP=1 the app imports without its workbooks and each
+# process loads them in the background; /healthz/ready says when it is done
+LAZY_STARTUP = os.environ.get('LAZY_STARTUP', '0') != '0'
+
+# Loaded workbooks by content hash; callers pick one with ?workbook_id=
+# (or the X-Workbook-Id header) and get the built-in one without it
+MODEL_STORE = os.path.join(UPLOAD_FOLDER, 'models')
+
 DEFAULT_EXCEL = '5.shipping cost based on summary.xlsx'
-current_handler = ExcelHandler(os.path.join(BASE_DIR, DEFAULT_EXCEL))
+route_models = ModelRegistry('routes', ExcelHandler, os.path.join(MODEL_STORE, 'routes'))
 
 WH_DEFAULT_EXCEL = os.path.join(BASE_DIR, 'WH Cost', 'WH cost.xlsx')
-wh_handler = WHExcelHandler(WH_DEFAULT_EXCEL)
+wh_models = ModelRegistry('wh', WHExcelHandler, os.path.join(MODEL_STORE, 'wh'))
 
+warmup = Warmup([(route_models, os.path.join(BASE_DIR, DEFAULT_EXCEL)), (wh_models, WH_DEFAULT_EXCEL)])
+if __name__ == '__mp_main__':
+    # The registries' builder process, spawned while serving `python app.py`,
+    # imports this module again under that name; it only builds the
+    # workbooks it is sent and must not load (and publish) the built-in ones
+    pass
+elif LAZY_STARTUP:
+    print(f"App imported in {IMPORT_SECONDS * 1000:.0f} ms, loading workbooks in the background", flush=True)
+else:
+    _load_started = time.perf_counter()
+    warmup.run()
+    print(f"App imported in {IMPORT_SECONDS * 1000:.0f} ms, built-in workbooks loaded in "
+          f"{(time.perf_counter() - _load_started) * 1000:.0f} ms", flush=True)
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    global current_handler
+def _result_cache_stats(stat):
+    def collect():
+        values = {}
+        for registry in (route_models, wh_models):
+            for handler in registry.handlers():
+                values[(registry.kind,)] = values.get((registry.kind,), 0) + handler.result_cache.stats()[stat]
+        return values
+    return collect
+
+def _registry_stats(stat):
+    return lambda: {(registry.kind,): registry.stats()[stat] for registry in (route_models, wh_models)}
+
+REGISTRY.callback('rate_result_cache_entries', "Results held by the result caches", ('kind',), _result_cache_stats('size'))
+REGISTRY.callback('rate_result_cache_hits_total', "Result cache hits", ('kind',), _result_cache_stats('hits'), kind='counter')
+REGISTRY.callback('rate_result_cache_misses_total', "Result cache misses", ('kind',), _result_cache_stats('misses'), kind='counter')
+REGISTRY.callback('rate_models_loaded', "Workbook models held in memory", ('kind',), _registry_stats('models'))
+REGISTRY.callback('rate_model_bytes', "Estimated memory of the loaded models", ('kind',), _registry_stats('bytes'))
+REGISTRY.callback('rate_model_evictions_total', "Models dropped for the memory budget", ('kind',), _registry_stats('evictions'), kind='counter')
+
+profiler = CalculateProfiler()
+
+# Finished bulk jobs and their results are deleted after BULK_JOB_HOURS
+BULK_JOB_HOURS = float(os.environ.get('BULK_JOB_HOURS', 24))
+bulk_jobs = BulkJobManager(os.path.join(UPLOAD_FOLDER, 'bulk_results'), keep_seconds=BULK_JOB_HOURS * 3600)
+BULK_EXTENSIONS = ('.csv', '.xlsx')
+
+
+def _workbook_id():
+    return request.args.get('workbook_id') or request.headers.get('X-Workbook-Id')
+
+def _route_handler():
+    return _snapshot_handler(route_models)
+
+def _wh_handler():
+    return _snapshot_handler(wh_models)
+
+def _profile_requested():
+    # Admins get a cProfile of the request with X-Profile-Token or ?profile=
+    return profile_requested(request.headers.get('X-Profile-Token') or request.args.get('profile'))
+
+def _snapshot_handler(registry):
+    # The request keeps this snapshot to the end, even if a newer workbook
+    # is published while it runs
+    g.workbook = registry.get(_workbook_id())
+    return g.workbook.handler
+
+@app.before_request
+def start_warmup():
+    # Normally started by gunicorn's post_worker_init already
+    if LAZY_STARTUP:
+        warmup.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    REGISTRY.start_publisher()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method)
+        HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+    return response
+
+@app.after_request
+def add_workbook_version(response):
+    workbook = g.get('workbook')
+    if workbook is not None:
+        response.headers['X-Workbook-Id'] = workbook.workbook_id
+        response.headers['X-Workbook-Version'] = str(workbook.version)
+    return response
+
+@app.errorhandler(ProfileForbidden)
+def profile_forbidden(e):
+    return jsonify({"error": "Profiling needs a valid profile token"}), 403
+
+@app.errorhandler(UnknownWorkbook)
+def unknown_workbook(e):
+    return jsonify({"error": f"Unknown workbook_id {e.args[0]}, please upload the workbook again"}), 404
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({"error": f"Upload is larger than the {MAX_UPLOAD_MB:g} MB limit"}), 413
+
+def _save_upload(file, filepath):
+    try:
+        file.stream.flush()
+        os.link(file.stream.name, filepath)
+    except (AttributeError, OSError):
+        file.save(filepath)
+
+def _upload_workbook(registry, status_endpoint, prefix=''):
+    """Save an uploaded workbook, check its structure and register it; the
+    caller keeps the returned id and polls `status_endpoint` with it."""
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
-    if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        current_handler = ExcelHandler(filepath)
-        return jsonify({"message": f"Successfully loaded {filename}", "filename": filename})
+    filename = secure_filename(file.filename)
+    filepath = os.path.join(UPLOAD_FOLDER, f"{prefix}{uuid.uuid4().hex}_{filename}")
+    _save_upload(file, filepath)
+    stored = False
+    try:
+        # Missing sheets, headers or unparseable formulas fail here, before
+        # anything is stored or a worker spends seconds loading the file
+        warnings = check_workbook(filepath, registry.factory.REQUIRED_HEADERS)
+        workbook_id, loaded = registry.store(filepath)
+        stored = True
+    except InvalidWorkbook as e:
+        return jsonify({"error": f"{filename} is not a valid workbook: {e}", "problems": e.problems}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to load {filename}: {e}"}), 400
+    finally:
+        # Once stored the registry has moved (or dropped) the file
+        if not stored and os.path.exists(filepath):
+            os.remove(filepath)
+    # Parsing runs in the background; poll the status until it is ready
+    status = registry.status(workbook_id)
+    status_url = url_for(status_endpoint, workbook_id=workbook_id)
+    status.update({"message": f"Loading {filename}" if not loaded else f"Successfully loaded {filename}",
+                   "filename": filename, "status_url": status_url, "warnings": warnings})
+    if loaded:
+        return jsonify(status)
+    return jsonify(status), 202, {"Location": status_url}
+
+def _workbook_status(registry, workbook_id):
+    status = registry.status(workbook_id)
+    if status is None:
+        return jsonify({"error": "Unknown workbook"}), 404
+    return jsonify(status)
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    return _upload_workbook(route_models, 'workbook_status')
 
 @app.route('/api/load-builtin', methods=['POST'])
 def load_builtin():
-    global current_handler
-    current_handler = ExcelHandler(os.path.join(BASE_DIR, DEFAULT_EXCEL))
-    return jsonify({"message": "Successfully loaded built-in workbook"})
+    workbook_id, _ = route_models.register(os.path.join(BASE_DIR, DEFAULT_EXCEL), pinned=True, default=True, wait=False)
+    status = route_models.status(workbook_id)
+    status["message"] = "Successfully loaded built-in workbook"
+    return jsonify(status)
+
+@app.route('/api/workbooks/<workbook_id>', methods=['GET'])
+def workbook_status(workbook_id):
+    return _workbook_status(route_models, workbook_id)
 
 @app.route('/api/download-builtin', methods=['GET'])
 def download_builtin():
@@ -54,14 +234,16 @@ def download_builtin():
 
 @app.route('/api/routes', methods=['GET'])
 def get_routes():
+    handler = _route_handler()
     try:
-        options = current_handler.get_route_options()
+        options = handler.get_route_options()
         return jsonify(options)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/fields', methods=['POST'])
 def get_fields():
+    handler = _route_handler()
     try:
         data = request.json
         node = data.get('node')
@@ -69,76 +251,225 @@ def get_fields():
         if not node or not location:
             return jsonify({"error": "Missing node or location"}), 400
         
-        fields = current_handler.get_node_fields(node, location)
+        fields = handler.get_node_fields(node, location, data.get('inputs'))
         return jsonify(fields)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/calculate', methods=['POST'])
 def calculate():
+    handler = _route_handler()
+    profile_this = _profile_requested()
     try:
         data = request.json
         if not isinstance(data, list):
             return jsonify({"error": "Expected a list of selections"}), 400
         
-        result = current_handler.calculate(data)
+        result, profile = profiler.calculate(handler, data, profile_this)
+        result["workbook_version"] = g.workbook.version
+        if profile is not None:
+            result["profile"] = profile
         return jsonify(result)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/sweep', methods=['POST'])
+def sweep():
+    handler = _route_handler()
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a selection with ranges"}), 400
+        return jsonify(sweep_costs(handler, data, data.get('ranges')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/frontier', methods=['POST'])
+def frontier():
+    handler = _route_handler()
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a selection"}), 400
+        return jsonify(cost_frontier(handler, data))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/plan', methods=['POST'])
+def plan():
+    handler = _route_handler()
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected an origin and a destination"}), 400
+        return jsonify(plan_routes(handler, data.get('origin'), data.get('destination'), data.get('inputs'),
+                                   data.get('k', 3), data.get('objective', 'cost')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _stream_batch(handler):
+    """Price many independent selection lists, one NDJSON line per item.
+
+    Lines are written as soon as each item is done; an item that fails only
+    gets an "error" line and the rest of the batch carries on. The whole
+    batch is priced against the workbook snapshot taken when it started,
+    even if a newer one is published meanwhile, and every line names its
+    version.
+    """
+    data = request.json
+    if not isinstance(data, list):
+        return jsonify({"error": "Expected a list of selection lists"}), 400
+    version = g.workbook.version
+
+    def generate():
+        for idx, selections in enumerate(data):
+            if not isinstance(selections, list):
+                line = {"index": idx, "error": "Expected a list of selections"}
+            else:
+                try:
+                    line = {"index": idx, "result": handler.calculate(selections)}
+                except Exception as e:
+                    line = {"index": idx, "error": str(e)}
+            line["workbook_version"] = version
+            yield app.json.dumps(line) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/calculate/batch', methods=['POST'])
+def calculate_batch():
+    return _stream_batch(_route_handler())
+
+def _submit_bulk(handler, kind):
+    """Save an uploaded selection file and queue it as a background job."""
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(BULK_EXTENSIONS):
+        return jsonify({"error": "Expected a .csv or .xlsx file"}), 400
+    filepath = os.path.join(UPLOAD_FOLDER, f"bulk_{kind}_{uuid.uuid4().hex}_{filename}")
+    _save_upload(file, filepath)
+    try:
+        job = bulk_jobs.submit(handler, filepath, kind, workbook_version=g.workbook.version)
+    except Exception as e:
+        os.remove(filepath)
+        return jsonify({"error": str(e)}), 400
+    return jsonify(job), 202
+
+@app.route('/api/bulk', methods=['POST'])
+def bulk_upload():
+    return _submit_bulk(_route_handler(), 'routes')
+
+@app.route('/api/bulk/<job_id>', methods=['GET'])
+def bulk_status(job_id):
+    job = bulk_jobs.status(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route('/api/bulk/<job_id>/result', methods=['GET'])
+def bulk_result(job_id):
+    path = bulk_jobs.result_path(job_id)
+    if path is None:
+        return jsonify({"error": "Result not ready"}), 404
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), as_attachment=True)
+
+@app.route('/healthz/live', methods=['GET'])
+def healthz_live():
+    return jsonify({"status": "alive"})
+
+@app.route('/healthz/ready', methods=['GET'])
+def healthz_ready():
+    """200 once the built-in workbooks are loaded in this process, 503 with
+    the load progress before that."""
+    status = warmup.status()
+    status["import_ms"] = IMPORT_SECONDS * 1000
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of all workers: request latency, calculate()
+    stages, match tiers, result caches and loaded models."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Result cache counters of the selected (default: built-in) workbooks."""
+    return jsonify({
+        "routes": _route_handler().result_cache.stats(),
+        "wh": _wh_handler().result_cache.stats(),
+    })
+
 # --- WH COST ROUTES ---
 
 @app.route('/api/wh/routes', methods=['GET'])
 def get_wh_routes():
+    handler = _wh_handler()
     try:
-        options = wh_handler.get_route_options()
+        options = handler.get_route_options()
         return jsonify(options)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/wh/fields', methods=['POST'])
 def get_wh_fields():
+    handler = _wh_handler()
     try:
         data = request.json
         node = data.get('node')
         location = data.get('location')
         inputs = data.get('inputs', {})
-        fields = wh_handler.get_node_fields(node, location, inputs)
+        fields = handler.get_node_fields(node, location, inputs)
         return jsonify(fields)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/wh/calculate', methods=['POST'])
 def calculate_wh():
+    handler = _wh_handler()
+    profile_this = _profile_requested()
     try:
         data = request.json
-        result = wh_handler.calculate(data)
+        result, profile = profiler.calculate(handler, data, profile_this)
+        result["workbook_version"] = g.workbook.version
+        if profile is not None:
+            result["profile"] = profile
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/wh/calculate/batch', methods=['POST'])
+def calculate_wh_batch():
+    return _stream_batch(_wh_handler())
+
+@app.route('/api/wh/bulk', methods=['POST'])
+def wh_bulk_upload():
+    return _submit_bulk(_wh_handler(), 'wh')
+
 @app.route('/api/wh/upload', methods=['POST'])
 def wh_upload_file():
-    global wh_handler
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-    if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, f"wh_{filename}")
-        file.save(filepath)
-        wh_handler = WHExcelHandler(filepath)
-        return jsonify({"message": f"Successfully loaded {filename}", "filename": filename})
+    return _upload_workbook(wh_models, 'wh_workbook_status', prefix='wh_')
 
 @app.route('/api/wh/load-builtin', methods=['POST'])
 def wh_load_builtin():
-    global wh_handler
-    wh_handler = WHExcelHandler(WH_DEFAULT_EXCEL)
-    return jsonify({"message": "Successfully loaded built-in WH workbook"})
+    workbook_id, _ = wh_models.register(WH_DEFAULT_EXCEL, pinned=True, default=True, wait=False)
+    status = wh_models.status(workbook_id)
+    status["message"] = "Successfully loaded built-in WH workbook"
+    return jsonify(status)
+
+@app.route('/api/wh/workbooks/<workbook_id>', methods=['GET'])
+def wh_workbook_status(workbook_id):
+    return _workbook_status(wh_models, workbook_id)
 
 @app.route('/api/wh/download-builtin', methods=['GET'])
 def wh_download_builtin():
@@ -169,4 +500,5 @@ def serve_static(path):
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
+    REGISTRY.clear()
     app.run(debug=False, port=port, host='0.0.0.0')
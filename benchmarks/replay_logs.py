@@ -0,0 +1,407 @@
+"""Replay the calculations recorded in the handler logs as a load test.
+
+    python benchmarks/replay_logs.py --concurrency 8 --requests 2000
+    python benchmarks/replay_logs.py --gunicorn --workers 4 --concurrency 16
+    python benchmarks/replay_logs.py --url http://127.0.0.1:5000 --out replay.json
+
+shipping_route_logs.txt and wh_cost_logs.txt (and their rotated backups)
+are parsed back into the /api/calculate and /api/wh/calculate payloads that
+produced them, in log order, together with the match tier each one went
+through (exact, partial, Truck times fallback, ...). The traces are then
+sent round robin by --concurrency threads to the app in this process
+(Flask test client, the default), to a gunicorn started here with the
+repo's gunicorn.conf.py, or to a server already running at --url.
+Throughput, latency percentiles and error counts are reported overall,
+per endpoint and per match tier.
+"""
+import argparse
+import ast
+import glob
+import http.client
+import itertools
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from run_benchmarks import percentile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+ROUTE_LOG = os.path.join(REPO_DIR, 'shipping_route_logs.txt')
+WH_LOG = os.path.join(REPO_DIR, 'wh_cost_logs.txt')
+ROUTE_ENDPOINT = '/api/calculate'
+WH_ENDPOINT = '/api/wh/calculate'
+
+LINE = re.compile(r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] (?:\[WH\] )?(.*)$')
+
+# Log lines that tell which match tier a section went through. A request is
+# tagged with the last tier any of its sections needed.
+ROUTE_TIERS = (
+    ('EXACT MATCH found', 'exact'),
+    ('PARTIAL MATCH found', 'partial'),
+    ('TRUCK TIMES FALLBACK MATCH found', 'truck_times'),
+    ('ERROR:', 'no_match'),
+)
+WH_TIERS = (
+    ('Exact match found', 'exact'),
+    ('Fallback match found', 'fallback'),
+    ('[ERROR]', 'no_match'),
+)
+TIER_ORDER = ('cached', 'exact', 'partial', 'fallback', 'truck_times', 'no_match')
+
+
+class Trace:
+    """One logged calculate() call: endpoint, selections and match tier."""
+
+    def __init__(self, time, endpoint, selections):
+        self.time = time
+        self.endpoint = endpoint
+        self.selections = selections
+        self.tier = None
+
+    def see_tier(self, tier):
+        if self.tier is None or TIER_ORDER.index(tier) > TIER_ORDER.index(self.tier):
+            self.tier = tier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--route-log', action='append', help=f"route calculation log (default {os.path.basename(ROUTE_LOG)} and its backups)")
+    parser.add_argument('--wh-log', action='append', help=f"WH calculation log (default {os.path.basename(WH_LOG)} and its backups)")
+    parser.add_argument('--only', choices=('routes', 'wh'), help="replay only one of the two logs")
+    parser.add_argument('--concurrency', type=int, default=4, help="requests in flight (default 4)")
+    parser.add_argument('--requests', type=int, help="requests to send, cycling over the traces (default: every trace once)")
+    parser.add_argument('--warmup', type=int, default=0, help="untimed requests sent first")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help="replay against a running server instead of the app in this process")
+    target.add_argument('--gunicorn', action='store_true', help="start gunicorn on a free local port and replay against it")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers with --gunicorn (default 2)")
+    parser.add_argument('--no-result-cache', action='store_true',
+                        help="turn the result cache off in the app under test (in-process and --gunicorn)")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'rate-replay'),
+                        help="working directory of the app under test, so its logs do not land in the replayed files")
+    parser.add_argument('--out', help="also write the report as JSON here")
+    args = parser.parse_args()
+    if args.out:
+        # The in-process app runs in the work directory
+        args.out = os.path.abspath(args.out)
+
+    traces = []
+    if args.only != 'wh':
+        traces += parse_route_log(log_files(args.route_log, ROUTE_LOG))
+    if args.only != 'routes':
+        traces += parse_wh_log(log_files(args.wh_log, WH_LOG))
+    traces.sort(key=lambda t: t.time)
+    if not traces:
+        parser.error("no calculations found in the logs")
+    sys.stderr.write(f"{len(traces)} traces: " + describe_mix(traces) + "\n")
+
+    os.makedirs(args.workdir, exist_ok=True)
+    if args.no_result_cache:
+        os.environ['RESULT_CACHE_SIZE'] = '0'
+    os.environ.setdefault('LOG_TO_STDOUT', '0')
+
+    server = None
+    if args.gunicorn:
+        server, url = start_gunicorn(args.workers, args.workdir)
+        send = http_sender(url)
+    elif args.url:
+        send = http_sender(args.url)
+    else:
+        send = app_sender(args.workdir)
+
+    try:
+        total = args.requests if args.requests is not None else len(traces)
+        if args.warmup:
+            replay(send, traces, args.warmup, args.concurrency)
+        report = replay(send, traces, total, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report["target"] = args.url or ('gunicorn' if args.gunicorn else 'in-process')
+    report["concurrency"] = args.concurrency
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=2, ensure_ascii=False) + '\n')
+
+
+def log_files(paths, default):
+    """The given logs, or the default log after its rotated backups (oldest first)."""
+    if paths:
+        return paths
+    backups = sorted(glob.glob(default + '.[0-9]*'), key=lambda p: int(p.rsplit('.', 1)[1]), reverse=True)
+    return backups + [default]
+
+
+def read_entries(paths):
+    """(time, message) per log record; continuation lines are joined to their record."""
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        current = None
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                m = LINE.match(line.rstrip('\r\n'))
+                if m:
+                    if current:
+                        yield current
+                    current = [m.group(1), m.group(2)]
+                elif current:
+                    current[1] += '\n' + line.rstrip('\r\n')
+        if current:
+            yield current
+
+
+def parse_route_log(paths):
+    traces = []
+    trace = None
+    pending = None
+    for stamp, msg in read_entries(paths):
+        if msg == 'CALCULATION START':
+            trace = Trace(stamp, ROUTE_ENDPOINT, [])
+            traces.append(trace)
+        elif msg.startswith('CALCULATION served from result cache: '):
+            selections = _literal(msg.split(': ', 1)[1])
+            if isinstance(selections, list):
+                trace = Trace(stamp, ROUTE_ENDPOINT, selections)
+                trace.see_tier('cached')
+                traces.append(trace)
+            trace = None
+        elif trace is None:
+            continue
+        elif msg.startswith('User Selection: '):
+            m = re.match(r'User Selection: Node=(.*?), Location=(.*)$', msg)
+            pending = {"node": m.group(1), "location": m.group(2)} if m else None
+        elif msg.startswith('User Inputs: ') and pending is not None:
+            inputs = _literal(msg[len('User Inputs: '):])
+            pending["inputs"] = inputs if isinstance(inputs, dict) else {}
+            trace.selections.append(pending)
+            pending = None
+        else:
+            for marker, tier in ROUTE_TIERS:
+                if msg.startswith(marker):
+                    trace.see_tier(tier)
+    return [t for t in traces if t.selections]
+
+
+def parse_wh_log(paths):
+    traces = []
+    trace = None
+    inputs = None
+    for stamp, msg in read_entries(paths):
+        msg = msg.strip()
+        if msg == 'WH CALCULATION START':
+            trace = Trace(stamp, WH_ENDPOINT, [])
+            traces.append(trace)
+        elif msg.startswith('WH CALCULATION served from result cache: '):
+            selections = _literal(msg.split(': ', 1)[1])
+            if isinstance(selections, list):
+                trace = Trace(stamp, WH_ENDPOINT, selections)
+                trace.see_tier('cached')
+                traces.append(trace)
+            trace = None
+        elif trace is None:
+            continue
+        elif msg.startswith('Attempting to match inputs: '):
+            inputs = _literal(msg[len('Attempting to match inputs: '):])
+        elif msg.startswith('Available rows for Node ') and inputs is not None:
+            # The node of a WH section is only logged after its inputs
+            node = msg[len('Available rows for Node '):].rsplit(':', 1)[0]
+            trace.selections.append({"node": node, "inputs": inputs if isinstance(inputs, dict) else {}})
+            inputs = None
+        else:
+            for marker, tier in WH_TIERS:
+                if marker in msg:
+                    trace.see_tier(tier)
+    return [t for t in traces if t.selections]
+
+
+def _literal(text):
+    try:
+        return ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError):
+        return None
+
+
+def describe_mix(traces):
+    counts = {}
+    for t in traces:
+        key = f"{t.endpoint} {t.tier or 'unknown'}"
+        counts[key] = counts.get(key, 0) + 1
+    return ", ".join(f"{n} {key}" for key, n in sorted(counts.items()))
+
+
+def app_sender(workdir):
+    """POST through the Flask test client of the app imported into this process."""
+    sys.path.insert(0, REPO_DIR)
+    # The handlers log to the working directory
+    os.chdir(workdir)
+    from app import app
+    local = threading.local()
+
+    def send(endpoint, payload):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        response = client.post(endpoint, json=payload)
+        return response.status_code, response.get_json(silent=True)
+    return send
+
+
+def http_sender(url):
+    """POST over HTTP with one keep-alive connection per thread."""
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', ''):
+        raise SystemExit(f"only http:// URLs are supported, got {url}")
+    host, port, base = parts.hostname or '127.0.0.1', parts.port or 80, parts.path.rstrip('/')
+    local = threading.local()
+
+    def send(endpoint, payload):
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        for attempt in (0, 1):
+            conn = getattr(local, 'conn', None)
+            if conn is None:
+                conn = local.conn = http.client.HTTPConnection(host, port, timeout=120)
+            try:
+                conn.request('POST', base + endpoint, body, headers)
+                response = conn.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    local.conn = None
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed the idle connection; retry once on a new one
+                conn.close()
+                local.conn = None
+                if attempt:
+                    raise
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+    return send
+
+
+def start_gunicorn(workers, workdir):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    cmd = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+           '--pythonpath', REPO_DIR, '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'app:app']
+    server = subprocess.Popen(cmd, cwd=workdir, env=dict(os.environ))
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/routes')
+            conn.getresponse().read()
+            conn.close()
+            sys.stderr.write(f"gunicorn ready on {url}\n")
+            return server, url
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("gunicorn did not start within 120 s")
+
+
+def replay(send, traces, total, concurrency):
+    """Send `total` requests from `traces` round robin, `concurrency` at a time."""
+    order = itertools.islice(itertools.cycle(traces), total)
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        while True:
+            with lock:
+                trace = next(order, None)
+            if trace is None:
+                return
+            start = time.perf_counter()
+            try:
+                status, body = send(trace.endpoint, trace.selections)
+                error = None if status == 200 else f"HTTP {status}"
+            except Exception as e:
+                body, error = None, f"{type(e).__name__}: {e}"
+            elapsed = (time.perf_counter() - start) * 1000
+            unmatched = _unmatched(trace, body) if error is None else 0
+            with lock:
+                samples.append((trace, elapsed, error, unmatched))
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    groups = {"all": samples}
+    for sample in samples:
+        trace = sample[0]
+        groups.setdefault(trace.endpoint, []).append(sample)
+        groups.setdefault(f"{trace.endpoint} {trace.tier or 'unknown'}", []).append(sample)
+    errors = {}
+    for _, _, error, _ in samples:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    return {
+        "requests": len(samples),
+        "seconds": wall,
+        "throughput_rps": len(samples) / wall if wall else 0.0,
+        "groups": {name: summarize(group, wall) for name, group in groups.items()},
+        "errors": errors,
+    }
+
+
+def _unmatched(trace, body):
+    """Sections of the request that came back without a priced result."""
+    if not isinstance(body, dict):
+        return len(trace.selections)
+    priced = sum(1 for res in body.get("node_results", []) if not res.get("error"))
+    return max(0, len(trace.selections) - priced)
+
+
+def summarize(samples, wall):
+    latencies = sorted(elapsed for _, elapsed, _, _ in samples)
+    return {
+        "n": len(samples),
+        "rps": len(samples) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.5),
+        "p90_ms": percentile(latencies, 0.9),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1],
+        "errors": sum(1 for _, _, error, _ in samples if error),
+        "error_rate": sum(1 for _, _, error, _ in samples if error) / len(samples),
+        "unmatched_sections": sum(unmatched for _, _, _, unmatched in samples),
+    }
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['seconds']:.2f} s against {report['target']}, "
+          f"concurrency {report['concurrency']}: {report['throughput_rps']:.1f} req/s")
+    print(f"{'group':34} {'n':>6} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7} {'unmatched':>9}")
+    for name, s in report["groups"].items():
+        print(f"{name:34} {s['n']:>6} {s['rps']:>8.1f} {s['p50_ms']:>8.2f} {s['p90_ms']:>8.2f} "
+              f"{s['p99_ms']:>8.2f} {s['max_ms']:>8.2f} {s['errors']:>7} {s['unmatched_sections']:>9}")
+    for error, n in sorted(report["errors"].items(), key=lambda item: -item[1]):
+        print(f"  {n} x {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""Load time, peak memory and request latency of both handlers on synthetic workbooks.
+
+    python benchmarks/run_benchmarks.py --sizes 100,1000,10000 --out bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json   # compare with an earlier run
+
+Every (handler, size) pair is measured in a fresh Python process with its
+own empty model cache, so the cold load really parses the xlsx and module
+import and earlier runs do not skew the numbers. The result cache is
+turned off there, so calculate() latencies are those of a cache miss.
+Results are written as JSON, one entry per pair.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+DEFAULT_SIZES = '100,1000,10000,100000'
+KINDS = ('routes', 'wh')
+# Metrics compared with --baseline; lower is better for all of them
+TRACKED = ('load_cold_ms', 'load_warm_ms', 'peak_mb',
+           'get_route_options.p50_ms', 'get_node_fields.p50_ms', 'get_node_fields.p99_ms',
+           'calculate.p50_ms', 'calculate.p99_ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f"data rows per workbook, comma separated (default {DEFAULT_SIZES})")
+    parser.add_argument('--kinds', default=','.join(KINDS), help="handlers to measure: routes, wh")
+    parser.add_argument('--requests', type=int, default=200, help="timed calls per operation (default 200)")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'rate-benchmarks'),
+                        help="where generated workbooks, model caches and logs go; workbooks are reused")
+    parser.add_argument('--out', help="write the results JSON here (default: stdout)")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--child', nargs=3, metavar=('KIND', 'WORKBOOK', 'REQUESTS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        kind, path, requests = args.child
+        print(json.dumps(measure(kind, path, int(requests))))
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for kind in [k.strip() for k in args.kinds.split(',') if k.strip()]:
+        if kind not in KINDS:
+            parser.error(f"unknown kind {kind}")
+        for rows in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            path = workbook_for(kind, rows, args.workdir)
+            sys.stderr.write(f"{kind} {rows} rows ... ")
+            sys.stderr.flush()
+            entry = run_child(kind, path, args.requests, args.workdir)
+            entry.update({"kind": kind, "rows": rows, "file_bytes": os.path.getsize(path)})
+            results.append(entry)
+            sys.stderr.write(f"load {entry['load_cold_ms']:.0f} ms, calculate p50 {entry['calculate']['p50_ms']:.3f} ms\n")
+
+    report = {"meta": meta(args.requests), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+def workbook_for(kind, rows, workdir):
+    from synthetic import make_route_workbook, make_wh_workbook
+    path = os.path.join(workdir, f"{kind}-{rows}.xlsx")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        (make_route_workbook if kind == 'routes' else make_wh_workbook)(path, rows)
+        sys.stderr.write(f"generated {os.path.basename(path)} in {time.perf_counter() - start:.1f} s\n")
+    return path
+
+
+def run_child(kind, path, requests, workdir):
+    cache_dir = tempfile.mkdtemp(prefix='model-cache-', dir=workdir)
+    env = dict(os.environ, MODEL_CACHE_DIR=cache_dir, LOG_TO_STDOUT='0', RESULT_CACHE_SIZE='0')
+    # Handler logs go to the working directory, keep them out of the repo
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', kind, path, str(requests)],
+                         cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.splitlines()[-1])
+
+
+def measure(kind, path, requests):
+    """Runs in the child process: load the workbook twice, then time the API calls."""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, os.path.join(REPO_DIR, 'WH Cost'))
+    if kind == 'routes':
+        from excel_handler import ExcelHandler as Handler
+    else:
+        from wh_excel_handler import WHExcelHandler as Handler
+    from log_pipeline import flush_logs
+
+    # Peak memory of the load is the growth of the process high-water mark
+    # (tracemalloc would slow the load down several times)
+    gc.collect()
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    handler = Handler(path)
+    load_cold = time.perf_counter() - start
+    peak = max_rss_mb() - rss_before
+    if handler.wb is None:
+        raise SystemExit(f"{path} did not load")
+
+    # Second handler reads the model cache the first one wrote
+    start = time.perf_counter()
+    handler = Handler(path)
+    load_warm = time.perf_counter() - start
+
+    rnd = random.Random(0)
+    options = timed(lambda: handler.get_route_options(), requests)
+    lanes = [(node, location) for node, info in handler.get_route_options().items() for location in info['locations']]
+    picks = [rnd.choice(lanes) for _ in range(requests)]
+    fields = timed(lambda i: handler.get_node_fields(*picks[i]), requests, indexed=True)
+    selections = [sample_selection(handler, kind, node, location, rnd) for node, location in picks]
+    calculate = timed(lambda i: handler.calculate([selections[i]]), requests, indexed=True)
+    # Sanity check that the sampled selections price: results without a cost
+    calculate["unpriced"] = sum(1 for sel in selections[:50]
+                                if not any(res.get("cost") for res in handler.calculate([sel])["node_results"]))
+    flush_logs()
+
+    return {
+        "load_cold_ms": load_cold * 1000,
+        "load_warm_ms": load_warm * 1000,
+        "peak_mb": peak,
+        "max_rss_mb": max_rss_mb(),
+        "lanes": len(lanes),
+        "get_route_options": options,
+        "get_node_fields": fields,
+        "calculate": calculate,
+    }
+
+
+def sample_selection(handler, kind, node, location, rnd):
+    """A calculate() section picking one row of the lane, with the quantity
+    inputs changed half of the time so the formula tier runs too."""
+    if kind == 'routes':
+        frm, to = [part.strip() for part in location.split('->')]
+        lane = handler.lane_costs[handler._get_sheet_for_node(node)][(node, frm, to)]
+        inputs = dict(rnd.choice(lane.options))
+        quantities = ('PALLET QTY', 'CBM', 'G/W')
+    else:
+        ws = handler.wb['WAHL WH fee']
+        row = rnd.choice(handler.get_route_options()[node]['details'])['excel_row']
+        inputs = {name: str(ws.value(row, c) or '').strip() for name, c, _ in handler.facet_index[node]['differentiators']}
+        for c, name in handler.schemas['WAHL WH fee'].input_cols:
+            if ws.value(row, c) is not None:
+                inputs[name] = str(ws.value(row, c))
+        quantities = ('pallet', 'CBM')
+    if rnd.random() < 0.5:
+        for name in quantities:
+            if name in inputs:
+                inputs[name] = str(rnd.randint(1, 50))
+    return {"node": node, "location": location, "inputs": inputs}
+
+
+def current_rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(fn, n, indexed=False):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i) if indexed else fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"n": n, "p50_ms": percentile(samples, 0.5), "p99_ms": percentile(samples, 0.99), "max_ms": samples[-1]}
+
+
+def percentile(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(round(q * (len(sorted_samples) - 1))))]
+
+
+def meta(requests):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    sys.path.insert(0, REPO_DIR)
+    from model_cache import ENGINE_VERSION
+    return {
+        "commit": commit,
+        "engine_version": ENGINE_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "requests": requests,
+    }
+
+
+def compare(baseline, report):
+    """Print each tracked metric next to the baseline's, as a ratio."""
+    old = {(entry["kind"], entry["rows"]): entry for entry in baseline.get("results", [])}
+    print(f"{'kind':6} {'rows':>7}  {'metric':26} {'baseline':>10} {'now':>10} {'ratio':>6}", file=sys.stderr)
+    for entry in report["results"]:
+        before = old.get((entry["kind"], entry["rows"]))
+        if before is None: continue
+        for metric in TRACKED:
+            a, b = lookup(before, metric), lookup(entry, metric)
+            if a is None or b is None: continue
+            ratio = b / a if a else float('inf')
+            print(f"{entry['kind']:6} {entry['rows']:>7}  {metric:26} {a:>10.3f} {b:>10.3f} {ratio:>6.2f}", file=sys.stderr)
+
+
+def lookup(entry, metric):
+    for key in metric.split('.'):
+        if not isinstance(entry, dict) or key not in entry:
+            return None
+        entry = entry[key]
+    return entry
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""Synthetic workbooks in the layouts of the built-in pricing workbooks.
+
+make_route_workbook() writes the WAHL-Customer, VENDOR-WAHL and WAHL-DGWA
+sheets of '5.shipping cost based on summary.xlsx' and make_wh_workbook()
+the 'WAHL WH fee' sheet of 'WH cost.xlsx', at any number of data rows:
+MAP/From/To headers, two-row records (rate text over values), SUM and
+product formulas, MIN rate text and green variable columns in row 1.
+
+The xlsx is written directly as SpreadsheetML, streamed row by row, so a
+100k row workbook takes seconds; formula cells carry their cached values
+like a workbook saved by Excel, which is what exact matches read.
+"""
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+
+GREEN = 'FF92D050'
+
+ROUTE_SHEETS = ('WAHL-Customer', 'VENDOR-WAHL', 'WAHL-DGWA')
+# Share of a route workbook's data rows per sheet
+ROUTE_SPLIT = (0.4, 0.4, 0.2)
+
+CUSTOMER_COSTS = ['TRUCK FEE', 'HK Custom clearance fee', 'DOC/SET', 'HANDING/SET', 'THC', 'Seal fee/SET',
+                  'Security fee/SET', 'VGM/SET', 'OCEAN FEE', 'Destination THC ', 'port charge/SET', '递送费/SET']
+VENDOR_COSTS = ['Original Pick up cost/SET', 'OCEAN FEE/CBM', 'CFS/CBM', 'THC/KG', 'Destination truck fee',
+                'Other fee/SET', 'HK custom clearance fee/SET']
+DGWA_CAPACITIES = ['3T', '8T', '10T', '12T', '20GP', '40GP', '45HQ']
+DGWA_BASE = {'Single': [1850, 2400, 2400, 2600, 3350, 3450, 3450], 'Round': [2750, 3650, 3650, 3950, 4750, 4950, 4950]}
+DGWA_SURCHARGE = 650
+
+WH_HEADERS = ['Own', 'From', 'To', 'Method', 'Import Truck times', 'Export Truck times', '测试', 'WH type', 'pallet',
+              'CBM', 'TOTAL Cost(HKD)', 'Month Qty', 'total invoice value (RMB)', 'HK3PL RM storage fee /Month',
+              'HK3PL FG storage fee /Month', 'Humen bonded storage fee /Month', 'import customs declaration fee',
+              'Export customs declaration fee', 'in&out handling fee', 'loading fee', 'unloading fee',
+              'inbound ruck fee', 'outbound truck fee', '测试收费类型', 'transp.insurance fee',
+              'w/h storage insurance ']
+WH_RATES = ['65000HKD/Month', '60HKD/CBM/WEEK', '2.3RMB/CBM/day', '350 RMB/time', '350 RMB/time', '30 RMB/pallet',
+            '25 RMB/pallet', '25 RMB/pallet', '900/time', '1700/time', None, '0.1% of cargos value invoice value',
+            '0.6% of cargos value']
+# Routes of the WH sheet; its nodes are lettered A, B, ... per route
+WH_ROUTES = 20
+
+
+def make_route_workbook(path, rows, seed=0):
+    """Write a route workbook with about `rows` data rows over its three sheets."""
+    rnd = random.Random(seed)
+    counts = [max(2, int(rows * share)) for share in ROUTE_SPLIT]
+    sheets = [
+        ('WAHL-Customer', _lane_sheet(rnd, counts[0], 'customer')),
+        ('VENDOR-WAHL', _lane_sheet(rnd, counts[1], 'vendor')),
+        ('WAHL-DGWA', _dgwa_sheet(rnd, counts[2])),
+    ]
+    _write_xlsx(path, sheets)
+
+
+def make_wh_workbook(path, rows, seed=0):
+    """Write a WH workbook whose fee sheet has `rows` data rows."""
+    _write_xlsx(path, [('WAHL WH fee', _wh_sheet(random.Random(seed), rows))])
+
+
+# --- sheets: each yields (row number, [(col, value, formula, style)]) ---
+
+def _lane_sheet(rnd, rows, layout):
+    if layout == 'customer':
+        fields = ['INCOTERMS', 'Truck size', 'CBM', 'PALLET QTY', 'G/W', 'Method', 'SUMMARY']
+        costs, nodes = CUSTOMER_COSTS, 'ABCD'
+    else:
+        fields = ['INCOTERMS', 'Truck size', 'CBM', 'G/W', '测试', 'Method', 'SUMMARY']
+        costs, nodes = VENDOR_COSTS, 'FGH'
+    headers = ['Own', 'From', 'To'] + fields + ['MAP', 'E2E Cost', 'E2E Lead Time'] + costs
+    col = {title: i + 1 for i, title in enumerate(headers)}
+    first_cost = col[costs[0]]
+    last_cost = first_cost + len(costs) - 1
+    green = {first_cost, first_cost + 1, first_cost + 4}
+
+    yield 1, [(c, i + 1, None, 'green' if c in green else None) for i, c in enumerate(range(first_cost, last_cost + 1))]
+    yield 2, [(c, title, None, None) for c, title in enumerate(headers, 1)]
+
+    r = 3
+    lane = 0
+    while r < rows + 3:
+        node = nodes[lane % len(nodes)]
+        if layout == 'customer':
+            frm, to = ('WADG', 'WAHL')[lane % 2], f'Customer {lane}'
+        else:
+            frm, to = f'Origin {lane}', 'WAHL'
+        lt_min = rnd.randint(1, 40)
+        lt = f'{lt_min}-{lt_min + rnd.randint(0, 7)}Days'
+        for option in _lane_options(rnd, layout):
+            if r >= rows + 3: break
+            top = {col['Own']: 'WAHL', col['From']: frm, col['To']: to, col['MAP']: node,
+                   col['E2E Lead Time']: 'Standard'}
+            bottom = {col['E2E Lead Time']: lt}
+            for title, value in option['fields'].items():
+                top[col[title]] = value
+            cost_cells = _cost_cells(rnd, layout, option, col, first_cost, last_cost, r)
+            total = 0.0
+            row_cells = [(c, v, None, None) for c, v in top.items()]
+            bottom_cells = [(c, v, None, None) for c, v in bottom.items()]
+            for c, (rate, value, formula) in cost_cells.items():
+                if rate is not None:
+                    row_cells.append((c, rate, None, None))
+                bottom_cells.append((c, value, formula, None))
+                total += value
+            sum_range = f'{get_column_letter(first_cost)}{r + 1}:{get_column_letter(last_cost)}{r + 1}'
+            row_cells.append((col['E2E Cost'], round(total, 4), f'SUM({sum_range})', None))
+            yield r, row_cells
+            yield r + 1, bottom_cells
+            r += 2
+        lane += 1
+
+
+def _lane_options(rnd, layout):
+    """Options of one lane: two FCL container sizes and two quantity-priced ones."""
+    incoterms = rnd.choice(['DAP', 'CIF', 'EXW', 'FOB'])
+    options = []
+    for size in ('20GP', '40GP'):
+        fields = {'INCOTERMS': incoterms, 'Truck size': size, 'CBM': 'N/A', 'G/W': 'N/A', 'Method': 'FCL', 'SUMMARY': 'A'}
+        if layout == 'customer':
+            fields['PALLET QTY'] = 'N/A'
+        else:
+            fields['测试'] = f'内容{rnd.randint(1, 9)}'
+        options.append({'fcl': True, 'fields': fields})
+    for summary in ('A', 'B'):
+        cbm = round(rnd.uniform(1, 30), 1)
+        gw = rnd.randint(100, 5000)
+        fields = {'INCOTERMS': incoterms, 'Truck size': 'N/A', 'CBM': cbm, 'G/W': gw,
+                  'Method': 'LCL' if summary == 'A' else 'AIR', 'SUMMARY': summary}
+        if layout == 'customer':
+            fields['PALLET QTY'] = rnd.randint(1, 30)
+        else:
+            fields['测试'] = f'内容{rnd.randint(1, 9)}'
+        options.append({'fcl': False, 'fields': fields})
+    return options
+
+
+def _cost_cells(rnd, layout, option, col, first_cost, last_cost, r):
+    """{col: (rate text of the top row, value, formula of the bottom row)}."""
+    cells = {}
+    fields = option['fields']
+    for c in range(first_cost, last_cost + 1):
+        if rnd.random() < 0.3:
+            continue
+        if option['fcl'] or c - first_cost >= 3:
+            amount = round(rnd.uniform(50, 5000), 1)
+            cells[c] = (f'{amount}HKD/SET', amount, None)
+        elif c == first_cost:
+            # MIN rate text priced on the quantity inputs
+            rate, minimum = rnd.randint(20, 150), rnd.randint(200, 900)
+            if layout == 'customer':
+                value = max(rate * fields['PALLET QTY'], minimum)
+                cells[c] = (f'{rate}HKD/PALLET,MIN {minimum}HKD', value, None)
+            else:
+                value = max(rate * 7.8 * fields['CBM'], minimum)
+                cells[c] = (f'{rate}USD/CBM,MIN {minimum}USD', value, None)
+        elif c == first_cost + 1 and layout == 'vendor':
+            rate, minimum = round(rnd.uniform(0.2, 1), 2), rnd.randint(300, 900)
+            cells[c] = (f'{rate}HKD/KG,Min {minimum}HKD', max(rate * fields['G/W'], minimum), None)
+        else:
+            # Product formula on an input of the record's top row
+            rate = rnd.randint(5, 300)
+            field = 'PALLET QTY' if layout == 'customer' else 'CBM'
+            ref = f'{get_column_letter(col[field])}{r}'
+            cells[c] = (f'{rate}HKD/{field}', rate * fields[field], f'{rate}*{ref}')
+    return cells
+
+
+def _dgwa_sheet(rnd, rows):
+    headers = ['Own', 'From', 'To', 'Truck times', 'Method', 'Capacity', 'Trip', 'SUMMARY', 'MAP', 'E2E Cost',
+               'E2E Lead Time'] + DGWA_CAPACITIES + ['附加费用']
+    cap_col = {cap: 12 + i for i, cap in enumerate(DGWA_CAPACITIES)}
+    surcharge_col = 12 + len(DGWA_CAPACITIES)
+    rate_row = {'Single': 3, 'Round': 4}
+
+    yield 2, [(c, title, None, None) for c, title in enumerate(headers, 1)]
+    for trip, r in rate_row.items():
+        cells = [(1, f'Standard-{trip} Trip', None, None), (11, '1Day', None, None),
+                 (surcharge_col, DGWA_SURCHARGE, None, None)]
+        for cap, c in cap_col.items():
+            cells.append((c, DGWA_BASE[trip][c - 12] + DGWA_SURCHARGE, f'{DGWA_BASE[trip][c - 12]}+{get_column_letter(surcharge_col)}{r}', None))
+        yield r, cells
+
+    lanes = [('WADG', 'WAHL'), ('WAHL', 'WADG')]
+    per_lane = len(DGWA_CAPACITIES) * 2
+    while len(lanes) * per_lane < rows:
+        lanes.append((f'Depot {len(lanes) - 1}', 'WAHL'))
+    r = 5
+    for frm, to in lanes:
+        for trip in ('Single', 'Round'):
+            for cap in DGWA_CAPACITIES:
+                if r >= rows + 5: return
+                times = rnd.choice([1, 2, 4, 8, 10])
+                price = DGWA_BASE[trip][cap_col[cap] - 12] + DGWA_SURCHARGE
+                cells = [(1, 'WAHL', None, None), (2, frm, None, None), (3, to, None, None), (4, times, None, None),
+                         (5, 'Truck', None, None), (6, cap, None, None), (7, trip, None, None), (8, 'C', None, None),
+                         (9, 'E', None, None), (11, '1Day', None, None),
+                         (10, times * price, f'D{r}*{get_column_letter(cap_col[cap])}{r}', None)]
+                for c in cap_col.values():
+                    base = DGWA_BASE[trip][c - 12] + DGWA_SURCHARGE
+                    cells.append((c, base, f'{get_column_letter(c)}{rate_row[trip]}', None))
+                yield r, cells
+                r += 1
+
+
+def _wh_sheet(rnd, rows):
+    col = {title: i + 1 for i, title in enumerate(WH_HEADERS)}
+    first_cost = col['HK3PL RM storage fee /Month']
+    yield 1, [(c, i + 1, None, None) for i, c in enumerate(range(first_cost, len(WH_HEADERS) + 1))
+              if WH_HEADERS[c - 1] != '测试收费类型']
+    yield 2, [(c, title, None, None) for c, title in enumerate(WH_HEADERS, 1)]
+    yield 3, [(1, 'Standard', None, None)] + [(first_cost + i, rate, None, None) for i, rate in enumerate(WH_RATES) if rate]
+
+    routes = [('WADG', 'Humen')] + [(f'Site {i}', f'Warehouse {i}') for i in range(1, WH_ROUTES)]
+    routes = routes[:max(1, min(WH_ROUTES, rows // 50))]
+    letter = {title: get_column_letter(c) for title, c in col.items()}
+    for i in range(rows):
+        r = i + 4
+        frm, to = routes[i % len(routes)]
+        v = {
+            'Own': rnd.choice(['WAHL', 'Customer']), 'From': frm, 'To': to, 'Method': 'WH Service',
+            'Import Truck times': rnd.randint(1, 10), 'Export Truck times': rnd.randint(1, 10),
+            '测试': rnd.randint(100, 999), 'WH type': rnd.choice(['Import', 'Export']),
+            'pallet': rnd.randint(1, 400), 'CBM': round(rnd.uniform(10, 500), 1), 'Month Qty': rnd.randint(1, 12),
+            'total invoice value (RMB)': round(rnd.uniform(1e5, 3e7), 2),
+        }
+        cells = [(col[title], value, None, None) for title, value in v.items()]
+        items = {
+            'Humen bonded storage fee /Month': (v['CBM'] * 2.3 * 30, f"{letter['CBM']}{r}*2.3*30"),
+            'import customs declaration fee': (350 * v['Import Truck times'], f"350*{letter['Import Truck times']}{r}"),
+            'Export customs declaration fee': (350 * v['Export Truck times'], f"350*{letter['Export Truck times']}{r}"),
+            'in&out handling fee': (30 * v['pallet'], f"30*{letter['pallet']}{r}"),
+            'loading fee': (25 * v['pallet'], f"25*{letter['pallet']}{r}"),
+            'unloading fee': (25 * v['pallet'], f"25*{letter['pallet']}{r}"),
+            'inbound ruck fee': (900 * v['Import Truck times'], f"900*{letter['Import Truck times']}{r}"),
+            'outbound truck fee': (1700 * v['Export Truck times'], f"1700*{letter['Export Truck times']}{r}"),
+            '测试收费类型': (100, None),
+            'transp.insurance fee': (0.001 * v['total invoice value (RMB)'], f"0.001*{letter['total invoice value (RMB)']}{r}"),
+            'w/h storage insurance ': (0.006 * v['total invoice value (RMB)'], f"0.006*{letter['total invoice value (RMB)']}{r}"),
+        }
+        for title, (value, formula) in items.items():
+            cells.append((col[title], value, formula, None))
+        summed = sum(value for title, (value, _) in items.items() if title != 'Humen bonded storage fee /Month')
+        total = (summed + v['Month Qty'] * items['Humen bonded storage fee /Month'][0]) * 1.1
+        first, last = letter['import customs declaration fee'], letter['w/h storage insurance ']
+        cells.append((col['TOTAL Cost(HKD)'], total,
+                      f"(SUM({first}{r}:{last}{r})+{letter['Month Qty']}{r}*{letter['Humen bonded storage fee /Month']}{r})*1.1", None))
+        yield r, cells
+
+
+# --- SpreadsheetML writer ---
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+{sheets}</Types>'''
+SHEET_TYPE = '<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>\n'
+ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>{sheets}</sheets>
+</workbook>'''
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+{sheets}<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+# Style 1 is the green fill of variable cost columns
+STYLES = f'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>
+<fill><patternFill patternType="solid"><fgColor rgb="{GREEN}"/><bgColor indexed="64"/></patternFill></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="0" fillId="2" borderId="0" xfId="0" applyFill="1"/></cellXfs>
+</styleSheet>'''
+STYLE_IDS = {None: None, 'green': 1}
+
+
+def _write_xlsx(path, sheets):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        n = len(sheets)
+        zf.writestr('[Content_Types].xml', CONTENT_TYPES.format(sheets=''.join(SHEET_TYPE.format(i=i) for i in range(1, n + 1))))
+        zf.writestr('_rels/.rels', ROOT_RELS)
+        zf.writestr('xl/workbook.xml', WORKBOOK.format(sheets=''.join(
+            f'<sheet name="{escape(title)}" sheetId="{i}" r:id="rId{i}"/>' for i, (title, _) in enumerate(sheets, 1))))
+        zf.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS.format(sheets=''.join(
+            f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{i}.xml"/>\n' for i in range(1, n + 1))))
+        zf.writestr('xl/styles.xml', STYLES)
+        for i, (title, rows) in enumerate(sheets, 1):
+            with zf.open(f'xl/worksheets/sheet{i}.xml', 'w') as fh:
+                _write_sheet(fh, rows)
+
+
+def _write_sheet(fh, rows):
+    fh.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+             b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    merges = []
+    buf = []
+    prev_top = None
+    for r, cells in rows:
+        buf.append(f'<row r="{r}">')
+        for c, value, formula, style in sorted(cells, key=lambda cell: cell[0]):
+            buf.append(_cell_xml(f'{get_column_letter(c)}{r}', value, formula, STYLE_IDS[style]))
+        buf.append('</row>')
+        # Two-row records keep their key columns merged like the real sheets
+        if prev_top is not None and r == prev_top + 1 and 1 not in {cell[0] for cell in cells}:
+            merges.append(f'A{prev_top}:A{r}')
+        prev_top = r if any(cell[0] == 1 for cell in cells) else None
+        if len(buf) > 4096:
+            fh.write(''.join(buf).encode('utf-8'))
+            buf = []
+    buf.append('</sheetData>')
+    if merges:
+        buf.append(f'<mergeCells count="{len(merges)}">')
+        buf.extend(f'<mergeCell ref="{ref}"/>' for ref in merges)
+        buf.append('</mergeCells>')
+    buf.append('</worksheet>')
+    fh.write(''.join(buf).encode('utf-8'))
+
+
+def _cell_xml(ref, value, formula, style):
+    s = f' s="{style}"' if style is not None else ''
+    if formula is not None:
+        return f'<c r="{ref}"{s}><f>{escape(formula)}</f><v>{value!r}</v></c>'
+    if isinstance(value, str):
+        return f'<c r="{ref}"{s} t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+    return f'<c r="{ref}"{s}><v>{value!r}</v></c>'
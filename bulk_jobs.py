@@ -0,0 +1,280 @@
+import csv
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Columns of an uploaded selection file; every other column is an input
+QUOTE_COLUMN = 'quote'
+NODE_COLUMN = 'node'
+LOCATION_COLUMN = 'location'
+
+RESULT_HEADERS = ['Quote', 'Node', 'Location', 'Cost', 'LT', 'Error', 'Quote Total Cost', 'Quote Total LT']
+
+JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+# Running jobs write their progress for the other workers at most this often
+PROGRESS_INTERVAL = 1.0
+
+
+def _iter_rows(path):
+    """Rows of a CSV/XLSX as lists, read as they are needed."""
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.reader(f)
+    else:
+        from openpyxl import load_workbook
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            for row in wb.worksheets[0].iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            wb.close()
+
+
+def _selection_rows(path):
+    """(row number, quote id, selection) of every non-empty row of a file."""
+    rows = _iter_rows(path)
+    try:
+        first = next(rows, None)
+        if first is None:
+            raise ValueError("The file is empty")
+        headers = [str(h).strip() if h is not None else '' for h in first]
+        lower = [h.lower() for h in headers]
+        if NODE_COLUMN not in lower:
+            raise ValueError("Missing 'node' column")
+        node_idx = lower.index(NODE_COLUMN)
+        location_idx = lower.index(LOCATION_COLUMN) if LOCATION_COLUMN in lower else None
+        quote_idx = lower.index(QUOTE_COLUMN) if QUOTE_COLUMN in lower else None
+        input_cols = [(i, h) for i, h in enumerate(headers) if h and i not in (node_idx, location_idx, quote_idx)]
+
+        for n, row in enumerate(rows, start=2):
+            row = list(row) + [None] * (len(headers) - len(row))
+            if all(v is None or str(v).strip() == '' for v in row):
+                continue
+            quote_id = str(row[quote_idx]).strip() if quote_idx is not None and row[quote_idx] is not None else str(n)
+            sel = {
+                'node': _text(row[node_idx]),
+                'location': _text(row[location_idx]) if location_idx is not None else None,
+                'inputs': {h: _text(row[i]) for i, h in input_cols if _text(row[i])},
+            }
+            yield n, quote_id, sel
+    finally:
+        rows.close()
+
+
+def scan_selection_file(path):
+    """Check a selection file and return {quote id: row number of its last row}.
+
+    Only the quote ids are kept, so a file of any length is checked in
+    constant memory per quote.
+    """
+    last_rows = {}
+    for n, quote_id, _ in _selection_rows(path):
+        last_rows[quote_id] = n
+    return last_rows
+
+
+def iter_selection_file(path, last_rows):
+    """Yield the (quote id, selections) of a CSV/XLSX of selections.
+
+    One row is one selection (node, location, inputs). Rows with the same
+    value in the optional 'quote' column are priced together as one
+    selection list; without that column every row is its own quote. A
+    quote is yielded at its last row (`last_rows` is what
+    scan_selection_file() returned), so only quotes with rows still to
+    come are held in memory.
+    """
+    pending = {}
+    for n, quote_id, sel in _selection_rows(path):
+        pending.setdefault(quote_id, []).append(sel)
+        if last_rows.get(quote_id) == n:
+            yield quote_id, pending.pop(quote_id)
+
+
+def read_selection_file(path):
+    """Read a CSV/XLSX of selections into a list of (quote id, selections)."""
+    return list(iter_selection_file(path, scan_selection_file(path)))
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+class BulkJobManager:
+    """Runs uploaded selection files through a handler in a background thread.
+
+    A job runs in the process that accepted the upload, which writes its
+    state to `<job id>.json` in `results_dir`; that directory is shared by
+    the gunicorn workers, so any of them answers status and result
+    requests. The input file is deleted once the job has read it, and the
+    results workbook (written with openpyxl's write-only mode, row by row)
+    and state of a job are deleted `keep_seconds` after it last changed.
+    """
+
+    def __init__(self, results_dir, max_workers=1, keep_seconds=24 * 3600):
+        self.results_dir = results_dir
+        self.keep_seconds = keep_seconds
+        os.makedirs(results_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bulk-quote')
+        self.jobs = {}  # jobs of this process that are not finished
+        self.lock = threading.Lock()
+
+    def submit(self, handler, input_path, kind, workbook_version=None):
+        """Check the file, queue the job and return its status right away.
+
+        The job owns `input_path` from here on; raises ValueError (and
+        leaves the file to the caller) if it is not a selection file.
+        """
+        self.expire()
+        last_rows = scan_selection_file(input_path)
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "workbook_version": workbook_version,
+            "status": "queued",
+            "total": len(last_rows),
+            "done": 0,
+            "errors": 0,
+            "created": time.time(),
+            "finished": None,
+            "error": None,
+            "input_path": input_path,
+            "result_path": os.path.join(self.results_dir, f"{kind}_{job_id}.xlsx"),
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+        self._save(job)
+        self.executor.submit(self._run, job, handler, last_rows)
+        return self.status(job_id)
+
+    def status(self, job_id):
+        job = self._job(job_id)
+        if job is None:
+            return None
+        status = {k: v for k, v in job.items() if k not in ('input_path', 'result_path')}
+        status["progress"] = status["done"] / status["total"] if status["total"] else 1.0
+        return status
+
+    def result_path(self, job_id):
+        job = self._job(job_id)
+        if job is None or job["status"] != "done" or not os.path.exists(job["result_path"]):
+            return None
+        return job["result_path"]
+
+    def expire(self):
+        """Delete the state and files of jobs that have not changed for keep_seconds."""
+        cutoff = time.time() - self.keep_seconds
+        with self.lock:
+            running = set(self.jobs)
+        for name in os.listdir(self.results_dir):
+            job_id, ext = os.path.splitext(name)
+            if ext != '.json' or job_id in running:
+                continue
+            state_path = os.path.join(self.results_dir, name)
+            try:
+                if os.stat(state_path).st_mtime >= cutoff:
+                    continue
+                with open(state_path, encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for path in (job.get("input_path"), job.get("result_path"), state_path):
+                if path:
+                    _remove(path)
+
+    def _job(self, job_id):
+        if not JOB_ID_RE.fullmatch(job_id):
+            return None
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        try:
+            with open(self._state_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _state_path(self, job_id):
+        return os.path.join(self.results_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        state = dict(job)
+        path = self._state_path(job["id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def _run(self, job, handler, last_rows):
+        job["status"] = "running"
+        self._save(job)
+        saved = time.monotonic()
+        try:
+            from openpyxl import Workbook
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet('Results')
+            ws.append(RESULT_HEADERS)
+            for quote_id, selections in iter_selection_file(job["input_path"], last_rows):
+                try:
+                    result = handler.calculate(selections)
+                    if not self._append_result(ws, quote_id, selections, result):
+                        job["errors"] += 1
+                except Exception as e:
+                    job["errors"] += 1
+                    ws.append([quote_id, None, None, None, None, str(e), None, None])
+                job["done"] += 1
+                if time.monotonic() - saved >= PROGRESS_INTERVAL:
+                    self._save(job)
+                    saved = time.monotonic()
+            wb.save(job["result_path"])
+            outcome = {"status": "done"}
+        except Exception as e:
+            outcome = {"status": "failed", "error": str(e)}
+            traceback.print_exc()
+        _remove(job["input_path"])
+        # The state file has the outcome before this process stops
+        # answering from memory, so no status lookup misses it
+        self._save(dict(job, finished=time.time(), **outcome))
+        with self.lock:
+            del self.jobs[job["id"]]
+
+    def _append_result(self, ws, quote_id, selections, result):
+        """Write one row per node result; returns False if the quote had errors."""
+        total_cost = result.get("total_cost")
+        total_lt = result.get("total_lt")
+        node_results = result.get("node_results", [])
+        if not node_results:
+            ws.append([quote_id, None, None, None, None, "No result", total_cost, total_lt])
+            return False
+        locations = {sel.get('node'): sel.get('location') for sel in selections}
+        for res in node_results:
+            ws.append([
+                quote_id,
+                res.get("node"),
+                locations.get(res.get("node")),
+                res.get("cost"),
+                res.get("lt"),
+                res.get("error"),
+                total_cost,
+                total_lt,
+            ])
+        return not any(res.get("error") for res in node_results)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,229 @@
+import numpy as np
+
+# Numeric inputs a sweep can vary; partial matching ignores exactly these,
+# so the matched row and its formula are the same for every grid point
+SWEEP_FIELDS = ('PALLET QTY', 'CBM', 'G/W')
+MAX_POINTS = 20000
+
+
+def sweep_costs(handler, selection, ranges):
+    """Cost grid of one lane over ranges of PALLET QTY / CBM / G/W.
+
+    `selection` is a calculate() section (node, location, inputs) and
+    `ranges` maps a sweep field to a list of values or to
+    {"start", "stop", "step"} (stop included). Gives the same cost per
+    point as calculate() would, but the match and formula setup run once
+    and the matched row's formula and MIN rules are evaluated for the whole
+    grid in one NumPy pass. Raises ValueError for an invalid request.
+    """
+    node = selection.get('node')
+    location = selection.get('location')
+    inputs = dict(selection.get('inputs') or {})
+    if not node or not location or '->' not in location:
+        raise ValueError("Missing node or location")
+
+    axes = _build_axes(ranges)
+    fields = [field for field, _ in axes]
+    shape = tuple(len(values) for _, values in axes)
+    size = int(np.prod(shape))
+    if size > MAX_POINTS:
+        raise ValueError(f"Sweep has {size} points, the limit is {MAX_POINTS}")
+    mesh = np.meshgrid(*[values for _, values in axes], indexing='ij')
+    grid = {field: m.ravel() for field, m in zip(fields, mesh)}
+    for field in fields:
+        inputs[field] = ''
+
+    sheet_name = handler._get_sheet_for_node(node)
+    if not sheet_name:
+        raise ValueError(f"No sheet found for node {node}")
+    ws = handler.wb[sheet_name]
+    formulas = handler.compiled_formulas.get(sheet_name, {})
+    schema = handler.schemas[sheet_name]
+    header_row = schema.header_row
+    frm_target, to_target = [s.strip() for s in location.split('->')]
+    candidates = handler.lane_index.get(sheet_name, {}).get("lanes", {}).get((node, frm_target, to_target), [])
+    handler._log(f"SWEEP {node} {location}: {size} points over {fields}, candidate rows {[rec.row for rec in candidates]}")
+
+    # Exact matches depend on the swept values: mark each point with the
+    # first candidate whose cached cost calculate() would return there
+    cost = np.zeros(size)
+    tier = np.full(size, 'none', dtype=object)
+    exact_rows = []
+    fixed_inputs = {k: v for k, v in inputs.items() if k not in grid}
+    for rec in candidates:
+        mask = _exact_mask(handler, ws, schema, rec, fixed_inputs, axes) & (tier == 'none')
+        if mask.any():
+            row_cost = handler._extract_data_from_row(ws, formulas, sheet_name, rec.row, header_row, fixed_inputs)[0]
+            cost[mask] = handler._to_number(row_cost)
+            tier[mask] = 'exact'
+            exact_rows.append(rec.row)
+
+    # Every other point uses the partial (or Truck times fallback) row
+    formula_row = None
+    for rec in candidates:
+        if handler._row_matches_partial(schema, rec, inputs):
+            formula_row = rec.row
+            break
+    if formula_row is None and sheet_name == 'WAHL-DGWA':
+        for rec in candidates:
+            if handler._row_matches_except_truck_times(schema, rec, inputs):
+                formula_row = rec.row
+                break
+
+    breakpoints = []
+    rest = tier == 'none'
+    if formula_row is not None and rest.any():
+        formula_cost, breakpoints = _formula_cost(handler, ws, formulas, sheet_name, formula_row,
+                                                  header_row, inputs, grid, size)
+        cost[rest] = formula_cost[rest]
+        tier[rest] = 'formula'
+
+    result = {
+        "node": node,
+        "location": location,
+        "axes": [{"field": field, "values": values.tolist()} for field, values in axes],
+        "cost": cost.reshape(shape).tolist(),
+        "tier": tier.reshape(shape).tolist(),
+        "exact_rows": exact_rows,
+        "formula_row": formula_row,
+        "breakpoints": breakpoints,
+    }
+    if rest.any() and formula_row is None:
+        result["error"] = f"未找到匹配: {frm_target} -> {to_target}"
+    return result
+
+
+def _build_axes(ranges):
+    if not isinstance(ranges, dict) or not ranges:
+        raise ValueError("Expected ranges for at least one of " + ", ".join(SWEEP_FIELDS))
+    axes = []
+    for field, spec in ranges.items():
+        if field not in SWEEP_FIELDS:
+            raise ValueError(f"Cannot sweep '{field}', expected one of " + ", ".join(SWEEP_FIELDS))
+        try:
+            if isinstance(spec, dict):
+                start, stop = float(spec['start']), float(spec['stop'])
+                step = float(spec.get('step', 1))
+                if step <= 0 or stop < start:
+                    raise ValueError
+                values = np.arange(start, stop + step / 2, step)
+            else:
+                values = np.array([float(v) for v in spec])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Invalid range for '{field}'")
+        if not len(values):
+            raise ValueError(f"Empty range for '{field}'")
+        # Drop float noise from arange so values print like user input
+        axes.append((field, np.round(values, 10)))
+    return axes
+
+
+def _format_input(value):
+    # How a client sends the number, which is what exact matching compares
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _exact_mask(handler, ws, schema, record, fixed_inputs, axes):
+    mask = np.ones(tuple(len(values) for _, values in axes), dtype=bool)
+    if not handler._row_matches_exact(ws, schema, record, fixed_inputs):
+        return np.zeros(mask.size, dtype=bool)
+    header_cols = schema.header_cols
+    field_pos = schema.input_pos
+    for i, (field, values) in enumerate(axes):
+        col = header_cols.get(field)
+        if not col:
+            continue
+        pos = field_pos.get(field)
+        row_val = record.fields[pos] if pos is not None else handler._merged_value(ws, record.row, col)
+        hits = np.array([str(row_val).strip() == _format_input(v) for v in values])
+        mask &= hits.reshape([-1 if j == i else 1 for j in range(len(axes))])
+    return mask.ravel()
+
+
+def _formula_cost(handler, ws, formulas, sheet_name, row, header_row, inputs, grid, size):
+    """Vector form of ExcelHandler._calculate_with_formula's total cost."""
+    e2e_cost_col = handler.schemas[sheet_name].col('E2E Cost')
+    compiled = formulas.get((row, e2e_cost_col))
+    formula = compiled.source if compiled else None
+    total = np.zeros(size)
+    breakpoints = []
+
+    if formula and formula.startswith('=SUM'):
+        if compiled.ranges:
+            start_row, start_col, end_row, end_col = compiled.ranges[0]
+            for c in range(start_col, end_col + 1):
+                row1_val = ws.value(row, c)
+                row2_val = ws.value(row + 1, c)
+                if row1_val and 'MIN' in str(row1_val).upper():
+                    rule = handler._parse_min_rule(row1_val, sheet_name)
+                    if rule is None:
+                        continue
+                    base_rate, factor, field, min_val = rule
+                    total += np.maximum(base_rate * factor * _min_driver(field, inputs, grid), min_val)
+                    rate = base_rate * factor
+                    breakpoints.append({
+                        "column": ws.value(header_row, c),
+                        "field": field,
+                        "rate": rate,
+                        "min": min_val,
+                        # Below this value of the field the MIN floor applies
+                        "breakpoint": min_val / rate if rate else None,
+                    })
+                elif (row + 1, c) in formulas:
+                    total += _evaluate(handler, ws, formulas[(row + 1, c)], sheet_name, inputs, grid, size)
+                elif row2_val is not None:
+                    total += handler._to_number(row2_val)
+    elif (row, e2e_cost_col) in formulas:
+        total += _evaluate(handler, ws, compiled, sheet_name, inputs, grid, size)
+    else:
+        value = ws.value(row, e2e_cost_col) or 0
+        if not value:
+            value = ws.value(row + 1, e2e_cost_col) or 0
+        total += handler._to_number(value)
+    return total, breakpoints
+
+
+def _min_driver(field, inputs, grid):
+    if field in grid:
+        return grid[field]
+    if field == 'G/W':
+        return float(inputs.get('G/W', 0) or inputs.get('GW', 0) or 0)
+    return float(inputs.get(field, 0) or 0)
+
+
+def _evaluate(handler, ws, compiled, sheet_name, inputs, grid, size):
+    """Evaluate a compiled formula over the grid, with the input rules of
+    ExcelHandler._evaluate_cell_formula (a failing point counts as 0)."""
+    schema = handler.schemas[sheet_name]
+    header_cols = schema.header_cols
+    col_titles = schema.col_titles
+
+    def make_ref(point):
+        def ref(ref_row, col_idx):
+            title = col_titles.get(col_idx)
+            if title is not None and title in inputs and header_cols.get(title) == col_idx:
+                if title in grid:
+                    return grid[title] if point is None else float(grid[title][point])
+                user_value = inputs.get(title)
+                if user_value is not None and str(user_value).strip() != '':
+                    try:
+                        return float(user_value)
+                    except (ValueError, TypeError):
+                        return 0
+            return handler._to_number(ws.value(ref_row, col_idx))
+        return ref
+
+    try:
+        with np.errstate(all='ignore'):
+            result = np.broadcast_to(np.asarray(compiled.evaluate_array(make_ref(None)), dtype=float), (size,))
+        return np.where(np.isfinite(result), result, 0.0)
+    except Exception:
+        pass
+    # MIN()/MAX() and friends do not broadcast; fall back to one point at a time
+    result = np.zeros(size)
+    for i in range(size):
+        try:
+            result[i] = compiled.evaluate(make_ref(i))
+        except Exception:
+            result[i] = 0.0
+    return result
@@ -1,37 +1,128 @@
-import pandas as pd
-import openpyxl
-from openpyxl.utils import get_column_letter
+from collections import namedtuple
+from facet_index import FacetIndex
+from formula_compiler import compile_sheet_formulas, ref_name
+from model_cache import cached_model, load_model
+from lane_costs import build_lane_costs
+from metrics import CALCULATE_STAGE_SECONDS, MATCH_TIER, ROWS_SCANNED
+from result_cache import ResultCache, canonical_input
+from route_planner import build_route_graph
+from sheet_schema import BreakdownColumn, SheetSchema, first_columns, index_columns, is_variable
+from workbook_loader import load_workbook_data
+import logging
 import re
+import threading
+import time
 import traceback
-import os
-from datetime import datetime
+from log_pipeline import get_logger
+
+# A candidate row of a lane with the values of its field columns
+# (between 'To' and 'SUMMARY') already read from the merged record
+LaneRecord = namedtuple('LaneRecord', ['row', 'fields'])
+
 
 class ExcelHandler:
-    def __init__(self, file_path):
+    ROUTE_SHEETS = ['WAHL-Customer', 'VENDOR-WAHL', 'WAHL-DGWA']
+    # Sheets an uploaded workbook must have, with the titles of their header row
+    REQUIRED_HEADERS = dict.fromkeys(ROUTE_SHEETS, ('MAP', 'From', 'To'))
+    # SUMMARY column codes of the transport modes offered in the UI
+    SUMMARY_CODES = {'Ocean': 'A', 'Air': 'B', 'Land': 'C'}
+    SUMMARY_NAMES = {code: name for name, code in SUMMARY_CODES.items()}
+
+    def __init__(self, file_path, base=None):
+        # `base`: path of an earlier version of the workbook whose model is
+        # cached (the same path if it was edited in place); a build reuses what it derived from the sheets that did not change
         self.file_path = file_path
+        self.logger = get_logger('shipping_route', 'shipping_route_logs.txt')
         self.target_green_rgb = '92D050'
+        self.route_options_cache = None
+        self.sheet_options = {}
+        self.result_cache = ResultCache()
+        self._calc_state = threading.local()
         try:
-            self.wb = openpyxl.load_workbook(self.file_path, data_only=True)
-            self.wb_formula = openpyxl.load_workbook(self.file_path, data_only=False)
-            self._log(f"Loaded workbook: {file_path}")
+            model = load_model(self.file_path, 'routes', lambda: self._build_model(base), self._log)
+            self.wb = model['wb']
+            self.schemas = model['schemas']
+            self.lane_index = model['lane_index']
+            self.compiled_formulas = model['compiled_formulas']
+            self.facet_index = model['facet_index']
+            self.lane_costs = model['lane_costs']
+            self.route_graph = model['route_graph']
         except Exception as e:
             self._log(f"Error loading workbook {file_path}: {e}")
             self.wb = None
-            self.wb_formula = None
-        self.route_options_cache = None
+            self.schemas = {}
+            self.lane_index = {}
+            self.compiled_formulas = {}
+            self.facet_index = {}
+            self.lane_costs = {}
+            self.route_graph = {}
+
+    def _build_model(self, base=None):
+        """Parse the workbook and build everything calculate() needs (cached on disk).
+
+        Sheets whose source is the same as in the cached model of `base`
+        are not parsed again, and their schemas, indexes, compiled formulas
+        and lane costs are carried over, so the build only does the work of
+        the sheets that changed.
+        """
+        previous = cached_model(base, 'routes') if base else None
+        # One pass over the xlsx gives both cached values and formulas
+        self.wb = load_workbook_data(self.file_path, sheets=self.ROUTE_SHEETS,
+                                     reuse=previous['wb'] if previous else None)
+        self._log(f"Loaded workbook: {self.file_path}")
+        changed = [name for name in self.ROUTE_SHEETS if name in self.wb.sheetnames and name not in self.wb.reused]
+        if self.wb.reused:
+            self._log(f"Unchanged since {base}: {', '.join(self.wb.reused)}; rebuilding {', '.join(changed) or 'nothing'}")
+
+        def merged(key, built):
+            # Sheet order is kept, the route graph lists edges in it
+            carried = previous[key] if previous else {}
+            return {name: built[name] if name in built else carried[name] for name in self.ROUTE_SHEETS
+                    if name in built or (name in self.wb.reused and name in carried)}
+
+        self.schemas = merged('schemas', self._build_schemas(changed))
+        self.lane_index = merged('lane_index', self._build_lane_index(changed))
+        self.compiled_formulas = merged('compiled_formulas', self._compile_formulas(changed))
+        lane_costs = merged('lane_costs', build_lane_costs(self, changed))
+        return {
+            'wb': self.wb,
+            'schemas': self.schemas,
+            'lane_index': self.lane_index,
+            'compiled_formulas': self.compiled_formulas,
+            'facet_index': merged('facet_index', self._build_facet_index(changed)),
+            'lane_costs': lane_costs,
+            'route_graph': build_route_graph(lane_costs),
+        }
+
+    def carry_over(self, previous):
+        """Take over from `previous`, the handler of an earlier version of
+        this workbook, the route options of the sheets that did not change
+        and the cached results that only priced such sheets."""
+        if not self.wb or not previous.wb:
+            return
+        unchanged = {name for name in self.ROUTE_SHEETS
+                     if name in self.wb.sheets and name in previous.wb.sheets
+                     and self.wb[name].source is not None and self.wb[name].source == previous.wb[name].source}
+        if not unchanged:
+            return
+        for name in unchanged:
+            if name in previous.sheet_options:
+                self.sheet_options.setdefault(name, previous.sheet_options[name])
+
+        def unchanged_only(key):
+            for node, _, _ in key:
+                sheet_name = self._get_sheet_for_node(node)
+                if sheet_name not in unchanged or previous._get_sheet_for_node(node) != sheet_name:
+                    return False
+            return True
+
+        carried = self.result_cache.adopt(previous.result_cache, unchanged_only)
+        self._log(f"Carried over {carried} cached results of {', '.join(sorted(unchanged))} from the previous workbook")
 
     def _log(self, msg):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {msg}\n"
-        print(log_entry.strip())
-        
-        # Write to log file in working directory
-        log_file = os.path.join(os.getcwd(), 'shipping_route_logs.txt')
-        try:
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(log_entry)
-        except Exception as e:
-            print(f"Error writing to log file: {e}")
+        # Queued and written by the background log writer (see log_pipeline);
+        # per-row and per-field traces go straight to self.logger.debug
+        self.logger.info(msg)
 
     def get_route_options(self):
         if self.route_options_cache:
@@ -39,31 +130,17 @@ class ExcelHandler:
         
         if not self.wb: return {}
             
-        sheets = ['WAHL-Customer', 'VENDOR-WAHL', 'WAHL-DGWA']
         options = {}
         
-        for sheet_name in sheets:
+        for sheet_name in self.ROUTE_SHEETS:
             if sheet_name not in self.wb.sheetnames: continue
-            ws = self.wb[sheet_name]
-            header_row, map_col, from_col, to_col = self._find_header_info(ws)
-            if not map_col: continue
-            
-            for r in range(header_row + 1, ws.max_row + 1):
-                node_val = ws.cell(r, map_col).value
-                if node_val is None: continue
-                
-                node = str(node_val).strip()
-                frm = str(ws.cell(r, from_col).value).strip() if from_col and ws.cell(r, from_col).value else ""
-                to = str(ws.cell(r, to_col).value).strip() if to_col and ws.cell(r, to_col).value else ""
-                
-                if node:
-                    if node not in options:
-                        options[node] = {'locations': [], 'details': [], 'sheet': sheet_name}
-                    
-                    loc_str = f"{frm} -> {to}"
+            for node, sheet_options in self._sheet_route_options(sheet_name).items():
+                if node not in options:
+                    options[node] = {'locations': [], 'details': [], 'sheet': sheet_name}
+                for loc_str, detail in zip(sheet_options['locations'], sheet_options['details']):
                     if loc_str not in options[node]['locations']:
                         options[node]['locations'].append(loc_str)
-                        options[node]['details'].append({"from": frm, "to": to})
+                        options[node]['details'].append(detail)
         
         for node in options:
             options[node]['locations'].sort()
@@ -86,58 +163,233 @@ class ExcelHandler:
         self.route_options_cache = options
         return options
 
-    def get_node_fields(self, node, location_str):
+    def _sheet_route_options(self, sheet_name):
+        """Locations of each node in one route sheet, in row order; kept per
+        sheet so a new version of the workbook can reuse unchanged ones."""
+        options = self.sheet_options.get(sheet_name)
+        if options is not None:
+            return options
+        options = {}
+        ws = self.wb[sheet_name]
+        header_row, map_col, from_col, to_col = self._find_header_info(ws)
+        if map_col:
+            for r in range(header_row + 1, ws.max_row + 1):
+                node_val = ws.value(r, map_col)
+                if node_val is None: continue
+
+                node = str(node_val).strip()
+                frm = str(ws.value(r, from_col)).strip() if from_col and ws.value(r, from_col) else ""
+                to = str(ws.value(r, to_col)).strip() if to_col and ws.value(r, to_col) else ""
+
+                if node:
+                    entry = options.setdefault(node, {'locations': [], 'details': []})
+                    loc_str = f"{frm} -> {to}"
+                    if loc_str not in entry['locations']:
+                        entry['locations'].append(loc_str)
+                        entry['details'].append({"from": frm, "to": to})
+        self.sheet_options[sheet_name] = options
+        return options
+
+    def _build_schemas(self, sheet_names):
+        """Header lookups, selection field columns and breakdown columns per route sheet."""
+        schemas = {}
+        for sheet_name in sheet_names:
+            if sheet_name not in self.wb.sheetnames: continue
+            ws = self.wb[sheet_name]
+            header_row, map_col, from_col, to_col = self._scan_header_info(ws)
+            headers = [(c, ws.value(header_row, c)) for c in range(1, ws.max_column + 1)]
+            header_cols, col_titles = first_columns(headers)
+
+            # Field columns between 'To' and 'SUMMARY' used by matching
+            summary_col = header_cols.get('SUMMARY')
+            to_col_idx = header_cols.get('To')
+            input_cols = None
+            if summary_col and to_col_idx:
+                input_cols = [(c, title) for c, title in headers[to_col_idx:summary_col] if title]
+
+            # Cost columns are numbered in row 1; green ones are variable costs
+            breakdown = []
+            for c in index_columns(ws):
+                title = ws.value(header_row, c)
+                if not title: continue
+                breakdown.append(BreakdownColumn(c, str(title).strip(), is_variable(ws, c), None))
+
+            schemas[sheet_name] = SheetSchema(header_row, header_cols, col_titles, input_cols, breakdown,
+                                              key_cols=(map_col, from_col, to_col))
+        return schemas
+
+    def _build_lane_index(self, sheet_names):
+        """Index every data row by (node, from, to) with its field values pre-extracted.
+
+        Matching in calculate() only looks at the candidate records of the
+        requested lane instead of scanning the whole sheet.
+        """
+        index = {}
+        if not self.wb: return index
+
+        for sheet_name in sheet_names:
+            if sheet_name not in self.wb.sheetnames: continue
+            ws = self.wb[sheet_name]
+            header_row, map_col, from_col, to_col = self._find_header_info(ws)
+            if not map_col: continue
+            field_cols = self.schemas[sheet_name].input_cols
+
+            lanes = {}
+            for r in range(header_row + 1, ws.max_row + 1):
+                node_cell = ws.value(r, map_col)
+                frm_cell = ws.value(r, from_col) if from_col else None
+                to_cell = ws.value(r, to_col) if to_col else None
+                if not node_cell or not frm_cell or not to_cell: continue
+
+                # Merged records keep their value in either of the two rows
+                fields = None
+                if field_cols is not None:
+                    fields = tuple(self._merged_value(ws, r, c) for c, title in field_cols)
+                key = (str(node_cell).strip(), str(frm_cell).strip(), str(to_cell).strip())
+                lanes.setdefault(key, []).append(LaneRecord(r, fields))
+
+            index[sheet_name] = {"lanes": lanes}
+            self._log(f"Indexed {sheet_name}: {len(lanes)} lanes")
+        return index
+
+    def _build_facet_index(self, sheet_names):
+        """Per sheet and lane (node, from, to), the values of the field columns
+        between 'To' and 'SUMMARY' as a FacetIndex for get_node_fields()."""
+        index = {}
+        if not self.wb: return index
+
+        for sheet_name in sheet_names:
+            if sheet_name not in self.wb.sheetnames: continue
+            ws = self.wb[sheet_name]
+            header_row, map_col, from_col, to_col = self._find_header_info(ws)
+            summary_col = self.schemas[sheet_name].col('SUMMARY')
+            if not map_col or not summary_col or not to_col: continue
+            columns = [(c, ws.value(header_row, c)) for c in range(to_col + 1, summary_col + 1)]
+            columns = [(c, title) for c, title in columns if title]
+
+            lane_rows = {}
+            for r in range(header_row + 1, ws.max_row + 1):
+                node_val = ws.value(r, map_col)
+                if not node_val: continue
+                frm = str(ws.value(r, from_col)).strip() if ws.value(r, from_col) else ""
+                to = str(ws.value(r, to_col)).strip() if ws.value(r, to_col) else ""
+                lane_rows.setdefault((str(node_val).strip(), frm, to), []).append(r)
+
+            lanes = {}
+            for key, rows in lane_rows.items():
+                facet = lanes[key] = FacetIndex(rows)
+                for pos, r in enumerate(rows):
+                    for c, title in columns:
+                        facet.add(c, pos, ws.value(r, c))
+
+            index[sheet_name] = {"columns": columns, "lanes": lanes}
+        return index
+
+    def _compile_formulas(self, sheet_names):
+        """Compile the formula cells of the route sheets once at load."""
+        compiled = {}
+        if not self.wb: return compiled
+        for sheet_name in sheet_names:
+            if sheet_name not in self.wb.sheetnames: continue
+            compiled[sheet_name] = compile_sheet_formulas(self.wb[sheet_name], self._log)
+            self._log(f"Compiled {len(compiled[sheet_name])} formulas in {sheet_name}")
+        return compiled
+
+    def _merged_value(self, ws, r, c):
+        val = ws.value(r, c)
+        if val is None:
+            val = ws.value(r + 1, c)
+        return val
+
+    def get_node_fields(self, node, location_str, current_inputs=None):
+        """Option lists of the lane's field columns, from the facet index.
+
+        With `current_inputs` each field also gets "counts": per option, the
+        lane rows that have it and match the values picked in the other fields.
+        """
         sheet_name = self._get_sheet_for_node(node)
         if not sheet_name: return []
-        
-        ws = self.wb[sheet_name]
-        header_row, _, _, to_col = self._find_header_info(ws)
-        summary_col = self._get_col_by_header(ws, header_row, 'SUMMARY')
-        if not summary_col or not to_col: return []
 
-        matching_rows = []
+        sheet_facets = self.facet_index.get(sheet_name)
+        if not sheet_facets: return []
+
         loc_parts = [s.strip() for s in location_str.split('->')]
         if len(loc_parts) != 2: return []
         frm_target, to_target = loc_parts
-        
-        _, map_col_idx, from_col_idx, to_col_idx = self._find_header_info(ws)
-        
-        for r in range(header_row + 1, ws.max_row + 1):
-            row_node = str(ws.cell(r, map_col_idx).value).strip() if ws.cell(r, map_col_idx).value else ""
-            row_frm = str(ws.cell(r, from_col_idx).value).strip() if ws.cell(r, from_col_idx).value else ""
-            row_to = str(ws.cell(r, to_col_idx).value).strip() if ws.cell(r, to_col_idx).value else ""
-            
-            if row_node == node and row_frm == frm_target and row_to == to_target:
-                matching_rows.append(r)
 
-        if not matching_rows: return []
+        facet = sheet_facets["lanes"].get((node, frm_target, to_target))
+        if facet is None: return []
 
-        fields = []
-        for c in range(to_col + 1, summary_col + 1):
-            title = ws.cell(header_row, c).value
-            if not title: continue
-            
-            display_title = "Shipping method" if title == "SUMMARY" else title
-            unique_values = set()
-            for r in matching_rows:
-                val = ws.cell(r, c).value
+        # Option value -> rows having it, per field column
+        options = {}
+        picked = {}
+        for c, title in sheet_facets["columns"]:
+            field_options = {}
+            for val, bits in facet.values(c).items():
+                if title == "SUMMARY":
+                    val = self.SUMMARY_NAMES.get(val, val)
+                if current_inputs and current_inputs.get(title) and str(val).strip() == str(current_inputs[title]).strip():
+                    picked[c] = picked.get(c, 0) | bits
                 if val is not None and str(val).strip().upper() != "N/A" and str(val).strip() != "":
-                    if title == "SUMMARY":
-                        if val == 'A': val = 'Ocean'
-                        elif val == 'B': val = 'Air'
-                        elif val == 'C': val = 'Land'
-                    unique_values.add(val)
-            
-            if unique_values:
-                fields.append({
-                    "name": title,
-                    "display_name": display_title,
-                    "options": sorted(list(unique_values))
-                })
-        
+                    field_options[val] = field_options.get(val, 0) | bits
+            options[c] = field_options
+
+        fields = []
+        for c, title in sheet_facets["columns"]:
+            if not options[c]: continue
+            field = {
+                "name": title,
+                "display_name": "Shipping method" if title == "SUMMARY" else title,
+                "options": sorted(options[c])
+            }
+            if current_inputs:
+                mask = facet.all
+                for other_c, other_title in sheet_facets["columns"]:
+                    if other_c != c and current_inputs.get(other_title):
+                        mask &= picked.get(other_c, 0)
+                field["counts"] = [facet.count(options[c][val], mask) for val in field["options"]]
+            fields.append(field)
+
         return fields
 
     def calculate(self, selections):
+        # Repeat quotes are answered from the result cache, which keeps and
+        # hands out its own copies, so callers may change what they get
+        key = self._selection_key(selections)
+        if key is not None:
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                self.logger.debug("CALCULATION served from result cache: %s", selections)
+                return cached
+        result = self._calculate(selections)
+        if key is not None:
+            self.result_cache.put(key, result)
+        return result
+
+    def _selection_key(self, selections):
+        """Hashable canonical form of calculate() selections, None if there is none."""
+        try:
+            key = []
+            for sel in selections:
+                location = sel.get('location')
+                if isinstance(location, str) and location.count('->') == 1:
+                    location = '->'.join(part.strip() for part in location.split('->'))
+                inputs = []
+                for field, val in sel.get('inputs', {}).items():
+                    if field == 'SUMMARY' and val in self.SUMMARY_CODES:
+                        # Tagged so a literal 'A' input does not share its key
+                        val = ('SUMMARY', self.SUMMARY_CODES[val])
+                    else:
+                        val = canonical_input(val)
+                    inputs.append((field, val))
+                key.append((sel.get('node'), location, tuple(sorted(inputs))))
+            key = tuple(key)
+            hash(key)
+            return key
+        except (AttributeError, TypeError):
+            return None
+
+    def _calculate(self, selections):
         results = []
         total_cost = 0
         all_lt_strings = []
@@ -145,6 +397,7 @@ class ExcelHandler:
         self._log("=" * 60)
         self._log("CALCULATION START")
         self._log("=" * 60)
+        self._calc_state.active = True
         
         try:
             for idx, sel in enumerate(selections):
@@ -168,23 +421,31 @@ class ExcelHandler:
                 self._log(f"Using sheet: {sheet_name}")
                     
                 ws = self.wb[sheet_name]
-                ws_formula = self.wb_formula[sheet_name]
+                formulas = self.compiled_formulas.get(sheet_name, {})
                 header_row, map_col, from_col, to_col = self._find_header_info(ws)
                 self._log(f"Header row: {header_row}, MAP col: {map_col}, From col: {from_col}, To col: {to_col}")
                 
                 frm_target, to_target = [s.strip() for s in location.split('->')]
                 self._log(f"Looking for: From='{frm_target}', To='{to_target}'")
                 
+                schema = self.schemas[sheet_name]
+                match_started = time.perf_counter()
+                candidates = self.lane_index.get(sheet_name, {}).get("lanes", {}).get((node, frm_target, to_target), [])
+                self._log(f"Candidate rows for lane: {[rec.row for rec in candidates]}")
+                
                 target_row = None
+                scanned = 0
                 # Try exact match first
-                for r in range(header_row + 1, ws.max_row + 1):
-                    if self._row_matches_exact(ws, r, header_row, map_col, from_col, to_col, node, frm_target, to_target, inputs):
-                        target_row = r
-                        self._log(f"EXACT MATCH found at row {r}")
+                for rec in candidates:
+                    scanned += 1
+                    if self._row_matches_exact(ws, schema, rec, inputs):
+                        target_row = rec.row
+                        self._log(f"EXACT MATCH found at row {target_row}")
                         break
                 
                 if target_row:
-                    cost, lt_str, breakdown, log_details = self._extract_data_from_row(ws, ws_formula, sheet_name, target_row, header_row, inputs)
+                    self._record_match('exact', match_started, scanned)
+                    cost, lt_str, breakdown, log_details = self._extract_data_from_row(ws, formulas, sheet_name, target_row, header_row, inputs)
                     results.append({"node": node, "cost": cost, "lt": lt_str, "breakdown": breakdown})
                     total_cost += cost
                     if lt_str:
@@ -193,16 +454,17 @@ class ExcelHandler:
                 else:
                     # Try partial match (ignore PALLET QTY, CBM, G/W)
                     self._log("No exact match, trying partial match (ignoring PALLET QTY, CBM, G/W)...")
-                    for r in range(header_row + 1, ws.max_row + 1):
-                        match_result = self._row_matches_partial(ws, r, header_row, map_col, from_col, to_col, node, frm_target, to_target, inputs)
-                        if match_result:
-                            target_row = r
-                            self._log(f"PARTIAL MATCH found at row {r}")
+                    for rec in candidates:
+                        scanned += 1
+                        if self._row_matches_partial(schema, rec, inputs):
+                            target_row = rec.row
+                            self._log(f"PARTIAL MATCH found at row {target_row}")
                             break
                     
                     if target_row:
+                        self._record_match('partial', match_started, scanned)
                         # Calculate cost using formula with user inputs
-                        cost, lt_str, breakdown, log_details = self._calculate_with_formula(ws, ws_formula, sheet_name, target_row, header_row, inputs)
+                        cost, lt_str, breakdown, log_details = self._calculate_with_formula(ws, formulas, sheet_name, target_row, header_row, inputs)
                         results.append({"node": node, "cost": cost, "lt": lt_str, "breakdown": breakdown})
                         total_cost += cost
                         if lt_str:
@@ -212,22 +474,24 @@ class ExcelHandler:
                         # Special handling for WAHL-DGWA: try Truck times fallback
                         if sheet_name == 'WAHL-DGWA':
                             self._log("No partial match, trying Truck times fallback for WAHL-DGWA...")
-                            for r in range(header_row + 1, ws.max_row + 1):
-                                match_result = self._row_matches_except_truck_times(ws, r, header_row, map_col, from_col, to_col, node, frm_target, to_target, inputs)
-                                if match_result:
-                                    target_row = r
-                                    self._log(f"TRUCK TIMES FALLBACK MATCH found at row {r}")
+                            for rec in candidates:
+                                scanned += 1
+                                if self._row_matches_except_truck_times(schema, rec, inputs):
+                                    target_row = rec.row
+                                    self._log(f"TRUCK TIMES FALLBACK MATCH found at row {target_row}")
                                     break
                         
                         if target_row:
+                            self._record_match('truck_times', match_started, scanned)
                             # Calculate using formula with user's Truck times value
-                            cost, lt_str, breakdown, log_details = self._calculate_with_formula(ws, ws_formula, sheet_name, target_row, header_row, inputs)
+                            cost, lt_str, breakdown, log_details = self._calculate_with_formula(ws, formulas, sheet_name, target_row, header_row, inputs)
                             results.append({"node": node, "cost": cost, "lt": lt_str, "breakdown": breakdown})
                             total_cost += cost
                             if lt_str:
                                 all_lt_strings.append(str(lt_str))
                             self._log(f"Calculated (Truck times fallback): Cost={cost}, LT='{lt_str}'")
                         else:
+                            self._record_match('no_match', match_started, scanned)
                             self._log(f"ERROR: No match found")
                             results.append({"node": node, "cost": 0, "lt": "", "breakdown": None, "error": f"未找到匹配: {frm_target} -> {to_target}"})
                         
@@ -235,7 +499,10 @@ class ExcelHandler:
             self._log(f"EXCEPTION: {str(e)}")
             self._log(traceback.format_exc())
 
+        started = time.perf_counter()
         total_lt = self._aggregate_lt(all_lt_strings)
+        self._observe_stage('aggregate_lt', started)
+        self._calc_state.active = False
         
         self._log("\n" + "=" * 60)
         self._log(f"TOTAL COST: {total_cost}")
@@ -249,6 +516,20 @@ class ExcelHandler:
             "total_lt": total_lt
         }
 
+    def _record_match(self, tier, started, scanned):
+        CALCULATE_STAGE_SECONDS.observe(time.perf_counter() - started, 'routes', 'match')
+        MATCH_TIER.inc('routes', tier)
+        ROWS_SCANNED.observe(scanned, 'routes')
+
+    def _observe_stage(self, stage, started):
+        """Time a calculate() stage that began at `started`; returns now.
+        Only calculate() requests count, not the lane pricing at load or
+        the sweep, which go through the same helpers."""
+        now = time.perf_counter()
+        if getattr(self._calc_state, 'active', False):
+            CALCULATE_STAGE_SECONDS.observe(now - started, 'routes', stage)
+        return now
+
     def _is_date_format(self, val):
         """Check if value looks like a date/days format"""
         if not val:
@@ -265,9 +546,9 @@ class ExcelHandler:
         for lt in lt_strings:
             if not lt: continue
             s = str(lt).strip()
-            self._log(f"  Parsing LT: '{s}'")
+            self.logger.debug("  Parsing LT: '%s'", s)
             nums = re.findall(r'\d+', s)
-            self._log(f"    Found numbers: {nums}")
+            self.logger.debug("    Found numbers: %s", nums)
             if len(nums) == 1:
                 val = int(nums[0])
                 total_min += val
@@ -284,10 +565,15 @@ class ExcelHandler:
             return f"{total_min}-{total_max} Days"
 
     def _find_header_info(self, ws):
+        """(header row, MAP col, From col, To col) of a route sheet."""
+        schema = self.schemas[ws.title]
+        return (schema.header_row,) + schema.key_cols
+
+    def _scan_header_info(self, ws):
         for r in range(1, 6):
             row_values = []
             for c in range(1, min(ws.max_column + 1, 30)):
-                row_values.append(ws.cell(r, c).value)
+                row_values.append(ws.value(r, c))
             
             if 'MAP' in row_values:
                 map_col = from_col = to_col = None
@@ -302,26 +588,17 @@ class ExcelHandler:
         options = self.get_route_options()
         return options.get(node, {}).get('sheet')
 
-    def _row_matches_exact(self, ws, r, header_row, map_col, from_col, to_col, node, frm, to, inputs):
-        """Check if row matches exactly including all input fields."""
-        node_cell = ws.cell(r, map_col).value
-        if not node_cell: return False
-        if str(node_cell).strip() != node: return False
-        
-        frm_cell = ws.cell(r, from_col).value
-        if not frm_cell or str(frm_cell).strip() != frm: return False
-
-        to_cell = ws.cell(r, to_col).value
-        if not to_cell or str(to_cell).strip() != to: return False
-        
+    def _row_matches_exact(self, ws, schema, record, inputs):
+        """Check if an indexed row matches exactly including all input fields."""
+        header_cols = schema.header_cols
+        field_pos = schema.input_pos
         for field, val in inputs.items():
             if not val or str(val).lower() == 'n/a': continue
             
-            col = self._get_col_by_header(ws, header_row, field)
+            col = header_cols.get(field)
             if col:
-                row_val = ws.cell(r, col).value
-                if row_val is None:
-                    row_val = ws.cell(r+1, col).value
+                pos = field_pos.get(field)
+                row_val = record.fields[pos] if pos is not None else self._merged_value(ws, record.row, col)
 
                 input_val = val
                 if field == 'SUMMARY':
@@ -331,134 +608,63 @@ class ExcelHandler:
                     return False
         return True
 
-    def _row_matches_partial(self, ws, r, header_row, map_col, from_col, to_col, node, frm, to, inputs):
-        """Check if row matches, ignoring PALLET QTY, CBM, G/W fields.
+    def _row_matches_partial(self, schema, record, inputs):
+        """Check if an indexed row matches, ignoring PALLET QTY, CBM, G/W fields.
         Stricter logic: if user didn't input a field but Excel has a value, fail.
         """
-        node_cell = ws.cell(r, map_col).value
-        if not node_cell: return False
-        if str(node_cell).strip() != node: return False
-        
-        frm_cell = ws.cell(r, from_col).value
-        if not frm_cell or str(frm_cell).strip() != frm: return False
-
-        to_cell = ws.cell(r, to_col).value
-        if not to_cell or str(to_cell).strip() != to: return False
+        r = record.row
         
         # Skip these fields for partial matching
         skip_fields = ['PALLET QTY', 'CBM', 'G/W', 'GW']
         
-        self._log(f"  检查第 {r} 行的部分匹配")
-        
-        # Get all field columns from Excel (between 'To' and 'SUMMARY')
-        summary_col = self._get_col_by_header(ws, header_row, 'SUMMARY')
-        to_col_idx = self._get_col_by_header(ws, header_row, 'To')
+        self.logger.debug("  检查第 %s 行的部分匹配", r)
         
-        if not summary_col or not to_col_idx:
-            self._log(f"    错误：找不到 SUMMARY 或 To 列")
+        # Field columns from Excel (between 'To' and 'SUMMARY'), from the schema
+        if schema.input_titles is None:
+            self.logger.debug("    错误：找不到 SUMMARY 或 To 列")
             return False
         
-        # Iterate through each field column
-        for c in range(to_col_idx + 1, summary_col + 1):
-            field_header = ws.cell(header_row, c).value
-            if not field_header:
-                continue
-            
-            # Skip the special fields
-            if field_header in skip_fields:
-                self._log(f"    字段 '{field_header}': 在跳过列表中，跳过")
-                continue
-            
-            # Get Excel value from row (check both merged rows)
-            excel_val = ws.cell(r, c).value
-            if excel_val is None:
-                excel_val = ws.cell(r + 1, c).value
-            
-            # Get user input value
-            user_val = inputs.get(field_header)
-            
-            # Handle SUMMARY field special conversion
-            if field_header == 'SUMMARY' and user_val:
-                user_val_converted = 'A' if user_val == 'Ocean' else ('B' if user_val == 'Air' else 'C')
-            else:
-                user_val_converted = user_val
-            
-            # Check logic:
-            # 1. User didn't input (empty/None)
-            if not user_val or str(user_val).strip() == '':
-                # Excel has a value (not empty/N/A) → FAIL
-                if excel_val and str(excel_val).strip() not in ['', 'N/A']:
-                    self._log(f"    字段 '{field_header}': 用户未输入，Excel 为 '{excel_val}' - 失败")
-                    return False
-                else:
-                    self._log(f"    字段 '{field_header}': 用户未输入，Excel 也为空 - 跳过")
-            # 2. User did input
-            else:
-                # Excel is empty/N/A but user has input → FAIL (stricter matching)
-                if not excel_val or str(excel_val).strip() in ['', 'N/A']:
-                    self._log(f"    字段 '{field_header}': Excel 为空，但用户输入='{user_val}' - 失败")
-                    return False
-                
-                # Normal match check
-                if str(excel_val).strip() != str(user_val_converted).strip():
-                    self._log(f"    字段 '{field_header}': 不匹配 - Excel='{excel_val}', 用户='{user_val}' - 失败")
-                    return False
-                else:
-                    self._log(f"    字段 '{field_header}': 匹配 - Excel='{excel_val}', 用户='{user_val}' - 成功")
+        if not self._fields_match(schema.input_titles, record.fields, inputs, skip_fields):
+            return False
         
-        self._log(f"  第 {r} 行部分匹配成功")
+        self.logger.debug("  第 %s 行部分匹配成功", r)
         return True
     
-    def _row_matches_except_truck_times(self, ws, r, header_row, map_col, from_col, to_col, node, frm, to, inputs):
-        """Check if row matches, ignoring Truck times field.
+    def _row_matches_except_truck_times(self, schema, record, inputs):
+        """Check if an indexed row matches, ignoring Truck times field.
         Used for WAHL-DGWA fallback: if all other fields match but Truck times differs,
         we can use the row's formula with user's Truck times input.
         """
-        node_cell = ws.cell(r, map_col).value
-        if not node_cell: return False
-        if str(node_cell).strip() != node: return False
-        
-        frm_cell = ws.cell(r, from_col).value
-        if not frm_cell or str(frm_cell).strip() != frm: return False
-
-        to_cell = ws.cell(r, to_col).value
-        if not to_cell or str(to_cell).strip() != to: return False
+        r = record.row
         
         # Ignore these fields for this special matching
         skip_fields = ['PALLET QTY', 'CBM', 'G/W', 'GW', 'Truck times']
         
-        self._log(f"  检查第 {r} 行的 Truck times fallback 匹配（忽略 Truck times）")
+        self.logger.debug("  检查第 %s 行的 Truck times fallback 匹配（忽略 Truck times）", r)
         
-        # Get all field columns from Excel (between 'To' and 'SUMMARY')
-        summary_col = self._get_col_by_header(ws, header_row, 'SUMMARY')
-        to_col_idx = self._get_col_by_header(ws, header_row, 'To')
-        
-        if not summary_col or not to_col_idx:
-            self._log(f"    错误：找不到 SUMMARY 或 To 列")
+        if schema.input_titles is None:
+            self.logger.debug("    错误：找不到 SUMMARY 或 To 列")
             return False
         
         # Check if Truck times column exists and user provided input
-        truck_times_col = self._get_col_by_header(ws, header_row, 'Truck times')
-        if not truck_times_col or 'Truck times' not in inputs:
-            self._log(f"    Truck times 列不存在或用户未提供输入，无法使用此匹配")
+        if 'Truck times' not in schema.header_cols or 'Truck times' not in inputs:
+            self.logger.debug("    Truck times 列不存在或用户未提供输入，无法使用此匹配")
             return False
         
-        # Iterate through each field column
-        for c in range(to_col_idx + 1, summary_col + 1):
-            field_header = ws.cell(header_row, c).value
-            if not field_header:
-                continue
-            
-            # Skip the special fields (including Truck times)
+        if not self._fields_match(schema.input_titles, record.fields, inputs, skip_fields):
+            return False
+        
+        self.logger.debug("  第 %s 行 Truck times fallback 匹配成功（除 Truck times 外所有字段匹配）", r)
+        return True
+
+    def _fields_match(self, field_titles, field_values, inputs, skip_fields):
+        """Strict field comparison shared by the partial and Truck times fallback tiers."""
+        for field_header, excel_val in zip(field_titles, field_values):
+            # Skip the special fields
             if field_header in skip_fields:
-                self._log(f"    字段 '{field_header}': 在跳过列表中，跳过")
+                self.logger.debug("    字段 '%s': 在跳过列表中，跳过", field_header)
                 continue
             
-            # Get Excel value from row (check both merged rows)
-            excel_val = ws.cell(r, c).value
-            if excel_val is None:
-                excel_val = ws.cell(r + 1, c).value
-            
             # Get user input value
             user_val = inputs.get(field_header)
             
@@ -468,33 +674,30 @@ class ExcelHandler:
             else:
                 user_val_converted = user_val
             
-            # Same strict matching logic as partial match
+            # Check logic:
+            # 1. User didn't input (empty/None)
             if not user_val or str(user_val).strip() == '':
+                # Excel has a value (not empty/N/A) → FAIL
                 if excel_val and str(excel_val).strip() not in ['', 'N/A']:
-                    self._log(f"    字段 '{field_header}': 用户未输入，Excel 为 '{excel_val}' - 失败")
+                    self.logger.debug("    字段 '%s': 用户未输入，Excel 为 '%s' - 失败", field_header, excel_val)
                     return False
                 else:
-                    self._log(f"    字段 '{field_header}': 用户未输入，Excel 也为空 - 跳过")
+                    self.logger.debug("    字段 '%s': 用户未输入，Excel 也为空 - 跳过", field_header)
+            # 2. User did input
             else:
+                # Excel is empty/N/A but user has input → FAIL (stricter matching)
                 if not excel_val or str(excel_val).strip() in ['', 'N/A']:
-                    self._log(f"    字段 '{field_header}': Excel 为空，但用户输入='{user_val}' - 失败")
+                    self.logger.debug("    字段 '%s': Excel 为空，但用户输入='%s' - 失败", field_header, user_val)
                     return False
                 
+                # Normal match check
                 if str(excel_val).strip() != str(user_val_converted).strip():
-                    self._log(f"    字段 '{field_header}': 不匹配 - Excel='{excel_val}', 用户='{user_val}' - 失败")
+                    self.logger.debug("    字段 '%s': 不匹配 - Excel='%s', 用户='%s' - 失败", field_header, excel_val, user_val)
                     return False
                 else:
-                    self._log(f"    字段 '{field_header}': 匹配 - Excel='{excel_val}', 用户='{user_val}' - 成功")
-        
-        self._log(f"  第 {r} 行 Truck times fallback 匹配成功（除 Truck times 外所有字段匹配）")
+                    self.logger.debug("    字段 '%s': 匹配 - Excel='%s', 用户='%s' - 成功", field_header, excel_val, user_val)
         return True
 
-    def _get_col_by_header(self, ws, header_row, header_name):
-        for c in range(1, ws.max_column + 1):
-            if ws.cell(header_row, c).value == header_name:
-                return c
-        return None
-
     def _parse_min_value(self, cell_text, sheet_name, inputs):
         """
         Parse MIN logic from cell text.
@@ -503,20 +706,12 @@ class ExcelHandler:
         if not cell_text or 'MIN' not in str(cell_text).upper():
             return None
             
-        text = str(cell_text).upper()
-        self._log(f"  Parsing MIN in: '{cell_text}'")
-        
-        # Extract MIN value
-        min_match = re.search(r'MIN\s*(\d+(?:\.\d+)?)', text)
-        if not min_match:
-            return None
-        min_val = float(min_match.group(1))
+        self.logger.debug("  Parsing MIN in: '%s'", cell_text)
         
-        # Extract base rate (number before MIN)
-        base_match = re.search(r'(\d+(?:\.\d+)?)', text)
-        if not base_match:
+        rule = self._parse_min_rule(cell_text, sheet_name)
+        if rule is None:
             return None
-        base_rate = float(base_match.group(1))
+        base_rate, factor, field, min_val = rule
         
         pallet_qty = float(inputs.get('PALLET QTY', 0) or 0)
         cbm = float(inputs.get('CBM', 0) or 0)
@@ -525,137 +720,133 @@ class ExcelHandler:
         calculated = 0
         
         if sheet_name == 'VENDOR-WAHL':
-            if 'CBM' in text:
+            if field == 'CBM':
                 calculated = base_rate * 7.8 * cbm
-                self._log(f"    VENDOR-WAHL CBM: {base_rate} * 7.8 * {cbm} = {calculated}")
-            elif 'KG' in text:
+                self.logger.debug("    VENDOR-WAHL CBM: %s * 7.8 * %s = %s", base_rate, cbm, calculated)
+            elif field == 'G/W':
                 calculated = base_rate * gw
-                self._log(f"    VENDOR-WAHL KG: {base_rate} * {gw} = {calculated}")
+                self.logger.debug("    VENDOR-WAHL KG: %s * %s = %s", base_rate, gw, calculated)
             else:
                 calculated = base_rate * pallet_qty
         else:  # WAHL-Customer
             calculated = base_rate * pallet_qty
-            self._log(f"    WAHL-Customer: {base_rate} * {pallet_qty} = {calculated}")
+            self.logger.debug("    WAHL-Customer: %s * %s = %s", base_rate, pallet_qty, calculated)
         
         result = max(calculated, min_val)
-        self._log(f"    Compare: calculated={calculated}, MIN={min_val}, result={result}")
+        self.logger.debug("    Compare: calculated=%s, MIN=%s, result=%s", calculated, min_val, result)
         return result
 
-    def _evaluate_cell_formula(self, ws, ws_formula, formula, row, header_row, inputs, sheet_name):
-        """Evaluate a cell formula, replacing references to user input fields with their values."""
-        if not formula or not isinstance(formula, str):
-            return 0
+    def _parse_min_rule(self, cell_text, sheet_name):
+        """
+        Parse MIN rate text like '120USD/CBM,MIN 350USD' into (base_rate, factor, field, min_val).
+        The cell costs max(base_rate * factor * inputs[field], min_val); None if unparsable.
+        """
+        text = str(cell_text).upper()
         
-        try:
-            # Create a mapping of column index -> field name for all input fields
-            col_to_field = {}
-            for field_name in inputs.keys():
-                col_idx = self._get_col_by_header(ws, header_row, field_name)
-                if col_idx:
-                    col_to_field[col_idx] = field_name
-            
-            # Simple formula parsing for common patterns like =A1*B2, =A1+B2, =A1
-            formula_str = formula[1:]  # Remove leading '='
-            
-            # Find all cell references (e.g., A1, AB12)
-            cell_refs = re.findall(r'([A-Z]+)(\d+)', formula_str)
-            
-            result_str = formula_str
+        # Extract MIN value
+        min_match = re.search(r'MIN\s*(\d+(?:\.\d+)?)', text)
+        if not min_match:
+            return None
+        min_val = float(min_match.group(1))
+        
+        # Extract base rate (number before MIN)
+        base_match = re.search(r'(\d+(?:\.\d+)?)', text)
+        if not base_match:
+            return None
+        base_rate = float(base_match.group(1))
+        
+        if sheet_name == 'VENDOR-WAHL':
+            if 'CBM' in text:
+                return base_rate, 7.8, 'CBM', min_val
+            elif 'KG' in text:
+                return base_rate, 1.0, 'G/W', min_val
+        return base_rate, 1.0, 'PALLET QTY', min_val
+
+    def _evaluate_cell_formula(self, ws, compiled, header_row, inputs, sheet_name):
+        """Evaluate a compiled cell formula, replacing references to user input fields with their values."""
+        schema = self.schemas[sheet_name]
+        header_cols = schema.header_cols
+        col_titles = schema.col_titles
+        
+        # Cell names are only needed for the DEBUG trace
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        
+        def ref(ref_row, col_idx):
+            cell_name = ref_name(ref_row, col_idx) if debug else None
+            title = col_titles.get(col_idx)
             
-            for col_letter, row_num in cell_refs:
-                col_idx = openpyxl.utils.column_index_from_string(col_letter)
-                ref_row = int(row_num)
+            # Check if this column corresponds to a user input field
+            if title is not None and title in inputs and header_cols.get(title) == col_idx:
+                user_value = inputs.get(title)
                 
-                # Check if this column corresponds to a user input field
-                if col_idx in col_to_field:
-                    field_name = col_to_field[col_idx]
-                    user_value = inputs.get(field_name)
-                    
-                    if user_value is not None and str(user_value).strip() != '':
-                        try:
-                            val = float(user_value)
-                            self._log(f"      替换 {col_letter}{row_num} ({field_name}) = {val} (用户输入)")
-                        except (ValueError, TypeError):
-                            # If can't convert to float, use 0
-                            val = 0
-                            self._log(f"      替换 {col_letter}{row_num} ({field_name}) = {val} (非数值)")
-                    else:
-                        # User didn't provide input, use Excel value
-                        val = ws.cell(ref_row, col_idx).value
-                        if val is None:
-                            val = 0
-                        try:
-                            val = float(val)
-                        except (ValueError, TypeError):
-                            val = 0
-                        self._log(f"      替换 {col_letter}{row_num} ({field_name}) = {val} (Excel默认值)")
-                else:
-                    # Not a user input field, get value from Excel
-                    val = ws.cell(ref_row, col_idx).value
-                    if val is None:
-                        val = 0
+                if user_value is not None and str(user_value).strip() != '':
                     try:
-                        val = float(val)
+                        val = float(user_value)
+                        self.logger.debug("      替换 %s (%s) = %s (用户输入)", cell_name, title, val)
                     except (ValueError, TypeError):
+                        # If can't convert to float, use 0
                         val = 0
-                    header_name = ws.cell(header_row, col_idx).value
-                    self._log(f"      替换 {col_letter}{row_num} ({header_name or 'Unknown'}) = {val} (Excel值)")
+                        self.logger.debug("      替换 %s (%s) = %s (非数值)", cell_name, title, val)
+                    return val
                 
-                # Replace cell reference with value
-                result_str = result_str.replace(f"{col_letter}{row_num}", str(val), 1)
+                # User didn't provide input, use Excel value
+                val = self._to_number(ws.value(ref_row, col_idx))
+                self.logger.debug("      替换 %s (%s) = %s (Excel默认值)", cell_name, title, val)
+                return val
             
-            # Evaluate the expression
-            # Only allow safe characters
-            safe_chars = set('0123456789.+-*/() ')
-            if all(c in safe_chars for c in result_str):
-                self._log(f"      计算表达式: {result_str}")
-                result = eval(result_str)
-                return float(result)
-            else:
-                self._log(f"      不安全的公式表达式: {result_str}")
-                return 0
-                
+            # Not a user input field, get value from Excel
+            val = self._to_number(ws.value(ref_row, col_idx))
+            self.logger.debug("      替换 %s (%s) = %s (Excel值)", cell_name, title or 'Unknown', val)
+            return val
+        
+        try:
+            result = compiled.evaluate(ref)
+            self.logger.debug("      计算表达式: %s = %s", compiled.source, result)
+            return result
         except Exception as e:
             self._log(f"      公式计算错误: {e}")
             return 0
 
-    def _calculate_with_formula(self, ws, ws_formula, sheet_name, row, header_row, inputs):
+    def _to_number(self, val):
+        if val is None:
+            return 0
+        try:
+            return float(val)
+        except (ValueError, TypeError):
+            return 0
+
+    def _calculate_with_formula(self, ws, formulas, sheet_name, row, header_row, inputs):
         """Calculate E2E Cost using formula with user inputs for partial match."""
-        e2e_cost_col = self._get_col_by_header(ws, header_row, 'E2E Cost')
-        e2e_lt_col = self._get_col_by_header(ws, header_row, 'E2E Lead Time')
+        started = time.perf_counter()
+        schema = self.schemas[sheet_name]
+        e2e_cost_col = schema.col('E2E Cost')
+        e2e_lt_col = schema.col('E2E Lead Time')
         
         self._log(f"Calculating with formula at row {row}")
         
-        # Get the formula from the cell
-        formula_cell = ws_formula.cell(row, e2e_cost_col)
-        formula = formula_cell.value
+        # Get the compiled formula of the cell
+        compiled = formulas.get((row, e2e_cost_col))
+        formula = compiled.source if compiled else None
         self._log(f"Formula: {formula}")
         
         total_cost = 0
         
-        # If formula is SUM(range), parse and calculate each cell
-        if formula and isinstance(formula, str) and formula.startswith('=SUM'):
-            # Extract range like N30:AG30
-            range_match = re.search(r'SUM\(([A-Z]+)(\d+):([A-Z]+)(\d+)\)', formula)
-            if range_match:
-                start_col = range_match.group(1)
-                start_row = int(range_match.group(2))
-                end_col = range_match.group(3)
-                end_row = int(range_match.group(4))
+        # If formula is SUM(range), calculate each cell of the range
+        if formula and formula.startswith('=SUM'):
+            # Range like N30:AG30, resolved when the formula was compiled
+            if compiled.ranges:
+                start_row, start_col_idx, end_row, end_col_idx = compiled.ranges[0]
                 
-                start_col_idx = openpyxl.utils.column_index_from_string(start_col)
-                end_col_idx = openpyxl.utils.column_index_from_string(end_col)
-                
-                self._log(f"SUM range: {start_col}{start_row} to {end_col}{end_row}")
+                self._log(f"SUM range: {ref_name(start_row, start_col_idx)} to {ref_name(end_row, end_col_idx)}")
                 
                 for c in range(start_col_idx, end_col_idx + 1):
                     # Get value from both rows of merged cell
-                    row1_val = ws.cell(row, c).value
-                    row2_val = ws.cell(row + 1, c).value
-                    header_val = ws.cell(header_row, c).value
+                    row1_val = ws.value(row, c)
+                    row2_val = ws.value(row + 1, c)
+                    header_val = ws.value(header_row, c)
                     
                     # Check if row2 cell has a formula
-                    formula_val = ws_formula.cell(row + 1, c).value
+                    has_formula = (row + 1, c) in formulas
                     
                     cell_contribution = 0
                     
@@ -663,9 +854,10 @@ class ExcelHandler:
                     if row1_val and 'MIN' in str(row1_val).upper():
                         cell_contribution = self._parse_min_value(row1_val, sheet_name, inputs) or 0
                     # Check if row2 has a formula that references other cells
-                    elif formula_val and isinstance(formula_val, str) and formula_val.startswith('='):
-                        cell_contribution = self._evaluate_cell_formula(ws, ws_formula, formula_val, row, header_row, inputs, sheet_name)
-                        self._log(f"    Col {c} ({header_val}): 公式={formula_val}, 计算值={cell_contribution}")
+                    elif has_formula:
+                        formula_val = formulas[(row + 1, c)]
+                        cell_contribution = self._evaluate_cell_formula(ws, formula_val, header_row, inputs, sheet_name)
+                        self.logger.debug("    Col %s (%s): 公式=%s, 计算值=%s", c, header_val, formula_val.source, cell_contribution)
                     elif row2_val is not None:
                         # Use row2 value directly if it's a number
                         try:
@@ -674,25 +866,25 @@ class ExcelHandler:
                             cell_contribution = 0
                     
                     if cell_contribution > 0:
-                        self._log(f"    Col {c} ({header_val}): {cell_contribution}")
+                        self.logger.debug("    Col %s (%s): %s", c, header_val, cell_contribution)
                     total_cost += cell_contribution
         else:
             # Handle non-SUM formulas (like =D15*N15)
-            if formula and isinstance(formula, str) and formula.startswith('='):
+            if (row, e2e_cost_col) in formulas:
                 self._log(f"Evaluating non-SUM formula: {formula}")
-                total_cost = self._evaluate_cell_formula(ws, ws_formula, formula, row, header_row, inputs, sheet_name)
+                total_cost = self._evaluate_cell_formula(ws, compiled, header_row, inputs, sheet_name)
                 self._log(f"Formula result: {total_cost}")
             else:
                 # Fallback to direct value
-                total_cost = ws.cell(row, e2e_cost_col).value or 0
+                total_cost = ws.value(row, e2e_cost_col) or 0
                 if not total_cost:
-                    total_cost = ws.cell(row + 1, e2e_cost_col).value or 0
+                    total_cost = ws.value(row + 1, e2e_cost_col) or 0
         
         self._log(f"Total calculated cost: {total_cost}")
         
         # Get LT
-        lt_row1 = ws.cell(row, e2e_lt_col).value
-        lt_row2 = ws.cell(row + 1, e2e_lt_col).value
+        lt_row1 = ws.value(row, e2e_lt_col)
+        lt_row2 = ws.value(row + 1, e2e_lt_col)
         
         if self._is_date_format(lt_row2):
             lt = lt_row2
@@ -703,28 +895,32 @@ class ExcelHandler:
         
         lt_str = str(lt).strip() if lt else ""
         
-        breakdown, log_details = self._get_breakdown_merged(ws, ws_formula, sheet_name, row, header_row, inputs)
+        started = self._observe_stage('formula', started)
+        breakdown, log_details = self._get_breakdown_merged(ws, formulas, sheet_name, row, header_row, inputs)
+        self._observe_stage('breakdown', started)
         return total_cost, lt_str, breakdown, log_details
 
-    def _extract_data_from_row(self, ws, ws_formula, sheet_name, row, header_row, inputs):
-        e2e_cost_col = self._get_col_by_header(ws, header_row, 'E2E Cost')
-        e2e_lt_col = self._get_col_by_header(ws, header_row, 'E2E Lead Time')
-        map_col = self._get_col_by_header(ws, header_row, 'MAP')
-        from_col = self._get_col_by_header(ws, header_row, 'From')
-        to_col = self._get_col_by_header(ws, header_row, 'To')
+    def _extract_data_from_row(self, ws, formulas, sheet_name, row, header_row, inputs):
+        started = time.perf_counter()
+        schema = self.schemas[sheet_name]
+        e2e_cost_col = schema.col('E2E Cost')
+        e2e_lt_col = schema.col('E2E Lead Time')
+        map_col = schema.col('MAP')
+        from_col = schema.col('From')
+        to_col = schema.col('To')
         
         self._log(f"E2E Cost column: {e2e_cost_col}, E2E Lead Time column: {e2e_lt_col}")
         
         # Check if this is a single-row entry
         # Method 1: Next row has a different MAP node
-        current_map = ws.cell(row, map_col).value if map_col else None
-        next_map = ws.cell(row + 1, map_col).value if map_col else None
+        current_map = ws.value(row, map_col) if map_col else None
+        next_map = ws.value(row + 1, map_col) if map_col else None
         
         # Method 2: Next row has different From/To values (new record)
-        current_from = ws.cell(row, from_col).value if from_col else None
-        next_from = ws.cell(row + 1, from_col).value if from_col else None
-        current_to = ws.cell(row, to_col).value if to_col else None
-        next_to = ws.cell(row + 1, to_col).value if to_col else None
+        current_from = ws.value(row, from_col) if from_col else None
+        next_from = ws.value(row + 1, from_col) if from_col else None
+        current_to = ws.value(row, to_col) if to_col else None
+        next_to = ws.value(row + 1, to_col) if to_col else None
         
         is_single_row = False
         # If next row has a different MAP node, it's single-row 
@@ -734,21 +930,21 @@ class ExcelHandler:
         elif next_from and str(next_from).strip() and (current_from != next_from or current_to != next_to):
             is_single_row = True
         # If current row has a cost but next row's cost cell has a new MAP value, it's single-row
-        elif ws.cell(row, e2e_cost_col).value and next_map and str(next_map).strip():
+        elif ws.value(row, e2e_cost_col) and next_map and str(next_map).strip():
             is_single_row = True
         
         if is_single_row:
             self._log(f"Single-row data detected (current MAP={current_map}, next MAP={next_map})")
         
-        cost = ws.cell(row, e2e_cost_col).value or 0
+        cost = ws.value(row, e2e_cost_col) or 0
         self._log(f"Cost from row {row}: {cost}")
         
         # Only check row+1 for merged cells (not single-row data)
         if not cost and not is_single_row:
-            cost = ws.cell(row + 1, e2e_cost_col).value or 0
+            cost = ws.value(row + 1, e2e_cost_col) or 0
             self._log(f"Cost from row {row+1}: {cost}")
         
-        lt_row1 = ws.cell(row, e2e_lt_col).value
+        lt_row1 = ws.value(row, e2e_lt_col)
         self._log(f"LT Row {row}: '{lt_row1}'")
         
         # For single-row data, use row1 only
@@ -756,7 +952,7 @@ class ExcelHandler:
             lt = lt_row1
             self._log(f"Selected LT from Row {row} (single-row data)")
         else:
-            lt_row2 = ws.cell(row + 1, e2e_lt_col).value
+            lt_row2 = ws.value(row + 1, e2e_lt_col)
             self._log(f"LT Row {row+1}: '{lt_row2}'")
             
             if self._is_date_format(lt_row2):
@@ -772,57 +968,36 @@ class ExcelHandler:
         lt_str = str(lt).strip() if lt else ""
         self._log(f"Final LT: '{lt_str}'")
 
-        breakdown, log_details = self._get_breakdown_merged(ws, ws_formula, sheet_name, row, header_row, inputs, is_single_row)
+        started = self._observe_stage('formula', started)
+        breakdown, log_details = self._get_breakdown_merged(ws, formulas, sheet_name, row, header_row, inputs, is_single_row)
+        self._observe_stage('breakdown', started)
         return cost, lt_str, breakdown, log_details
 
-    def _get_breakdown_merged(self, ws, ws_formula, sheet_name, row, header_row, inputs=None, is_single_row=False):
+    def _get_breakdown_merged(self, ws, formulas, sheet_name, row, header_row, inputs=None, is_single_row=False):
         base_costs = []
         variable_costs = []
         log_details = []
         
-        breakdown_cols = []
-        for c in range(1, ws.max_column + 1):
-            idx_val = ws.cell(1, c).value
-            if idx_val is not None:
-                try:
-                    int(idx_val)
-                    breakdown_cols.append(c)
-                except (ValueError, TypeError):
-                    if str(idx_val).isdigit():
-                        breakdown_cols.append(c)
-        
-        self._log(f"Breakdown columns: {breakdown_cols}")
+        breakdown_cols = self.schemas[sheet_name].breakdown
+        self._log(f"Breakdown columns: {[col.col for col in breakdown_cols]}")
 
-        for c in breakdown_cols:
-            title = ws.cell(header_row, c).value
-            if not title: continue
-            title_str = str(title).strip()
-            
-            fill = ws.cell(1, c).fill
-            is_green = False
-            if fill and hasattr(fill.start_color, 'rgb'):
-                color_rgb = str(fill.start_color.rgb)
-                if color_rgb in ['FF92D050', '92D050']:
-                    is_green = True
-            
-            val1 = ws.cell(row, c).value
+        for c, title_str, is_green, _ in breakdown_cols:
+            val1 = ws.value(row, c)
             
             # For single-row data, only use current row
             if is_single_row:
                 val2 = val1  # Use same value for display
                 # Check for formula in current row
-                formula_val = ws_formula.cell(row, c).value
-                if inputs and formula_val and isinstance(formula_val, str) and formula_val.startswith('='):
-                    calculated_val = self._evaluate_cell_formula(ws, ws_formula, formula_val, row, header_row, inputs, sheet_name)
+                if inputs and (row, c) in formulas:
+                    calculated_val = self._evaluate_cell_formula(ws, formulas[(row, c)], header_row, inputs, sheet_name)
                     if calculated_val > 0:
                         val2 = calculated_val
             else:
-                val2 = ws.cell(row + 1, c).value
+                val2 = ws.value(row + 1, c)
                 
                 # Check for formula in row2 and evaluate with user inputs
-                formula_val = ws_formula.cell(row + 1, c).value
-                if inputs and formula_val and isinstance(formula_val, str) and formula_val.startswith('='):
-                    calculated_val = self._evaluate_cell_formula(ws, ws_formula, formula_val, row, header_row, inputs, sheet_name)
+                if inputs and (row + 1, c) in formulas:
+                    calculated_val = self._evaluate_cell_formula(ws, formulas[(row + 1, c)], header_row, inputs, sheet_name)
                     if calculated_val > 0:
                         val2 = calculated_val
             
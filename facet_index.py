@@ -0,0 +1,41 @@
+class FacetIndex:
+    """Rows of one lane (or WH node) as bitsets per field value.
+
+    Bit i stands for the i-th row of `rows`. Filtering rows by the fields
+    picked so far is an AND of the bitsets of the picked values, and the
+    count of rows behind an option is the popcount of its bitset within
+    that mask, so cascading option lists never touch the sheet.
+    """
+
+    __slots__ = ('rows', 'fields', 'all')
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fields = {}  # field -> {value: bitset}
+        self.all = (1 << len(self.rows)) - 1
+
+    def add(self, field, pos, value):
+        values = self.fields.setdefault(field, {})
+        values[value] = values.get(value, 0) | (1 << pos)
+
+    def values(self, field):
+        return self.fields.get(field, {})
+
+    def bits(self, field, value):
+        return self.fields.get(field, {}).get(value, 0)
+
+    def count(self, bits, mask):
+        return (bits & mask).bit_count()
+
+    def first_row(self, mask):
+        """Sheet row of the lowest set bit of `mask`, None if it is empty."""
+        if not mask:
+            return None
+        return self.rows[(mask & -mask).bit_length() - 1]
+
+    def __getstate__(self):
+        return self.rows, self.fields
+
+    def __setstate__(self, state):
+        self.rows, self.fields = state
+        self.all = (1 << len(self.rows)) - 1
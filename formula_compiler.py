@@ -0,0 +1,323 @@
+import re
+
+
+class FormulaError(ValueError):
+    pass
+
+
+# Tokens understood by the compiler: numbers, A1 / $A$1 references, function
+# names, operators, parentheses, range colons and argument commas.
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<ref>\$?[A-Z]{1,3}\$?\d+)
+      | (?P<func>[A-Z][A-Z0-9.]*)\s*\(
+      | (?P<op>[-+*/^(),:])
+    )''', re.VERBOSE)
+
+REF_RE = re.compile(r'\$?([A-Z]{1,3})(\$?)(\d+)')
+
+FUNCTIONS = {'SUM': 'sum', 'MIN': 'min', 'MAX': 'max'}
+
+# Largest range a formula may use; a whole-column range on a big sheet is
+# almost certainly a mistake and would be slow to evaluate
+MAX_RANGE_CELLS = 10000
+
+
+# Formulas copied down a column compile to the same code (rows are relative
+# to the formula's own row), so each distinct shape is eval'd only once.
+_CODE_CACHE = {}
+
+
+RANGE_RE = re.compile(r'\$?([A-Z]{1,3})\$?(\d+)\s*:\s*\$?([A-Z]{1,3})\$?(\d+)', re.IGNORECASE)
+
+
+def largest_range(formula):
+    """Cells in the largest A1:B2 style range of a formula's text, found
+    without compiling it (0 if it has none)."""
+    largest = 0
+    for m in RANGE_RE.finditer(formula):
+        c1, r1, c2, r2 = column_index(m.group(1).upper()), int(m.group(2)), column_index(m.group(3).upper()), int(m.group(4))
+        largest = max(largest, (abs(r2 - r1) + 1) * (abs(c2 - c1) + 1))
+    return largest
+
+
+def parse_ref(text):
+    m = REF_RE.fullmatch(text)
+    if not m:
+        raise FormulaError(f"Invalid cell reference: {text}")
+    return int(m.group(3)), column_index(m.group(1))
+
+
+def column_index(letters):
+    """'A' -> 1, 'AB' -> 28"""
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - 64
+    return col
+
+
+# Column number -> letters; importing openpyxl for this alone costs the
+# app a fifth of a second at startup
+_LETTERS = {}
+
+
+def column_letter(col):
+    letters = _LETTERS.get(col)
+    if letters is None:
+        letters, n = '', col
+        while n > 0:
+            n, rem = divmod(n - 1, 26)
+            letters = chr(65 + rem) + letters
+        _LETTERS[col] = letters
+    return letters
+
+
+def ref_name(row, col):
+    return f"{column_letter(col)}{row}"
+
+
+class CompiledFormula:
+    """A formula cell turned into a Python function at load time.
+
+    Cell references are already resolved to (row, col) pairs, so evaluating
+    only needs callbacks that return the value for a referenced cell:
+    ``ref(row, col)`` for direct references and ``rng(row, col)`` for cells
+    inside a range (defaults to ``ref``).
+    """
+
+    __slots__ = ('source', 'row', 'refs', 'ranges', 'code', '_fn')
+
+    def __init__(self, source, row, code, refs, ranges):
+        self.source = source
+        self.row = row
+        self.refs = tuple(refs)
+        self.ranges = tuple(ranges)
+        cached = _CODE_CACHE.get(code)
+        if cached is None:
+            cached = _CODE_CACHE[code] = (code, eval(code, {'_sum': _sum, '_min': _min, '_max': _max,
+                                                            '_cells': _cells}))
+        self.code, self._fn = cached
+
+    def __reduce__(self):
+        # The generated function is rebuilt (once per shape) from its code
+        return CompiledFormula, (self.source, self.row, self.code, self.refs, self.ranges)
+
+    def evaluate(self, ref, rng=None):
+        return float(self._fn(self.row, ref, rng or ref))
+
+    def evaluate_array(self, ref, rng=None):
+        # Result kept as is, so callbacks may return NumPy arrays
+        return self._fn(self.row, ref, rng or ref)
+
+    def evaluate_rows(self, rows, ref, rng=None):
+        # Formulas copied down a column share this code; with `rows` an
+        # array of their rows one call evaluates all of them
+        return self._fn(rows, ref, rng or ref)
+
+    def range_cells(self):
+        for r1, c1, r2, c2 in self.ranges:
+            for r in range(r1, r2 + 1):
+                for c in range(c1, c2 + 1):
+                    yield r, c
+
+    def __repr__(self):
+        return f"CompiledFormula({self.source!r})"
+
+
+class UnsupportedFormula:
+    """Placeholder for a formula cell the compiler cannot handle.
+
+    Evaluating it raises FormulaError, which callers already treat like any
+    other evaluation failure (the cell counts as 0).
+    """
+
+    __slots__ = ('source', 'error', 'refs', 'ranges')
+
+    def __init__(self, source, error):
+        self.source = source
+        self.error = error
+        self.refs = ()
+        self.ranges = ()
+
+    def evaluate(self, ref, rng=None):
+        raise FormulaError(self.error)
+
+    evaluate_array = evaluate
+
+    def range_cells(self):
+        return iter(())
+
+    def __repr__(self):
+        return f"UnsupportedFormula({self.source!r})"
+
+
+def _cells(rng, base, r1, r2, c1, c2):
+    # Values of a range, row by row; `base` is R for relative rows (an int,
+    # or an array when evaluating many rows at once) and 0 for absolute ones
+    return [rng(base + r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1)]
+
+
+def _sum(*parts):
+    return sum(parts)
+
+
+def _min(*parts):
+    return min(parts)
+
+
+def _max(*parts):
+    return max(parts)
+
+
+class _Parser:
+    def __init__(self, text, row):
+        self.tokens = self._tokenize(text)
+        self.row = row
+        self.pos = 0
+        self.refs = []
+        self.ranges = []
+
+    def _tokenize(self, text):
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = TOKEN_RE.match(text, pos)
+            if not m:
+                raise FormulaError(f"Unsupported syntax at '{text[pos:]}'")
+            kind = m.lastgroup
+            tokens.append((kind, m.group(kind)))
+            pos = m.end()
+        return tokens
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        tok = self.peek()
+        if tok[0] is None or (value is not None and tok[1] != value):
+            raise FormulaError(f"Expected {value or 'token'}, got {tok[1]}")
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        code = self.expr()
+        if self.pos != len(self.tokens):
+            raise FormulaError(f"Unexpected token {self.peek()[1]}")
+        return code
+
+    # Precedence follows the eval() based evaluators this replaces:
+    # + - < * / < unary < ^ (right associative)
+    def expr(self):
+        code = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            code = f"({code} {op} {self.term()})"
+        return code
+
+    def term(self):
+        code = self.unary()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            code = f"({code} {op} {self.unary()})"
+        return code
+
+    def unary(self):
+        if self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            return f"({op}{self.unary()})"
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() == ('op', '^'):
+            self.take()
+            return f"({base} ** {self.unary()})"
+        return base
+
+    def atom(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return repr(float(value))
+        if kind == 'ref':
+            if self.peek() == ('op', ':'):
+                raise FormulaError("Ranges are only supported inside functions")
+            row, col = parse_ref(value)
+            self.refs.append((row, col))
+            return f"ref({self.row_code(value, row)}, {col})"
+        if kind == 'func':
+            return self.call(value)
+        if (kind, value) == ('op', '('):
+            code = self.expr()
+            self.take(')')
+            return code
+        raise FormulaError(f"Unexpected token {value}")
+
+    def call(self, name):
+        if name not in FUNCTIONS:
+            raise FormulaError(f"Unsupported function {name}")
+        args = []
+        while self.peek() != ('op', ')'):
+            args.append(self.argument())
+            if self.peek() == ('op', ','):
+                self.take()
+            elif self.peek() != ('op', ')'):
+                raise FormulaError(f"Unexpected token {self.peek()[1]}")
+        self.take(')')
+        if not args:
+            raise FormulaError(f"{name} needs at least one argument")
+        return f"_{FUNCTIONS[name]}({', '.join(args)})"
+
+    def argument(self):
+        kind, value = self.peek()
+        if kind == 'ref' and self.pos + 2 < len(self.tokens) and self.tokens[self.pos + 1] == ('op', ':'):
+            self.pos += 2
+            end_kind, end_value = self.take()
+            if end_kind != 'ref':
+                raise FormulaError(f"Invalid range end {end_value}")
+            r1, c1 = parse_ref(value)
+            r2, c2 = parse_ref(end_value)
+            r1, r2 = min(r1, r2), max(r1, r2)
+            c1, c2 = min(c1, c2), max(c1, c2)
+            size = (r2 - r1 + 1) * (c2 - c1 + 1)
+            if size > MAX_RANGE_CELLS:
+                raise FormulaError(f"Range {value}:{end_value} has {size} cells, more than {MAX_RANGE_CELLS}")
+            self.ranges.append((r1, c1, r2, c2))
+            absolute = '$' in value.lstrip('$') and '$' in end_value.lstrip('$')
+            if absolute:
+                return f"*_cells(rng, 0, {r1}, {r2}, {c1}, {c2})"
+            return f"*_cells(rng, R, {r1 - self.row}, {r2 - self.row}, {c1}, {c2})"
+        return self.expr()
+
+    def row_code(self, text, row):
+        # $-anchored rows stay absolute, other rows are relative to R
+        if REF_RE.fullmatch(text).group(2):
+            return str(row)
+        return f"R + {row - self.row}"
+
+
+def compile_formula(formula, row=0):
+    """Compile the '=...' formula of a cell in `row`; raises FormulaError if unsupported."""
+    if not isinstance(formula, str) or not formula.startswith('='):
+        raise FormulaError(f"Not a formula: {formula!r}")
+    parser = _Parser(formula[1:].strip().upper(), row)
+    body = parser.parse()
+    return CompiledFormula(formula, row, f"lambda R, ref, rng: {body}", parser.refs, parser.ranges)
+
+
+def compile_sheet_formulas(sheet, log=None):
+    """Compile every formula cell of a loaded sheet (see workbook_loader).
+
+    Returns {(row, col): CompiledFormula}; formulas that cannot be compiled
+    map to an UnsupportedFormula so they still count as formula cells.
+    """
+    compiled = {}
+    for cell, text in sheet.formulas.items():
+        try:
+            compiled[cell] = compile_formula(text, cell[0])
+        except FormulaError as e:
+            compiled[cell] = UnsupportedFormula(text, str(e))
+            if log:
+                log(f"Cannot compile formula at {ref_name(*cell)} '{text}': {e}")
+    return compiled
@@ -0,0 +1,159 @@
+from formula_compiler import ref_name
+
+
+class FormulaGraph:
+    """Dependency graph over the compiled formula cells of one sheet.
+
+    Built once at load: formula cells are put in topological order, cycles are
+    detected (cells on a cycle evaluate to 0 instead of recursing forever) and
+    every cell is evaluated once without user inputs to get its constant value.
+
+    A user input named after a column header replaces a reference to that
+    column when the reference is in the same row as the formula, and replaces
+    any plain value cell of that column inside a SUM range. Per request only
+    the cells whose value can depend on the supplied input names are
+    recomputed, each at most once; everything else comes from the constants.
+    """
+
+    def __init__(self, formulas, header_names, cell_value, log=None, trace=None):
+        self.formulas = formulas
+        self.header_names = header_names
+        self.cell_value = cell_value
+        self.log = log or (lambda msg: None)
+        # Per-cell trace, called logging style: trace(fmt, *args)
+        self.trace = trace or (lambda msg, *args: None)
+
+        self.children = {cell: self._children(cell, f) for cell, f in formulas.items()}
+        self.cyclic = set()
+        self.order = self._toposort()
+        self.position = {cell: i for i, cell in enumerate(self.order)}
+        self.input_deps = self._collect_input_deps()
+        self.depth = self._collect_depth()
+
+        self.constants = {}
+        for cell in self.order:
+            self.constants[cell] = self._evaluate_cell(cell, {}, self.constants)
+        if self.cyclic:
+            self.log(f"Circular references detected, evaluated as 0: {sorted(ref_name(*c) for c in self.cyclic)}")
+
+    def _children(self, cell, compiled):
+        children = []
+        for ref in list(compiled.refs) + list(compiled.range_cells()):
+            if ref in self.formulas and ref not in children:
+                children.append(ref)
+        return children
+
+    def _toposort(self):
+        order = []
+        state = {}  # cell -> 1 while on the DFS stack, 2 when finished
+        for root in self.formulas:
+            if root in state:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self.children[root]))]
+            path = [root]
+            while stack:
+                cell, it = stack[-1]
+                child = next(it, None)
+                if child is None:
+                    stack.pop()
+                    path.pop()
+                    state[cell] = 2
+                    order.append(cell)
+                elif child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(self.children[child])))
+                    path.append(child)
+                elif state[child] == 1:
+                    self.cyclic.update(path[path.index(child):])
+        return order
+
+    def _collect_input_deps(self):
+        deps = {}
+        for cell in self.order:
+            row = cell[0]
+            compiled = self.formulas[cell]
+            names = set()
+            for r, c in compiled.refs:
+                header = self.header_names.get(c)
+                if header and r == row:
+                    names.add(header)
+            for r, c in compiled.range_cells():
+                header = self.header_names.get(c)
+                if header and (r, c) not in self.formulas:
+                    names.add(header)
+            for child in self.children[cell]:
+                names |= deps.get(child, set())
+            deps[cell] = frozenset(names)
+        return deps
+
+    def _collect_depth(self):
+        depth = {}
+        for cell in self.order:
+            depth[cell] = 1 + max((depth.get(child, 0) for child in self.children[cell]), default=0)
+        return depth
+
+    def is_formula(self, cell):
+        return cell in self.formulas
+
+    def evaluate(self, cells, inputs):
+        """Evaluate formula cells for one request, sharing a single memo."""
+        names = set(inputs)
+        dirty = set()
+        stack = [cell for cell in cells if self.input_deps.get(cell, frozenset()) & names]
+        while stack:
+            cell = stack.pop()
+            if cell in dirty:
+                continue
+            dirty.add(cell)
+            stack.extend(child for child in self.children[cell]
+                         if child not in dirty and self.input_deps[child] & names)
+
+        memo = {}
+        for cell in sorted(dirty, key=self.position.get):
+            memo[cell] = self._evaluate_cell(cell, inputs, memo)
+            self.trace("      Formula at %s evaluated to: %s", ref_name(*cell), memo[cell])
+        return {cell: memo[cell] if cell in memo else self.constants[cell] for cell in cells}
+
+    def _formula_value(self, cell, memo):
+        if cell in memo:
+            return memo[cell]
+        return self.constants.get(cell, 0.0)
+
+    def _evaluate_cell(self, cell, inputs, memo):
+        if cell in self.cyclic:
+            return 0.0
+        row = cell[0]
+        formulas = self.formulas
+        header_names = self.header_names
+
+        def ref(r, c):
+            header = header_names.get(c)
+            if header and header in inputs and r == row:
+                try:
+                    val = float(inputs[header])
+                    self.trace("      Replacing %s with User Input '%s': %s", ref_name(r, c), header, val)
+                    return val
+                except (ValueError, TypeError):
+                    return 0.0
+            if (r, c) in formulas:
+                return self._formula_value((r, c), memo)
+            return self.cell_value(r, c)
+
+        # Cells inside SUM(Range)
+        def rng(r, c):
+            if (r, c) in formulas:
+                return self._formula_value((r, c), memo)
+            header = header_names.get(c)
+            if header and header in inputs:
+                try:
+                    return float(inputs[header])
+                except (ValueError, TypeError):
+                    return 0.0
+            return self.cell_value(r, c)
+
+        try:
+            return formulas[cell].evaluate(ref, rng)
+        except Exception as e:
+            self.log(f"Error evaluating {formulas[cell].source}: {e}")
+            return 0.0
@@ -106,6 +106,18 @@ function App() {
         return path.includes('warehouse') ? 'warehouse' : 'shipping'
     })
     const fileInputRef = useRef(null)
+    // Workbook this page priced against; unset means the built-in one
+    const workbookIdRef = useRef(null)
+    const workbookParams = () => ({ params: { workbook_id: workbookIdRef.current || undefined } })
+    // Uploaded workbooks are parsed in the background; wait until published
+    const waitForWorkbook = async (status) => {
+        while (status.status === 'loading') {
+            await new Promise(resolve => setTimeout(resolve, 500))
+            status = (await axios.get(`/api/workbooks/${status.workbook_id}`)).data
+        }
+        if (status.status === 'failed') throw new Error(status.error)
+        return status
+    }
 
     useEffect(() => {
         fetchRoutes()
@@ -113,7 +125,7 @@ function App() {
 
     const fetchRoutes = async () => {
         try {
-            const res = await axios.get('/api/routes')
+            const res = await axios.get('/api/routes', workbookParams())
             setRouteOptions(res.data)
         } catch (err) {
             console.error("Error fetching routes", err)
@@ -379,7 +391,7 @@ function App() {
 
     const updateFields = async (nodeId, node, location) => {
         try {
-            const res = await axios.post('/api/fields', { node, location })
+            const res = await axios.post('/api/fields', { node, location }, workbookParams())
             const newNodes = [...selectedNodes]
             const idx = newNodes.findIndex(n => n.id === nodeId)
             newNodes[idx].fields = res.data
@@ -403,7 +415,8 @@ function App() {
         const formData = new FormData()
         formData.append('file', file)
         try {
-            await axios.post('/api/upload', formData)
+            const res = await axios.post('/api/upload', formData)
+            workbookIdRef.current = (await waitForWorkbook(res.data)).workbook_id
             setCurrentFile(file.name)
             setFileMessage(`已加载自定义文件: ${file.name}`)
             setTimeout(() => setFileMessage(''), 5000)
@@ -415,7 +428,8 @@ function App() {
 
     const loadBuiltin = async () => {
         try {
-            await axios.post('/api/load-builtin')
+            const res = await axios.post('/api/load-builtin')
+            workbookIdRef.current = (await waitForWorkbook(res.data)).workbook_id
             setCurrentFile('Built-in Template')
             setFileMessage('已加载内置模板')
             setTimeout(() => setFileMessage(''), 5000)
@@ -452,7 +466,7 @@ function App() {
                 location: n.location,
                 inputs: n.inputs
             }))
-            const res = await axios.post('/api/calculate', payload)
+            const res = await axios.post('/api/calculate', payload, workbookParams())
             setResults(res.data)
 
             const updatedNodes = [...selectedNodes]
@@ -102,6 +102,18 @@ export default function WarehouseCalculator() {
     const [fileMessage, setFileMessage] = useState('')
     const [currentFile, setCurrentFile] = useState('Built-in Template')
     const fileInputRef = useRef(null)
+    // Workbook this page priced against; unset means the built-in one
+    const workbookIdRef = useRef(null)
+    const workbookParams = () => ({ params: { workbook_id: workbookIdRef.current || undefined } })
+    // Uploaded workbooks are parsed in the background; wait until published
+    const waitForWorkbook = async (status) => {
+        while (status.status === 'loading') {
+            await new Promise(resolve => setTimeout(resolve, 500))
+            status = (await axios.get(`/api/wh/workbooks/${status.workbook_id}`)).data
+        }
+        if (status.status === 'failed') throw new Error(status.error)
+        return status
+    }
 
     // Map editing states
     const [mapEditMode, setMapEditMode] = useState(false)
@@ -136,7 +148,7 @@ export default function WarehouseCalculator() {
 
     const fetchRoutes = async () => {
         try {
-            const res = await axios.get('/api/wh/routes')
+            const res = await axios.get('/api/wh/routes', workbookParams())
             setRouteOptions(res.data || {})
         } catch (err) {
             console.error("Error fetching WH routes", err)
@@ -152,7 +164,8 @@ export default function WarehouseCalculator() {
         formData.append('file', file)
 
         try {
-            await axios.post('/api/wh/upload', formData)
+            const res = await axios.post('/api/wh/upload', formData)
+            workbookIdRef.current = (await waitForWorkbook(res.data)).workbook_id
             setCurrentFile(file.name)
             setFileMessage(`已加载自定义文件: ${file.name}`)
             setTimeout(() => setFileMessage(''), 5000)
@@ -164,7 +177,8 @@ export default function WarehouseCalculator() {
 
     const loadBuiltin = async () => {
         try {
-            await axios.post('/api/wh/load-builtin')
+            const res = await axios.post('/api/wh/load-builtin')
+            workbookIdRef.current = (await waitForWorkbook(res.data)).workbook_id
             setCurrentFile('Built-in Template')
             setFileMessage('已加载内置模板')
             setTimeout(() => setFileMessage(''), 5000)
@@ -352,7 +366,7 @@ export default function WarehouseCalculator() {
 
     const updateFields = async (nodeId, node, location, currentInputs) => {
         try {
-            const res = await axios.post('/api/wh/fields', { node, location, inputs: currentInputs })
+            const res = await axios.post('/api/wh/fields', { node, location, inputs: currentInputs }, workbookParams())
             const newNodes = [...selectedNodes]
             const idx = newNodes.findIndex(n => n.id === nodeId)
             const nodeToUpdate = newNodes[idx]
@@ -395,7 +409,7 @@ export default function WarehouseCalculator() {
                 location: n.location,
                 inputs: n.inputs
             }))
-            const res = await axios.post('/api/wh/calculate', payload)
+            const res = await axios.post('/api/wh/calculate', payload, workbookParams())
             setResults(res.data)
             setLogs(res.data.logs || [])
             setShowLogs(true)
@@ -0,0 +1,36 @@
+import gc
+import os
+
+# gunicorn binds to $PORT on its own; WEB_CONCURRENCY sets the worker count
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = 120
+
+# Load the app, and with it the built-in pricing models, once in the
+# master. Workers are forked from it and share those pages copy-on-write;
+# the sheet value grids are memory mapped from the model cache and are
+# shared through the page cache either way.
+preload_app = True
+
+
+def on_starting(server):
+    # Metrics snapshots of the workers of an earlier run
+    from metrics import REGISTRY
+    REGISTRY.clear()
+
+
+def post_worker_init(worker):
+    # With LAZY_STARTUP the master imported the app without its workbooks;
+    # each worker loads them in the background and answers /healthz/ready
+    # with 503 until they are in. Workers then start sooner but each holds
+    # its own copy of the models (and starts its own builder process)
+    # instead of sharing the master's pages, so it is off by default and
+    # best kept for single-worker or memory-rich deployments
+    from app import LAZY_STARTUP, warmup
+    if LAZY_STARTUP:
+        warmup.start()
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's generations, so
+    # a collection in a worker does not write to (and so copy) those pages
+    gc.freeze()
@@ -0,0 +1,310 @@
+import re
+
+import numpy as np
+
+# Inputs that price an option instead of picking its row; every other input
+# narrows the rows of the sheets that have that column
+PLAN_FIELDS = ('PALLET QTY', 'CBM', 'G/W', 'Truck times')
+
+
+class LaneCosts:
+    """E2E cost of every row of one lane as a function of the numeric inputs.
+
+    Built at load from the lane's candidate rows. Each row is one option:
+    its own field values (`options`, in the form calculate() takes them)
+    with the caller's PLAN_FIELDS on top. For such an option calculate()
+    returns the row's cached cost when the numeric inputs match the row
+    exactly and evaluates the row's formula otherwise; both are kept here
+    in array form, so pricing all rows for one set of inputs is a handful
+    of NumPy operations instead of one calculate() per row:
+
+    - `cached_cost` / `cached_lt`: what the exact tier returns,
+    - `const`: the formula tier's constant part (plain cells of the SUM
+      range, or the E2E Cost value itself when it has no formula),
+    - `min_terms`: MIN rate cells as max(rate * input, minimum),
+    - `formula_groups`: formula cells by compiled code, each code evaluated
+      once with the rows as an array.
+    """
+
+    def __init__(self, sheet_name, rows, options):
+        self.sheet_name = sheet_name
+        self.rows = np.array(rows, dtype=np.int64)
+        self.options = options
+        n = len(rows)
+        self.cached_cost = np.zeros(n)
+        self.cached_lt = [''] * n
+        self.formula_lt = [''] * n
+        self.const = np.zeros(n)
+        # (positions, rate, minimum) per driving input field
+        self.min_terms = {}
+        # code -> (positions, formula rows, a CompiledFormula of that code)
+        self.formula_groups = {}
+        # str() of the row's value per numeric field, for the exact tier
+        self.match_text = {}
+        # Row's own numeric value per field (NaN where the option has none)
+        self.own_numbers = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add_min_term(self, pos, field, rate, minimum):
+        terms = self.min_terms.setdefault(field, ([], [], []))
+        for values, value in zip(terms, (pos, rate, minimum)):
+            values.append(value)
+
+    def add_formula(self, pos, compiled):
+        group = self.formula_groups.setdefault(compiled.code, ([], [], compiled))
+        group[0].append(pos)
+        group[1].append(compiled.row)
+
+    def freeze(self):
+        """Turn the term lists into arrays once all rows are added."""
+        self.min_terms = {field: tuple(np.array(values) for values in terms)
+                          for field, terms in self.min_terms.items()}
+        self.formula_groups = {code: (np.array(pos, dtype=np.int64), np.array(rows, dtype=np.int64), compiled)
+                               for code, (pos, rows, compiled) in self.formula_groups.items()}
+        self.lt_ranges = np.array([lt_range(lt) for lt in self.cached_lt] +
+                                  [lt_range(lt) for lt in self.formula_lt], dtype=np.int64).reshape(2, -1, 2)
+
+    def evaluate(self, ws, schema, inputs):
+        """(cost, exact, lt) of every row for the numeric `inputs`.
+
+        `inputs` maps PLAN_FIELDS to their text (see plan_inputs); `exact`
+        marks the rows whose cached cost applies and `lt` is each row's
+        lead time text.
+        """
+        n = len(self.rows)
+        exact = np.ones(n, dtype=bool)
+        for field, text in inputs.items():
+            if field in self.match_text:
+                exact &= self.match_text[field] == text
+
+        numbers = {field: np.full(n, float(text)) for field, text in inputs.items()}
+        for field, own in self.own_numbers.items():
+            numbers.setdefault(field, own)
+
+        cost = self.const.copy()
+        for field, (pos, rate, minimum) in self.min_terms.items():
+            driver = numbers.get(field)
+            if field == 'G/W' and driver is None:
+                driver = numbers.get('GW')
+            driver = np.zeros(n) if driver is None else np.nan_to_num(driver, nan=0.0)
+            np.add.at(cost, pos, np.maximum(rate * driver[pos], minimum))
+        for pos, rows, compiled in self.formula_groups.values():
+            np.add.at(cost, pos, self._evaluate_group(ws, schema, numbers, pos, rows, compiled))
+
+        cost = np.where(exact, self.cached_cost, cost)
+        lt = [cached if is_exact else formula
+              for cached, formula, is_exact in zip(self.cached_lt, self.formula_lt, exact)]
+        return cost, exact, lt
+
+    def allowed(self, schema, filters):
+        """Rows without another value in a column the caller filtered on."""
+        filters = {field: val for field, val in filters.items() if field in schema.input_pos}
+        return np.array([all(option.get(field, '') == val for field, val in filters.items())
+                         for option in self.options], dtype=bool)
+
+    def lt_bounds(self, exact):
+        """(min, max) lead time days per row, of the tier `exact` picked."""
+        return np.where(exact[:, None], self.lt_ranges[0], self.lt_ranges[1])
+
+    def _evaluate_group(self, ws, schema, numbers, pos, rows, compiled):
+        header_cols = schema.header_cols
+        col_titles = schema.col_titles
+
+        def ref(ref_rows, col):
+            ref_rows = np.broadcast_to(ref_rows, pos.shape)
+            excel = np.array([_to_number(ws.value(int(r), col)) for r in ref_rows])
+            title = col_titles.get(col)
+            if title is not None and header_cols.get(title) == col and title in numbers:
+                option = numbers[title][pos]
+                return np.where(np.isnan(option), excel, option)
+            return excel
+
+        try:
+            with np.errstate(all='ignore'):
+                result = np.broadcast_to(np.asarray(compiled.evaluate_rows(rows, ref), dtype=float), pos.shape)
+            return np.where(np.isfinite(result), result, 0.0)
+        except Exception:
+            pass
+        # MIN()/MAX() and friends do not take arrays; one row at a time
+        result = np.zeros(len(pos))
+        for i in range(len(pos)):
+            try:
+                result[i] = compiled.evaluate_rows(int(rows[i]), lambda r, c: float(ref(r, c)[i]))
+            except Exception:
+                result[i] = 0.0
+        return result
+
+
+def build_lane_costs(handler, sheet_names=None):
+    """LaneCosts of every lane of the route sheets (those in `sheet_names`
+    if given), {sheet: {(node, from, to): LaneCosts}}."""
+    costs = {}
+    for sheet_name, sheet_index in handler.lane_index.items():
+        if sheet_names is not None and sheet_name not in sheet_names: continue
+        ws = handler.wb[sheet_name]
+        schema = handler.schemas[sheet_name]
+        formulas = handler.compiled_formulas.get(sheet_name, {})
+        titles = schema.input_titles or ()
+        e2e_cost_col = schema.col('E2E Cost')
+        numeric_fields = [field for field in PLAN_FIELDS if field in schema.header_cols]
+        lanes = costs[sheet_name] = {}
+        for key, records in sheet_index["lanes"].items():
+            options = [_own_inputs(handler, titles, rec.fields) for rec in records]
+            lane = lanes[key] = LaneCosts(sheet_name, [rec.row for rec in records], options)
+            for pos, (rec, option) in enumerate(zip(records, options)):
+                row = rec.row
+                cost, lt = handler._extract_data_from_row(ws, formulas, sheet_name, row, schema.header_row, option)[:2]
+                lane.cached_cost[pos] = handler._to_number(cost)
+                lane.cached_lt[pos] = lt
+                lane.formula_lt[pos] = handler._calculate_with_formula(ws, formulas, sheet_name, row, schema.header_row, option)[1]
+                if e2e_cost_col:
+                    _add_formula_terms(handler, ws, formulas, sheet_name, lane, pos, row, e2e_cost_col)
+
+            for field in numeric_fields:
+                pos = schema.input_pos.get(field)
+                col = schema.col(field)
+                values = [rec.fields[pos] if pos is not None else handler._merged_value(ws, rec.row, col)
+                          for rec in records]
+                lane.match_text[field] = np.array([str(v).strip() for v in values], dtype=object)
+            for field in set(numeric_fields) | {title for option in options for title in option}:
+                own = [option.get(field) for option in options]
+                if any(v is not None for v in own):
+                    lane.own_numbers[field] = np.array([np.nan if v is None else _to_number(v) for v in own])
+            lane.freeze()
+    return costs
+
+
+def _own_inputs(handler, titles, fields):
+    inputs = {}
+    for title, value in zip(titles, fields or ()):
+        if value is None or str(value).strip() in ('', 'N/A'): continue
+        if title == 'SUMMARY':
+            value = handler.SUMMARY_NAMES.get(value, value)
+        inputs[title] = str(value).strip()
+    return inputs
+
+
+def _add_formula_terms(handler, ws, formulas, sheet_name, lane, pos, row, e2e_cost_col):
+    """Split the formula tier of ExcelHandler._calculate_with_formula into terms."""
+    compiled = formulas.get((row, e2e_cost_col))
+    formula = compiled.source if compiled else None
+    if formula and formula.startswith('=SUM'):
+        if not compiled.ranges:
+            return
+        start_row, start_col, end_row, end_col = compiled.ranges[0]
+        for c in range(start_col, end_col + 1):
+            row1_val = ws.value(row, c)
+            row2_val = ws.value(row + 1, c)
+            if row1_val and 'MIN' in str(row1_val).upper():
+                rule = handler._parse_min_rule(row1_val, sheet_name)
+                if rule is not None:
+                    base_rate, factor, field, min_val = rule
+                    lane.add_min_term(pos, field, base_rate * factor, min_val)
+            elif (row + 1, c) in formulas:
+                _add_formula(lane, pos, formulas[(row + 1, c)])
+            elif row2_val is not None:
+                lane.const[pos] += _to_number(row2_val)
+    elif compiled is not None:
+        _add_formula(lane, pos, compiled)
+    else:
+        lane.const[pos] = _to_number(ws.value(row, e2e_cost_col) or ws.value(row + 1, e2e_cost_col) or 0)
+
+
+def _add_formula(lane, pos, compiled):
+    # An unsupported formula evaluates to 0 in calculate() as well
+    if hasattr(compiled, 'code'):
+        lane.add_formula(pos, compiled)
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def plan_inputs(inputs):
+    """The given PLAN_FIELDS of `inputs` as stripped text, which is what
+    exact matching compares; raises ValueError for a non-number."""
+    texts = {}
+    for field in PLAN_FIELDS:
+        value = (inputs or {}).get(field)
+        if value is None or str(value).strip() == '':
+            continue
+        try:
+            float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"'{field}' must be a number")
+        texts[field] = str(value).strip()
+    return texts
+
+
+def lt_range(lt):
+    """(min, max) days of a lead time text, as ExcelHandler._aggregate_lt reads it."""
+    nums = re.findall(r'\d+', str(lt or ''))
+    if len(nums) == 1:
+        return int(nums[0]), int(nums[0])
+    if len(nums) >= 2:
+        return int(nums[0]), int(nums[1])
+    return 0, 0
+
+
+def cost_frontier(handler, selection):
+    """Cost vs lead time Pareto frontier of the options of one lane.
+
+    `selection` is a calculate() section (node, location, inputs). Every
+    candidate row of the lane is an option priced for the numeric inputs;
+    any other input only keeps the options with that value. Returns the
+    options no other one beats on both cost and lead time (upper bound in
+    days), fastest first, so each is the cheapest way to arrive within its
+    lead time. Options without a price or a lead time are left out.
+    Raises ValueError for an invalid request.
+    """
+    node = selection.get('node')
+    location = selection.get('location')
+    inputs = selection.get('inputs') or {}
+    if not node or not location or '->' not in location:
+        raise ValueError("Missing node or location")
+    numbers = plan_inputs(inputs)
+    filters = {field: str(val).strip() for field, val in inputs.items()
+               if field not in PLAN_FIELDS and val is not None and str(val).strip() != ''}
+
+    sheet_name = handler._get_sheet_for_node(node)
+    if not sheet_name:
+        raise ValueError(f"No sheet found for node {node}")
+    frm_target, to_target = [s.strip() for s in location.split('->')]
+    lane = handler.lane_costs.get(sheet_name, {}).get((node, frm_target, to_target))
+    if lane is None:
+        raise ValueError(f"未找到匹配: {frm_target} -> {to_target}")
+
+    schema = handler.schemas[sheet_name]
+    cost, exact, lt = lane.evaluate(handler.wb[sheet_name], schema, numbers)
+    days = lane.lt_bounds(exact)
+    allowed = lane.allowed(schema, filters)
+    candidates = np.flatnonzero(allowed & (cost > 0) & (days[:, 1] > 0))
+
+    # Fastest first, cheapest first within a lead time; an option is on the
+    # frontier when it is cheaper than every faster (or equally fast) one
+    order = candidates[np.lexsort((cost[candidates], days[candidates, 1]))]
+    ranked = cost[order]
+    best_before = np.minimum.accumulate(np.concatenate(([np.inf], ranked[:-1])))
+    frontier = order[ranked < best_before]
+    handler._log(f"FRONTIER {node} {location}: {len(frontier)} of {len(candidates)} options, rows {lane.rows[frontier].tolist()}")
+
+    options = [{
+        "inputs": dict(lane.options[i], **{field: text for field, text in numbers.items() if field in schema.header_cols}),
+        "row": int(lane.rows[i]),
+        "cost": float(cost[i]),
+        "lt": lt[i],
+        "lt_days": days[i].tolist(),
+        "exact": bool(exact[i]),
+    } for i in frontier]
+    return {
+        "node": node,
+        "location": location,
+        "options": options,
+        "candidates": int(len(candidates)),
+        "dominated": int(len(candidates) - len(frontier)),
+    }
@@ -0,0 +1,142 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import RotatingFileHandler
+
+# Level of the handler loggers; per-row / per-field traces are DEBUG
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 5 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 3))
+LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT', '1') != '0'
+
+# Records written per batch before the handlers are flushed
+BATCH_SIZE = 512
+
+_STOP = object()
+
+
+class _BatchFlush:
+    """Handler mixin: emit() does not flush, the writer flushes once per batch."""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class _FileHandler(_BatchFlush, RotatingFileHandler):
+    pass
+
+
+class _ConsoleHandler(_BatchFlush, logging.StreamHandler):
+    pass
+
+
+class _QueueHandler(logging.Handler):
+    # Unlike logging.handlers.QueueHandler the record is not formatted here,
+    # so the calling thread only pays for the put()
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        self.writer.queue.put(record)
+
+
+class LogWriter:
+    """Background thread that writes queued log records in batches."""
+
+    def __init__(self):
+        self.handlers = {}
+        self._start()
+
+    def _start(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def add_handlers(self, name, handlers):
+        self.handlers.setdefault(name, []).extend(handlers)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            touched = set()
+            for record in batch:
+                if record is _STOP:
+                    self._flush(touched)
+                    return
+                if isinstance(record, threading.Event):
+                    # flush_logs() waiting for everything queued before it
+                    self._flush(touched)
+                    record.set()
+                    continue
+                for handler in self.handlers.get(record.name, ()):
+                    handler.handle(record)
+                    touched.add(handler)
+            self._flush(touched)
+
+    def _flush(self, handlers):
+        for handler in handlers:
+            try:
+                handler.flush_batch()
+            except Exception as e:
+                sys.stderr.write(f"Error writing log: {e}\n")
+
+    def stop(self):
+        """Write out everything queued so far and stop the thread."""
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout=5)
+
+    def after_fork(self):
+        # The thread does not survive fork(); the child needs its own
+        self._start()
+
+
+_writer = LogWriter()
+atexit.register(_writer.stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_writer.after_fork)
+
+_setup_lock = threading.Lock()
+
+
+def get_logger(name, file_name, prefix=''):
+    """Logger `name` writing '[time] prefix message' lines to `file_name`
+    (in the working directory, rotated by size) and to stdout, through the
+    background writer. Configured once per process."""
+    logger = logging.getLogger(name)
+    with _setup_lock:
+        if getattr(logger, '_pipeline_configured', False):
+            return logger
+        formatter = logging.Formatter(f'[%(asctime)s] {prefix}%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+        handlers = [_FileHandler(os.path.join(os.getcwd(), file_name), maxBytes=LOG_MAX_BYTES,
+                                 backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)]
+        if LOG_TO_STDOUT:
+            handlers.append(_ConsoleHandler(sys.stdout))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        _writer.add_handlers(name, handlers)
+
+        logger.addHandler(_QueueHandler(_writer))
+        logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        logger.propagate = False
+        logger._pipeline_configured = True
+    return logger
+
+
+def flush_logs(timeout=5):
+    """Block until everything logged so far has been written."""
+    done = threading.Event()
+    _writer.queue.put(done)
+    done.wait(timeout)
@@ -0,0 +1,242 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Every process writes its metrics here; /metrics adds them all up, so a
+# scrape sees the whole gunicorn server whichever worker answers it
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, '.metrics'))
+PUBLISH_INTERVAL = float(os.environ.get('METRICS_PUBLISH_INTERVAL', 5))
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+DEPTH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values -> count
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Histogram:
+    """Observations counted into fixed buckets, per label values.
+
+    Each observation is one bisect and a few list updates under a lock, so
+    the hot paths can be timed on every request.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [count per bucket and +Inf, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            return [[list(labels), [list(counts), total]] for labels, (counts, total) in self.values.items()]
+
+
+class Callback:
+    """Values read from `collect()` (label values -> number) when published,
+    for numbers other objects already keep, like the result cache stats."""
+
+    def __init__(self, name, help, labelnames, collect, kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        return [[list(labels), value] for labels, value in self.collect().items()]
+
+
+class MetricsRegistry:
+    """The metrics of this process, shared with the other workers through
+    one snapshot file per process in `directory`.
+
+    Snapshot files of exited workers are kept until the directory is
+    cleared at server start, so counters only ever go up.
+    """
+
+    def __init__(self, directory=METRICS_DIR, interval=PUBLISH_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.metrics = []
+        self.lock = threading.Lock()
+        self.publisher_pid = None
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=SECONDS_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, labelnames, collect, kind='gauge'):
+        return self._add(Callback(name, help, labelnames, collect, kind))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        snap = {}
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                samples = []
+            snap[metric.name] = samples
+        return snap
+
+    def start_publisher(self):
+        """Write this process's snapshot every `interval` seconds from a
+        background thread. Safe to call on every request: the thread is
+        started once per process (a forked worker starts its own)."""
+        if self.publisher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.publisher_pid == os.getpid():
+                return
+            self.publisher_pid = os.getpid()
+            threading.Thread(target=self._publish_loop, name='metrics-publisher', daemon=True).start()
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception:
+                pass
+
+    def publish(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        """Drop the snapshots of an earlier server run (call before the workers start)."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') or name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def collect(self):
+        """Samples of every metric summed over all processes, this one up to date."""
+        own = f"{os.getpid()}.json"
+        snapshots = [self.snapshot()]
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == own:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        merged = {}
+        for metric in self.metrics:
+            values = merged[metric.name] = {}
+            for snap in snapshots:
+                for labels, value in snap.get(metric.name, ()):
+                    labels = tuple(labels)
+                    if metric.kind == 'histogram':
+                        counts, total = value
+                        if len(counts) != len(metric.buckets) + 1:
+                            continue
+                        entry = values.setdefault(labels, [[0] * len(counts), 0.0])
+                        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                        entry[1] += total
+                    else:
+                        values[labels] = values.get(labels, 0) + value
+        return merged
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        merged = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in sorted(merged[metric.name].items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == 'histogram':
+                    counts, total = value
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + ('+Inf',), counts):
+                        cumulative += count
+                        lines.append(f"{metric.name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_labels(pairs)} {_number(total)}")
+                    lines.append(f"{metric.name}_count{_labels(pairs)} {cumulative}")
+                else:
+                    lines.append(f"{metric.name}{_labels(pairs)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'rate_http_request_duration_seconds', "Time to build the response, by route", ('route', 'method'))
+HTTP_REQUESTS = REGISTRY.counter(
+    'rate_http_requests_total', "Responses by route and status", ('route', 'method', 'status'))
+CALCULATE_STAGE_SECONDS = REGISTRY.histogram(
+    'rate_calculate_stage_seconds', "Time spent per calculate() stage and section", ('handler', 'stage'))
+MATCH_TIER = REGISTRY.counter(
+    'rate_match_tier_total', "Sections by the match tier that answered them", ('handler', 'tier'))
+ROWS_SCANNED = REGISTRY.histogram(
+    'rate_match_rows_scanned', "Candidate rows compared per section", ('handler',), ROW_BUCKETS)
+FORMULA_DEPTH = REGISTRY.histogram(
+    'rate_formula_depth', "Formula dependency depth of the evaluated cost cell", ('handler',), DEPTH_BUCKETS)
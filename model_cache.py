@@ -0,0 +1,169 @@
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import time
+
+# Bump whenever the loader, formula compiler or index layout changes so that
+# cache files written by an older engine are ignored and rebuilt.
+ENGINE_VERSION = 8
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', os.path.join(BASE_DIR, '.model_cache'))
+
+# File layout: header, buffer table, pickle, then the out-of-band buffers
+# (the sheet value grids) aligned to 8 bytes so they can be used in place.
+MAGIC = b'RATEMDL\0'
+HEADER = struct.Struct('<8sI32sQI')  # magic, engine version, sha256, pickle size, buffer count
+BUFFER_ENTRY = struct.Struct('<QQ')  # offset, size
+
+
+def file_digest(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def cache_path(kind, digest):
+    return os.path.join(CACHE_DIR, f"{kind}-{digest.hex()[:32]}-v{ENGINE_VERSION}.model")
+
+
+def source_path(kind, file_path):
+    # Names the cache file a workbook path last used
+    key = hashlib.sha256(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{kind}-{key}.source")
+
+
+def load_model(file_path, kind, build, log=None):
+    """Return the compiled model of a workbook, going through the on-disk cache.
+
+    `build()` parses and compiles the workbook and returns a picklable dict;
+    it only runs when no valid cache file exists for the xlsx content and
+    ENGINE_VERSION. Cache files are memory mapped, so the sheet value grids
+    are read straight from the page cache instead of being copied. The
+    cache file the same path used before (an older content or engine
+    version) is deleted once this one is in place.
+    """
+    log = log or (lambda msg: None)
+    digest = file_digest(file_path)
+    path = cache_path(kind, digest)
+
+    if os.path.exists(path):
+        start = time.perf_counter()
+        try:
+            model = read_model(path, digest)
+            log(f"Loaded cached model {os.path.basename(path)} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        except Exception as e:
+            log(f"Ignoring stale model cache {path}: {e}")
+        else:
+            _supersede(source_path(kind, file_path), path, log)
+            return model
+
+    model = build()
+    try:
+        write_model(path, digest, model)
+    except Exception as e:
+        log(f"Could not write model cache {path}: {e}")
+    else:
+        _supersede(source_path(kind, file_path), path, log)
+    return model
+
+
+def _supersede(pointer, path, log):
+    """Point `pointer` at the cache file `path`, deleting the one it named."""
+    name = os.path.basename(path)
+    try:
+        try:
+            with open(pointer, encoding='utf-8') as f:
+                previous = f.read().strip()
+        except FileNotFoundError:
+            previous = None
+        if previous == name:
+            return
+        tmp_path = f"{pointer}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(name)
+        os.replace(tmp_path, pointer)
+        if previous and os.path.basename(previous) == previous:
+            # Workers that still map it keep their mapping
+            os.remove(os.path.join(CACHE_DIR, previous))
+            log(f"Deleted superseded model cache {previous}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log(f"Could not prune model cache for {path}: {e}")
+
+
+def cached_model(file_path, kind):
+    """The model last cached for a workbook path, or None if there is none
+    (nothing is built).
+
+    This is the model of the file as it was when it was last loaded, even
+    if it has been edited in place since: the path's .source file names
+    it until a model of the new content replaces it.
+    """
+    try:
+        with open(source_path(kind, file_path), encoding='utf-8') as f:
+            name = f.read().strip()
+    except OSError:
+        name = None
+    try:
+        if name and os.path.basename(name) == name:
+            return read_model(os.path.join(CACHE_DIR, name))
+        digest = file_digest(file_path)
+        return read_model(cache_path(kind, digest), digest)
+    except Exception:
+        return None
+
+
+def write_model(path, digest, model):
+    buffers = []
+    data = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+    raws = [buf.raw() for buf in buffers]
+
+    offset = HEADER.size + BUFFER_ENTRY.size * len(raws) + len(data)
+    table = []
+    for raw in raws:
+        offset = _align(offset)
+        table.append((offset, raw.nbytes))
+        offset += raw.nbytes
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, ENGINE_VERSION, digest, len(data), len(raws)))
+        for entry in table:
+            f.write(BUFFER_ENTRY.pack(*entry))
+        f.write(data)
+        for (offset, size), raw in zip(table, raws):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(raw)
+    # Readers in other workers only ever see a complete file
+    os.replace(tmp_path, path)
+
+
+def read_model(path, digest=None):
+    """Map a cache file; with `digest` it must be the model of that content."""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    magic, version, stored_digest, size, count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version != ENGINE_VERSION or (digest is not None and stored_digest != digest):
+        raise ValueError("cache header does not match workbook")
+    pos = HEADER.size
+    buffers = []
+    for i in range(count):
+        offset, length = BUFFER_ENTRY.unpack_from(view, pos + i * BUFFER_ENTRY.size)
+        if offset + length > len(view):
+            raise ValueError("truncated cache file")
+        buffers.append(view[offset:offset + length])
+    pos += BUFFER_ENTRY.size * count
+    # The buffers keep the mapping alive for as long as the model uses them
+    return pickle.loads(view[pos:pos + size], buffers=buffers)
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
@@ -0,0 +1,407 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from model_cache import file_digest
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process dev server, no locking needed
+    fcntl = None
+
+# Rough retained bytes per formula cell (text, compiled object, dict slots)
+FORMULA_BYTES = 600
+# Rough bytes per interned string besides its characters
+STRING_BYTES = 64
+
+DEFAULT_MEMORY_BUDGET = int(float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 256)) * 1024 * 1024)
+
+logger = logging.getLogger(__name__)
+
+# A published model; never changed once handed out, so a request that got
+# one keeps pricing against it even if a newer workbook is swapped in
+Snapshot = namedtuple('Snapshot', 'workbook_id version handler')
+
+
+class UnknownWorkbook(KeyError):
+    pass
+
+
+def workbook_id_of(digest):
+    return digest.hex()[:16]
+
+
+def model_size(handler):
+    """Estimated memory held by a loaded handler, from its sheet snapshots."""
+    wb = getattr(handler, 'wb', None)
+    if not wb:
+        return 0
+    size = 0
+    for sheet in wb.sheets.values():
+        size += memoryview(sheet.kinds).nbytes + memoryview(sheet.numbers).nbytes
+        size += sum(STRING_BYTES + len(s) for s in sheet.strings)
+        size += FORMULA_BYTES * len(sheet.formulas)
+    return size
+
+
+def _prebuild(factory, file_path, base):
+    # Runs in the builder process: parsing and compiling the workbook there
+    # leaves the model in the on-disk cache, so the web process only maps it
+    factory(file_path, base)
+
+
+class ModelRegistry:
+    """Loaded pricing models (handlers) keyed by workbook content hash.
+
+    A workbook id is the start of the sha256 of the xlsx, so uploading a
+    byte-identical file returns the id of the model already loaded instead
+    of parsing it again. Uploads are kept in `store_dir` under their id;
+    when the loaded models go over `memory_budget` the least recently used
+    ones are dropped and transparently reloaded from the store (through the
+    on-disk model cache) the next time their id is used. Pinned models (the
+    built-in workbook) are never evicted.
+
+    New workbooks are parsed and compiled in a separate builder process
+    and then published as a Snapshot with the next version number, so a
+    tariff refresh does not hold the GIL away from requests being priced.
+    A new workbook is built against the newest published one: the factory
+    gets its path as `base` and only rebuilds the sheets that differ, and
+    the new handler carries over the results cached for the others.
+
+    Under gunicorn every worker has its own registry over the same
+    `store_dir`. Published ids, their versions and the default workbook
+    are recorded in a manifest file there; each lookup stats the manifest
+    and re-reads it only when it changed, so an upload to one worker is
+    visible to all of them with the same id and version.
+    """
+
+    def __init__(self, kind, factory, store_dir, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.kind = kind
+        self.factory = factory
+        self.store_dir = store_dir
+        self.memory_budget = memory_budget
+        self.models = OrderedDict()  # workbook id -> (snapshot, size), least recently used first
+        self.paths = {}
+        self.pinned = set()
+        self.default_id = None
+        self.evictions = 0
+        self.version = 0
+        self.versions = {}  # workbook id -> version it was published as
+        self.pending = {}  # workbook id -> Future of its snapshot while building
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.builder = None
+        self.manifest_path = os.path.join(store_dir, 'manifest.json')
+        self.manifest_stamp = None
+        os.makedirs(store_dir, exist_ok=True)
+
+    def register(self, file_path, pinned=False, default=False, wait=True):
+        """Load a workbook from where it is; returns (workbook id, already loaded).
+
+        With `default` the workbook replaces the default one once it is
+        published. Unless `wait`, it is built in the background.
+        """
+        file_path = os.path.abspath(file_path)
+        workbook_id = workbook_id_of(file_digest(file_path))
+        with self.lock:
+            self.paths.setdefault(workbook_id, file_path)
+            if pinned:
+                self.pinned.add(workbook_id)
+            if default and self.default_id is None:
+                # Requests for the default workbook wait for it while it loads
+                self._set_default(workbook_id)
+        return workbook_id, self._load(workbook_id, default=default, wait=wait)
+
+    def store(self, upload_path):
+        """Move an uploaded file into the store under its id and start loading it."""
+        workbook_id = workbook_id_of(file_digest(upload_path))
+        stored_path = self._stored_path(workbook_id)
+        if os.path.exists(stored_path):
+            os.remove(upload_path)
+        else:
+            shutil.move(upload_path, stored_path)
+        with self.lock:
+            self.paths.setdefault(workbook_id, stored_path)
+        return workbook_id, self._load(workbook_id, strict=True, wait=False)
+
+    def get(self, workbook_id=None):
+        """Snapshot of a workbook id (the default workbook when None).
+
+        Waits for a workbook that is still being built.
+        """
+        self._sync()
+        with self.lock:
+            workbook_id = workbook_id or self.default_id
+            entry = self.models.get(workbook_id)
+            if entry is not None:
+                self.models.move_to_end(workbook_id)
+                return entry[0]
+            future = self.pending.get(workbook_id)
+            if future is None and workbook_id not in self.versions:
+                if workbook_id in self.errors or not self._stored(workbook_id):
+                    raise UnknownWorkbook(workbook_id)
+                # Uploaded to another worker that has not published it yet
+                self.paths.setdefault(workbook_id, self._stored_path(workbook_id))
+                future = self.pending[workbook_id] = Future()
+                build = True
+            else:
+                build = False
+        if build:
+            self._build(workbook_id, future, strict=True, default=False, prebuild=False)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                raise UnknownWorkbook(workbook_id)
+        return self._reload(workbook_id)
+
+    def status(self, workbook_id):
+        self._sync()
+        with self.lock:
+            if workbook_id in self.pending:
+                state = "loading"
+            elif workbook_id in self.errors:
+                state = "failed"
+            elif workbook_id in self.versions:
+                state = "ready"
+            elif self._stored(workbook_id):
+                state = "loading"
+            else:
+                return None
+            return {
+                "workbook_id": workbook_id,
+                "status": state,
+                "version": self.versions.get(workbook_id),
+                "default": workbook_id == self.default_id,
+                "error": self.errors.get(workbook_id),
+            }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": len(self.models),
+                "bytes": sum(size for _, size in self.models.values()),
+                "budget": self.memory_budget,
+                "evictions": self.evictions,
+                "version": self.version,
+                "loading": len(self.pending),
+            }
+
+    def load_state(self, workbook_id):
+        """'ready' once the workbook is loaded in this process, else 'loading' or 'failed'."""
+        with self.lock:
+            if workbook_id in self.models:
+                return "ready"
+            if workbook_id in self.errors:
+                return "failed"
+            return "loading"
+
+    def handlers(self):
+        """Handlers of the models loaded in this process."""
+        with self.lock:
+            return [snapshot.handler for snapshot, _ in self.models.values()]
+
+    def _load(self, workbook_id, strict=False, default=False, wait=True):
+        """Start building a workbook unless it is loaded; returns True if it was."""
+        with self.lock:
+            if workbook_id in self.models:
+                if default:
+                    self._set_default(workbook_id)
+                return True
+            if workbook_id in self.pending:
+                return False
+            self.errors.pop(workbook_id, None)
+            future = self.pending[workbook_id] = Future()
+        if wait:
+            self._build(workbook_id, future, strict, default, prebuild=False)
+        else:
+            threading.Thread(target=self._build, args=(workbook_id, future, strict, default),
+                             name=f'{self.kind}-model-build', daemon=True).start()
+        return False
+
+    def _build(self, workbook_id, future, strict, default, prebuild=True):
+        path = self.paths[workbook_id]
+        base_id, base_path = self._base(workbook_id)
+        try:
+            if prebuild:
+                self._prebuild(path, base_path)
+            with self.build_lock:
+                handler = self.factory(path, base_path)
+            if strict and not handler.wb:
+                with self.lock:
+                    self.paths.pop(workbook_id, None)
+                if os.path.dirname(path) == self.store_dir:
+                    os.remove(path)
+                raise ValueError("Could not read the workbook")
+            with self.lock:
+                base = self.models.get(base_id)
+            if base is not None:
+                handler.carry_over(base[0].handler)
+            snapshot = self._publish(workbook_id, handler, default)
+        except Exception as e:
+            logger.exception("Could not build %s workbook %s from %s", self.kind, workbook_id, path)
+            with self.lock:
+                self.errors[workbook_id] = str(e)
+                self.pending.pop(workbook_id, None)
+            self._update_manifest(lambda manifest: manifest['failed'].__setitem__(workbook_id, str(e)))
+            future.set_exception(e)
+            return
+        with self.lock:
+            self.pending.pop(workbook_id, None)
+        future.set_result(snapshot)
+
+    def _prebuild(self, path, base):
+        """Build the workbook in the builder process; what it raises fails the build."""
+        if self.builder is None:
+            # spawn, not fork: the web process has threads holding locks
+            self.builder = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            self.builder.submit(_prebuild, self.factory, path, base).result()
+        except BrokenProcessPool:
+            # The builder died (killed, out of memory); the next build starts a new one
+            self.builder = None
+            raise
+
+    def _base(self, workbook_id):
+        """(id, path) of the newest published workbook other than `workbook_id`,
+        (None, None) if there is none; a new upload is most likely an edit of it."""
+        with self.lock:
+            published = sorted(((version, other) for other, version in self.versions.items() if other != workbook_id),
+                               reverse=True)
+            for _, other in published:
+                path = self.paths.get(other)
+                if path and os.path.exists(path):
+                    return other, path
+        return None, None
+
+    def _publish(self, workbook_id, handler, default):
+        size = model_size(handler)
+        path = self.paths[workbook_id]
+
+        def record(manifest):
+            entry = manifest['workbooks'].get(workbook_id)
+            # The same content keeps the version another worker gave it
+            if entry is None:
+                manifest['version'] += 1
+                entry = manifest['workbooks'][workbook_id] = {'version': manifest['version'], 'path': path}
+            manifest['failed'].pop(workbook_id, None)
+            if default:
+                manifest['default'] = workbook_id
+            return entry['version']
+
+        version = self._update_manifest(record)
+        with self.lock:
+            self.version = max(self.version, version)
+            snapshot = Snapshot(workbook_id, version, handler)
+            self.versions[workbook_id] = snapshot.version
+            self.models[workbook_id] = (snapshot, size)
+            if default:
+                self._set_default(workbook_id)
+            self._evict()
+        handler._log(f"Published {self.kind} workbook {workbook_id} as version {snapshot.version}")
+        return snapshot
+
+    def _stored_path(self, workbook_id):
+        return os.path.join(self.store_dir, f"{workbook_id}.xlsx")
+
+    def _stored(self, workbook_id):
+        return os.path.exists(self._stored_path(workbook_id))
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault('version', 0)
+        manifest.setdefault('default', None)
+        manifest.setdefault('workbooks', {})
+        manifest.setdefault('failed', {})
+        return manifest
+
+    def _update_manifest(self, change):
+        """Apply `change(manifest)` under an exclusive lock; returns its result."""
+        with open(os.path.join(self.store_dir, '.manifest.lock'), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self._read_manifest()
+            result = change(manifest)
+            tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+        self._sync()
+        return result
+
+    def _sync(self):
+        """Pick up what other workers published, if the manifest changed."""
+        try:
+            st = os.stat(self.manifest_path)
+        except OSError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self.manifest_stamp:
+            return
+        manifest = self._read_manifest()
+        with self.lock:
+            self.manifest_stamp = stamp
+            self.version = max(self.version, manifest['version'])
+            for workbook_id, entry in manifest['workbooks'].items():
+                self.versions[workbook_id] = entry['version']
+                self.paths.setdefault(workbook_id, entry['path'])
+            for workbook_id, error in manifest['failed'].items():
+                if workbook_id not in self.pending:
+                    self.errors.setdefault(workbook_id, error)
+            if manifest['default'] and manifest['default'] != self.default_id:
+                self._set_default(manifest['default'])
+
+    def _set_default(self, workbook_id):
+        previous = self.default_id
+        self.default_id = workbook_id
+        if previous is not None and previous != workbook_id:
+            # The replaced default may now be evicted like any upload
+            self.pinned.discard(previous)
+
+    def _reload(self, workbook_id):
+        """Load an evicted model again, under the version it was published as."""
+        with self.build_lock:
+            with self.lock:
+                entry = self.models.get(workbook_id)
+                if entry is not None:
+                    return entry[0]
+                path = self.paths.get(workbook_id)
+            # A built-in workbook may have been edited in place since
+            if path is None or not os.path.exists(path) or workbook_id_of(file_digest(path)) != workbook_id:
+                with self.lock:
+                    self.paths.pop(workbook_id, None)
+                    self.versions.pop(workbook_id, None)
+                raise UnknownWorkbook(workbook_id)
+            handler = self.factory(path)
+            size = model_size(handler)
+            with self.lock:
+                snapshot = Snapshot(workbook_id, self.versions[workbook_id], handler)
+                self.models[workbook_id] = (snapshot, size)
+                self._evict()
+            return snapshot
+
+    def _evict(self):
+        total = sum(size for _, size in self.models.values())
+        for workbook_id in list(self.models):
+            if total <= self.memory_budget:
+                break
+            if workbook_id in self.pinned or workbook_id == self.default_id:
+                continue
+            # The newest model stays even if it alone is over budget
+            if workbook_id == next(reversed(self.models)):
+                break
+            snapshot, size = self.models.pop(workbook_id)
+            total -= size
+            self.evictions += 1
+            snapshot.handler._log(f"Evicted {self.kind} workbook {workbook_id} ({size / 1e6:.1f} MB) to stay within the model memory budget")
@@ -0,0 +1,141 @@
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Profiling a request needs this token in the X-Profile-Token header (or
+# ?profile=); without a token configured on-demand profiling is off
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, '.profiles'))
+# Share of calculate requests profiled in the background (0 = off)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_FLUSH_INTERVAL = float(os.environ.get('PROFILE_FLUSH_INTERVAL', 300))
+
+# Functions listed in the profile returned with a response
+TOP_FUNCTIONS = 30
+
+
+class ProfileForbidden(Exception):
+    pass
+
+
+def profile_requested(token):
+    """Whether a request carrying `token` (None: no profile asked for) is
+    profiled; raises ProfileForbidden for a wrong token or when on-demand
+    profiling is off."""
+    if token is None:
+        return False
+    if not PROFILE_TOKEN or not hmac.compare_digest(str(token), PROFILE_TOKEN):
+        raise ProfileForbidden()
+    return True
+
+
+class CalculateProfiler:
+    """Runs calculate() under cProfile on request, or for a random sample.
+
+    A requested profile skips the result cache, so the matching and
+    formula work of the payload is always in it; it is stored as a .prof
+    file in `directory` and the functions with the most cumulative time
+    come back with the response. Sampled requests go through the normal
+    calculate() path and are added to one aggregated profile per process,
+    written to `directory` every `flush_interval` seconds.
+
+    One request is profiled at a time: a sampled request that finds the
+    profiler busy is just not sampled.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, flush_interval=PROFILE_FLUSH_INTERVAL):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.sampled = None  # pstats.Stats of the samples since the worker started
+        self.sampled_count = 0
+        self.last_flush = time.monotonic()
+
+    def calculate(self, handler, selections, requested=False):
+        """handler.calculate(selections) and the profile report, None unless requested."""
+        if requested:
+            if not self.lock.acquire(timeout=30):
+                return handler.calculate(selections), {"error": "Another request is being profiled"}
+            try:
+                return self._profile_request(handler, selections)
+            finally:
+                self.lock.release()
+
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self.lock.acquire(blocking=False):
+            return handler.calculate(selections), None
+        try:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(handler.calculate, selections)
+            self._add_sample(profiler)
+            return result, None
+        finally:
+            self.lock.release()
+
+    def _profile_request(self, handler, selections):
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        result = profiler.runcall(handler._calculate, selections)
+        elapsed = time.perf_counter() - start
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        stats = pstats.Stats(profiler)
+        path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"request-{profile_id}.prof")
+            stats.dump_stats(path)
+        except OSError:
+            path = None
+        return dict(result), {
+            "id": profile_id,
+            "total_ms": elapsed * 1000,
+            "file": os.path.basename(path) if path else None,
+            "functions": top_functions(stats),
+        }
+
+    def _add_sample(self, profiler):
+        if self.sampled is None:
+            self.sampled = pstats.Stats(profiler)
+        else:
+            self.sampled.add(profiler)
+        self.sampled_count += 1
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        """Write the aggregated sampled profile of this process."""
+        self.last_flush = time.monotonic()
+        if self.sampled is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"sampled-{os.getpid()}.prof")
+        tmp_path = f"{path}.tmp"
+        self.sampled.dump_stats(tmp_path)
+        os.replace(tmp_path, path)
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """The `limit` functions with the most cumulative time, as JSON rows."""
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:limit]
+    return [{
+        "function": _function_name(key),
+        "calls": calls,
+        "tottime_ms": tottime * 1000,
+        "cumtime_ms": cumtime * 1000,
+    } for key, (_, calls, tottime, cumtime, _) in rows]
+
+
+def _function_name(key):
+    filename, line, name = key
+    if filename.startswith(BASE_DIR):
+        filename = os.path.relpath(filename, BASE_DIR)
+    return f"{filename}:{line}({name})" if line else name
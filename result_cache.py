@@ -0,0 +1,96 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 4096))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 600))
+
+
+def canonical_input(value):
+    """Input value as matching and formula evaluation see it.
+
+    Surrounding whitespace is dropped, except where the handlers tell a
+    blank or 'n/a' value apart from its padded form; those are kept as is.
+    """
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped and stripped.lower() != 'n/a':
+            return stripped
+    return value
+
+
+class ResultCache:
+    """Bounded LRU of calculate() results with a time to live.
+
+    One cache belongs to one loaded workbook (handler), so a new or
+    changed workbook starts with an empty cache and nothing needs to be
+    invalidated by hand. Keys are the handler's canonical form of the
+    selections. Results are deep copied going in and coming out, so a
+    caller that changes the result it got cannot change later hits.
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, result), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            result = entry[1]
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        if self.maxsize <= 0:
+            return
+        result = copy.deepcopy(result)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def adopt(self, other, keep):
+        """Copy the live entries of `other` whose key passes keep(key), with
+        their expiry times; returns how many were copied."""
+        with other.lock:
+            entries = list(other.entries.items())
+        now = time.monotonic()
+        entries = [(key, entry) for key, entry in entries if entry[0] >= now and keep(key)]
+        with self.lock:
+            for key, entry in entries:
+                self.entries[key] = entry
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return len(entries)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
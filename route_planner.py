@@ -0,0 +1,125 @@
+import heapq
+from collections import namedtuple
+
+from lane_costs import PLAN_FIELDS, plan_inputs
+
+OBJECTIVES = ('cost', 'lt')
+MAX_LEGS = 4
+MAX_ROUTES = 20
+# Partial routes popped before the search gives up
+MAX_EXPANSIONS = 20000
+
+# One row of a route sheet as an edge From -> To, the pos-th option of its
+# lane in the handler's lane_costs
+RouteEdge = namedtuple('RouteEdge', ['sheet', 'node', 'frm', 'to', 'pos'])
+
+
+def build_route_graph(lane_costs):
+    """Edges of every lane row of the route sheets, by From location."""
+    graph = {}
+    for sheet_name, lanes in lane_costs.items():
+        for (node, frm, to), lane in lanes.items():
+            if frm == to: continue
+            graph.setdefault(frm, []).extend(RouteEdge(sheet_name, node, frm, to, pos) for pos in range(len(lane)))
+    return graph
+
+
+def plan_routes(handler, origin, destination, inputs=None, k=3, objective='cost'):
+    """The k cheapest (objective 'cost') or fastest ('lt') chains of lanes
+    from `origin` to `destination`.
+
+    Every sheet row is an edge priced for the numeric `inputs` (PALLET QTY,
+    CBM, G/W, Truck times) the way calculate() prices that row, a whole
+    lane at a time through its LaneCosts; any other
+    input only keeps the rows that have that value in sheets with the
+    column. A route's lead time is the sum of its legs' upper bounds. Legs
+    have the selection shape, so a route's legs can be posted to
+    /api/calculate as they are for the full breakdown. Raises ValueError
+    for an invalid request.
+    """
+    if not origin or not destination:
+        raise ValueError("Missing origin or destination")
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective '{objective}', expected one of " + ", ".join(OBJECTIVES))
+    try:
+        k = int(k)
+    except (TypeError, ValueError):
+        raise ValueError("k must be a number")
+    if not 1 <= k <= MAX_ROUTES:
+        raise ValueError(f"k must be between 1 and {MAX_ROUTES}")
+    origin, destination = str(origin).strip(), str(destination).strip()
+    inputs = {field: val for field, val in (inputs or {}).items()
+              if val is not None and str(val).strip() != ''}
+    numbers = plan_inputs(inputs)
+    filters = {field: str(val).strip() for field, val in inputs.items() if field not in PLAN_FIELDS}
+
+    handler._log(f"PLAN {origin} -> {destination} by {objective}, k={k}, inputs {inputs}")
+    graph = handler.route_graph
+    lanes_priced = {}
+    routes = []
+    # (weight, tie breaker, location, legs); weights add up per component
+    heap = [((0, 0), 0, origin, ())]
+    pushed = expansions = 0
+    while heap and len(routes) < k and expansions < MAX_EXPANSIONS:
+        weight, _, location, legs = heapq.heappop(heap)
+        expansions += 1
+        if location == destination and legs:
+            routes.append(legs)
+            continue
+        if len(legs) == MAX_LEGS: continue
+        visited = {origin}.union(leg["to"] for leg in legs)
+        for edge in graph.get(location, ()):
+            if edge.to in visited: continue
+            key = (edge.sheet, edge.node, edge.frm, edge.to)
+            if key not in lanes_priced:
+                lanes_priced[key] = _price_lane(handler, edge, numbers, filters)
+            leg = lanes_priced[key][edge.pos]
+            if leg is None: continue
+            cost, lt_max = leg["cost"], leg["lt_range"][1]
+            step = (cost, lt_max) if objective == 'cost' else (lt_max, cost)
+            pushed += 1
+            heapq.heappush(heap, ((weight[0] + step[0], weight[1] + step[1]), pushed, edge.to, legs + (leg,)))
+
+    handler._log(f"PLAN found {len(routes)} routes, {len(lanes_priced)} lanes priced, {expansions} expansions")
+    return {
+        "origin": origin,
+        "destination": destination,
+        "objective": objective,
+        "routes": [_route_result(handler, legs) for legs in routes],
+    }
+
+
+def _price_lane(handler, edge, numbers, filters):
+    """Legs of all rows of the edge's lane, None for a row that is filtered
+    out or has no price."""
+    lane = handler.lane_costs[edge.sheet][(edge.node, edge.frm, edge.to)]
+    schema = handler.schemas[edge.sheet]
+    cost, exact, lt = lane.evaluate(handler.wb[edge.sheet], schema, numbers)
+    days = lane.lt_bounds(exact)
+    allowed = lane.allowed(schema, filters)
+    overrides = {field: text for field, text in numbers.items() if field in schema.header_cols}
+    legs = []
+    for i in range(len(lane)):
+        if not allowed[i] or cost[i] <= 0:
+            legs.append(None)
+            continue
+        legs.append({
+            "node": edge.node,
+            "location": f"{edge.frm} -> {edge.to}",
+            "inputs": dict(lane.options[i], **overrides),
+            "row": int(lane.rows[i]),
+            "to": edge.to,
+            "cost": float(cost[i]),
+            "lt": lt[i],
+            "lt_range": days[i].tolist(),
+        })
+    return legs
+
+
+def _route_result(handler, legs):
+    return {
+        "legs": [{key: leg[key] for key in ("node", "location", "inputs", "row", "cost", "lt")} for leg in legs],
+        "total_cost": sum(leg["cost"] for leg in legs),
+        "total_lt": handler._aggregate_lt([leg["lt"] for leg in legs if leg["lt"]]),
+        "lt_days": [sum(leg["lt_range"][0] for leg in legs), sum(leg["lt_range"][1] for leg in legs)],
+    }
@@ -0,0 +1,66 @@
+from collections import namedtuple
+
+# Row 1 fill of a breakdown column whose cost varies with the quantity inputs
+VARIABLE_FILLS = ('FF92D050', '92D050')
+
+# A cost column shown in the breakdown; rate is its standard-rate label
+BreakdownColumn = namedtuple('BreakdownColumn', 'col name variable rate')
+
+
+class SheetSchema:
+    """Column layout of one pricing sheet, worked out once at load.
+
+    Holds what the handlers used to rescan the sheet for on every request:
+    the header row and header lookups, the columns of the fields a
+    selection is matched on, and the breakdown columns in sheet order with
+    their variable/base classification and standard-rate labels. It is
+    built with the model and kept in the model cache.
+    """
+
+    def __init__(self, header_row, header_cols, col_titles, input_cols=None, breakdown=(), key_cols=()):
+        self.header_row = header_row
+        self.header_cols = header_cols  # title -> column
+        self.col_titles = col_titles  # column -> title
+        # (column, title) of the selection fields, None if the sheet has none
+        self.input_cols = input_cols
+        self.input_titles = tuple(title for c, title in input_cols) if input_cols is not None else None
+        # Position of a field in input_cols when it is the header's first column
+        self.input_pos = {title: i for i, (c, title) in enumerate(input_cols or ()) if header_cols.get(title) == c}
+        self.breakdown = tuple(breakdown)
+        # Handler specific key columns (e.g. MAP/From/To of a route sheet)
+        self.key_cols = tuple(key_cols)
+
+    def col(self, title):
+        return self.header_cols.get(title)
+
+
+def first_columns(headers):
+    """(title -> first column with it, column -> title) of (column, title) pairs."""
+    header_cols = {}
+    col_titles = {}
+    for c, title in headers:
+        if title is None:
+            continue
+        col_titles[c] = title
+        if title not in header_cols:
+            header_cols[title] = c
+    return header_cols, col_titles
+
+
+def index_columns(ws):
+    """Columns numbered in row 1, which is how the route sheets mark cost columns."""
+    cols = []
+    for c in range(1, ws.max_column + 1):
+        idx_val = ws.value(1, c)
+        if idx_val is not None:
+            try:
+                int(idx_val)
+                cols.append(c)
+            except (ValueError, TypeError):
+                if str(idx_val).isdigit():
+                    cols.append(c)
+    return cols
+
+
+def is_variable(ws, c):
+    return ws.fill_rgb(1, c) in VARIABLE_FILLS
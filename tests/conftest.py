@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Logs, model caches, metrics and uploads of the test run go to a scratch
+# directory instead of the working tree; set before any repo module is
+# imported since they read these at import time
+WORK_DIR = tempfile.mkdtemp(prefix='rate-tests-')
+os.environ.setdefault('MODEL_CACHE_DIR', os.path.join(WORK_DIR, 'model_cache'))
+os.environ.setdefault('METRICS_DIR', os.path.join(WORK_DIR, 'metrics'))
+os.environ.setdefault('PROFILE_DIR', os.path.join(WORK_DIR, 'profiles'))
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(WORK_DIR, 'uploads'))
+os.environ['LOG_TO_STDOUT'] = '0'
+
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'WH Cost')]
+
+ROUTE_WORKBOOK = os.path.join(REPO_DIR, '5.shipping cost based on summary.xlsx')
+WH_WORKBOOK = os.path.join(REPO_DIR, 'WH Cost', 'WH cost.xlsx')
+
+
+def lane_selections():
+    """A calculate() selection for every row of the route sheets, with that row's inputs."""
+    import openpyxl
+    from excel_handler import ExcelHandler
+
+    wb = openpyxl.load_workbook(ROUTE_WORKBOOK, data_only=True)
+    selections = []
+    for title in ExcelHandler.ROUTE_SHEETS:
+        ws = wb[title]
+        header = {ws.cell(2, c).value: c for c in range(1, ws.max_column + 1) if ws.cell(2, c).value}
+        for r in range(3, ws.max_row + 1):
+            node = str(ws.cell(r, header['MAP']).value or '').strip()
+            if not node:
+                continue
+            location = f"{str(ws.cell(r, header['From']).value).strip()} -> {str(ws.cell(r, header['To']).value).strip()}"
+            inputs = {}
+            for c in range(header['To'] + 1, header['SUMMARY'] + 1):
+                value = ws.cell(r, c).value
+                if value is not None and str(value).strip() not in ('', 'N/A'):
+                    inputs[ws.cell(2, c).value] = str(value)
+            if 'SUMMARY' in inputs:
+                inputs['SUMMARY'] = {'A': 'Ocean', 'B': 'Air', 'C': 'Land'}.get(inputs['SUMMARY'], inputs['SUMMARY'])
+            selections.append({'node': node, 'location': location, 'inputs': inputs})
+    return selections
+
+
+@pytest.fixture(scope='session', autouse=True)
+def work_dir():
+    # The handlers write their log files to the working directory
+    cwd = os.getcwd()
+    os.chdir(WORK_DIR)
+    yield WORK_DIR
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """A model cache of its own, so a test builds its models from the xlsx."""
+    import model_cache
+    path = tmp_path / 'model_cache'
+    monkeypatch.setattr(model_cache, 'CACHE_DIR', str(path))
+    # Builder processes spawned by the test use it too
+    monkeypatch.setenv('MODEL_CACHE_DIR', str(path))
+    return path
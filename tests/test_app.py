@@ -0,0 +1,126 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app_module():
+    """The app as gunicorn's master imports it, built-in workbooks loaded."""
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def test_ready_after_import(client):
+    response = client.get('/healthz/ready')
+    assert response.status_code == 200
+    assert response.get_json()['loaded'] == 2
+
+
+def test_ready_in_forked_worker(app_module):
+    # preload_app: the master loads the workbooks and the workers fork from
+    # it with the models already in memory
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            response = app_module.app.test_client().get('/healthz/ready')
+            os.write(write_fd, json.dumps([response.status_code, response.get_json()]).encode())
+            code = 0
+        finally:
+            os._exit(code)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as fh:
+        output = fh.read()
+    _, exit_status = os.waitpid(pid, 0)
+    assert exit_status == 0
+    status_code, status = json.loads(output)
+    assert status_code == 200, status
+    assert all(model['status'] == 'ready' for model in status['models'].values())
+
+
+def test_bulk_upload_and_status(client, app_module):
+    import io
+    import time
+
+    def upload(text):
+        return client.post('/api/bulk', data={'file': (io.BytesIO(text.encode()), 'quotes.csv')})
+
+    before = set(os.listdir(app_module.UPLOAD_FOLDER))
+    assert upload("quote,CBM\n1,2\n").status_code == 400
+    jobs = [upload("node\nA\n").get_json()["id"] for _ in range(2)]
+    for job_id in jobs:
+        deadline = time.monotonic() + 10
+        while client.get(f'/api/bulk/{job_id}').get_json()["status"] not in ("done", "failed"):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert client.get(f'/api/bulk/{job_id}/result').status_code == 200
+    # Inputs are gone once read, and a rejected one right away
+    assert set(os.listdir(app_module.UPLOAD_FOLDER)) == before
+    assert client.get('/api/bulk/unknown').status_code == 404
+
+
+def _upload(client, path, url='/api/upload'):
+    with open(path, 'rb') as fh:
+        return client.post(url, data={'file': (fh, os.path.basename(path))})
+
+
+def test_workbook_upload_status_and_unknown_id(client, tmp_path):
+    import time
+
+    import openpyxl
+    from conftest import ROUTE_WORKBOOK
+
+    wb = openpyxl.load_workbook(ROUTE_WORKBOOK)
+    wb['VENDOR-WAHL']['F3'] = 6.4
+    path = tmp_path / 'edited.xlsx'
+    wb.save(path)
+
+    response = _upload(client, str(path))
+    assert response.status_code == 202
+    workbook_id = response.get_json()["workbook_id"]
+    deadline = time.monotonic() + 60
+    while (status := client.get(response.headers['Location']).get_json())["status"] == "loading":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert status["status"] == "ready" and status["workbook_id"] == workbook_id
+    response = client.get('/api/routes', query_string={'workbook_id': workbook_id})
+    assert response.status_code == 200 and response.headers['X-Workbook-Id'] == workbook_id
+
+    assert client.get('/api/workbooks/0123456789abcdef').status_code == 404
+    assert client.get('/api/routes', query_string={'workbook_id': '0123456789abcdef'}).status_code == 404
+
+
+def test_rejected_uploads_are_removed(client, app_module, tmp_path, monkeypatch):
+    from conftest import WH_WORKBOOK
+
+    before = set(os.listdir(app_module.UPLOAD_FOLDER))
+    bad = tmp_path / 'notes.xlsx'
+    bad.write_text('not a workbook')
+    assert _upload(client, str(bad)).status_code == 400
+
+    def store(path):
+        raise OSError("disk full")
+    monkeypatch.setattr(app_module.wh_models, 'store', store)
+    response = _upload(client, WH_WORKBOOK, '/api/wh/upload')
+    assert response.status_code == 400 and 'disk full' in response.get_json()["error"]
+    assert set(os.listdir(app_module.UPLOAD_FOLDER)) == before
+
+
+def test_batch_lines_name_their_workbook_version(client):
+    import json
+
+    selection = [{'node': 'E', 'location': 'WADG -> WAHL', 'inputs': {}}]
+    response = client.post('/api/calculate/batch', json=[selection, 'not a list', selection])
+    version = int(response.headers['X-Workbook-Version'])
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['index'] for line in lines] == [0, 1, 2]
+    assert all(line['workbook_version'] == version for line in lines)
+    assert 'error' in lines[1] and lines[0]['result'] == lines[2]['result']
@@ -0,0 +1,79 @@
+import os
+import time
+
+import openpyxl
+import pytest
+
+from bulk_jobs import BulkJobManager, read_selection_file
+
+
+class FakeHandler:
+    def calculate(self, selections):
+        results = [{"node": sel['node'], "cost": 1.0, "lt": 2} for sel in selections]
+        return {"node_results": results, "total_cost": float(len(results)), "total_lt": 2}
+
+
+def _write_csv(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def _wait(manager, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = manager.status(job_id)
+        if status["status"] in ("done", "failed"):
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_rows_of_a_quote_are_priced_together(tmp_path):
+    path = _write_csv(tmp_path / 'in.csv', "quote,node,location,CBM\nq1,A,HK,1\nq2,B,SZ,2\nq1,C,,3\n\n")
+    assert read_selection_file(path) == [
+        ('q2', [{'node': 'B', 'location': 'SZ', 'inputs': {'CBM': '2'}}]),
+        ('q1', [{'node': 'A', 'location': 'HK', 'inputs': {'CBM': '1'}},
+                {'node': 'C', 'location': '', 'inputs': {'CBM': '3'}}]),
+    ]
+
+
+def test_bad_files_are_rejected(tmp_path):
+    with pytest.raises(ValueError, match="empty"):
+        read_selection_file(_write_csv(tmp_path / 'empty.csv', ""))
+    with pytest.raises(ValueError, match="node"):
+        read_selection_file(_write_csv(tmp_path / 'nonode.csv', "quote,CBM\n1,2\n"))
+
+
+def test_job_state_is_shared_between_workers(tmp_path):
+    results_dir = str(tmp_path / 'bulk_results')
+    worker = BulkJobManager(results_dir)
+    other = BulkJobManager(results_dir)
+    input_path = _write_csv(tmp_path / 'in.csv', "node,CBM\nA,1\nB,2\n")
+
+    job_id = worker.submit(FakeHandler(), input_path, 'routes')["id"]
+    status = _wait(other, job_id)
+    assert (status["status"], status["total"], status["done"], status["errors"]) == ("done", 2, 2, 0)
+    assert not os.path.exists(input_path)
+
+    rows = list(openpyxl.load_workbook(other.result_path(job_id)).active.iter_rows(values_only=True))
+    assert [row[:3] for row in rows[1:]] == [('2', 'A', None), ('3', 'B', None)]
+    assert other.status('0' * 32) is None
+    assert other.status('../../etc/passwd') is None
+
+
+def test_finished_jobs_expire(tmp_path):
+    results_dir = str(tmp_path / 'bulk_results')
+    manager = BulkJobManager(results_dir, keep_seconds=60)
+    job_id = manager.submit(FakeHandler(), _write_csv(tmp_path / 'in.csv', "node\nA\n"), 'wh')["id"]
+    _wait(manager, job_id)
+    result_path = manager.result_path(job_id)
+
+    manager.expire()
+    assert manager.status(job_id) is not None
+
+    old = time.time() - 120
+    os.utime(os.path.join(results_dir, f"{job_id}.json"), (old, old))
+    manager.expire()
+    assert manager.status(job_id) is None
+    assert not os.path.exists(result_path)
+    assert os.listdir(results_dir) == []
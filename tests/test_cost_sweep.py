@@ -0,0 +1,31 @@
+import itertools
+
+import pytest
+
+from conftest import ROUTE_WORKBOOK, lane_selections
+from cost_sweep import _format_input, sweep_costs
+from excel_handler import ExcelHandler
+
+PALLETS = [0, 1, 6]
+CBMS = [0, 0.5, 3, 7.5]
+WEIGHTS = [0, 250]
+SELECTIONS = lane_selections()
+
+
+@pytest.fixture(scope='module')
+def handler():
+    return ExcelHandler(ROUTE_WORKBOOK)
+
+
+def _calculate(handler, selection, **inputs):
+    result = handler.calculate([dict(selection, inputs=dict(selection['inputs'], **inputs))])
+    return result['node_results'][0] if result['node_results'] else {}
+
+
+@pytest.mark.parametrize('selection', SELECTIONS, ids=lambda s: f"{s['node']}:{s['location']}")
+def test_sweep_matches_calculate(handler, selection):
+    result = sweep_costs(handler, selection, {'PALLET QTY': PALLETS, 'CBM': CBMS, 'G/W': WEIGHTS})
+    for (i, pallets), (j, cbm), (k, weight) in itertools.product(enumerate(PALLETS), enumerate(CBMS), enumerate(WEIGHTS)):
+        expected = _calculate(handler, selection, **{'PALLET QTY': _format_input(pallets), 'CBM': _format_input(cbm),
+                                                     'G/W': _format_input(weight)})
+        assert result['cost'][i][j][k] == pytest.approx(float(expected.get('cost') or 0)), (pallets, cbm, weight)
@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+import openpyxl
+import pytest
+
+from conftest import ROUTE_WORKBOOK, WH_WORKBOOK
+from formula_compiler import MAX_RANGE_CELLS, FormulaError, compile_formula
+from workbook_loader import load_workbook_data
+
+
+@pytest.mark.parametrize('path', [ROUTE_WORKBOOK, WH_WORKBOOK])
+def test_compiled_formulas_reproduce_excel_values(path):
+    book = load_workbook_data(path)
+    cached = openpyxl.load_workbook(path, data_only=True)
+    checked = 0
+    for name in book.sheetnames:
+        sheet = book[name]
+
+        def number(r, c):
+            value = sheet.value(r, c)
+            try:
+                return float(value) if value else 0.0
+            except (TypeError, ValueError):
+                return 0.0
+
+        for (row, col), text in sheet.formulas.items():
+            expected = cached[name].cell(row, col).value
+            assert compile_formula(text, row).evaluate(number) == pytest.approx(expected), (name, row, col, text)
+            checked += 1
+    assert checked
+
+
+def test_operator_precedence():
+    values = {(1, 1): 2.0, (1, 2): 3.0}
+    ref = lambda r, c: values.get((r, c), 0.0)
+    assert compile_formula('=A1+B1*2').evaluate(ref) == 8.0
+    assert compile_formula('=-A1^2').evaluate(ref) == -4.0
+    assert compile_formula('=(A1+B1)/5').evaluate(ref) == 1.0
+
+
+def test_ranges_relative_and_absolute():
+    ref = lambda r, c: r * 10.0 + c
+    compiled = compile_formula('=SUM(B2:C3)+MAX($A$1:$A$2)', 4)
+    assert compiled.evaluate(ref) == 22 + 23 + 32 + 33 + 21
+    # Copied down one row the relative range moves, the absolute one stays
+    assert list(compiled.evaluate_rows(np.array([4, 5]), ref)) == [131, 171]
+    assert sorted(compiled.range_cells()) == [(1, 1), (2, 1), (2, 2), (2, 3), (3, 2), (3, 3)]
+
+
+def test_large_range_compiles_to_a_loop():
+    start = time.perf_counter()
+    compiled = compile_formula('=SUM(A1:Z384)', 1)
+    assert time.perf_counter() - start < 0.5
+    assert len(compiled.code) < 200
+    assert compiled.evaluate(lambda r, c: 1.0) == 26 * 384
+
+
+def test_range_over_the_cap_is_rejected():
+    start = time.perf_counter()
+    with pytest.raises(FormulaError, match='cells'):
+        compile_formula('=SUM(A1:Z100000)')
+    assert time.perf_counter() - start < 0.5
+    assert MAX_RANGE_CELLS < 26 * 100000
+
+
+@pytest.mark.parametrize('formula', ['=VLOOKUP(A1,B:C,2)', '=IF(A1>1,2,3)', '=A1:B2', '=SUM()', 'A1'])
+def test_unsupported_formulas_raise(formula):
+    with pytest.raises(FormulaError):
+        compile_formula(formula)
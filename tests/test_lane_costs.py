@@ -0,0 +1,32 @@
+import pytest
+
+from conftest import ROUTE_WORKBOOK, lane_selections
+from excel_handler import ExcelHandler
+from lane_costs import PLAN_FIELDS, cost_frontier
+
+SELECTIONS = lane_selections()
+
+
+@pytest.fixture(scope='module')
+def handler():
+    return ExcelHandler(ROUTE_WORKBOOK)
+
+
+def _calculate(handler, selection, **inputs):
+    result = handler.calculate([dict(selection, inputs=dict(selection['inputs'], **inputs))])
+    return result['node_results'][0] if result['node_results'] else {}
+
+
+@pytest.mark.parametrize('selection', SELECTIONS, ids=lambda s: f"{s['node']}:{s['location']}")
+def test_frontier_options_match_calculate(handler, selection):
+    numbers = {field: value for field, value in selection['inputs'].items() if field in PLAN_FIELDS}
+    result = cost_frontier(handler, dict(selection, inputs=numbers))
+    costs = [option['cost'] for option in result['options']]
+    days = [option['lt_days'][1] for option in result['options']]
+    # Fastest first, and each option is cheaper than every faster one
+    assert days == sorted(days)
+    assert all(later < earlier for earlier, later in zip(costs, costs[1:]))
+    for option in result['options']:
+        expected = _calculate(handler, dict(selection, inputs={}), **option['inputs'])
+        assert option['cost'] == pytest.approx(float(expected['cost'])), option
+        assert option['lt'] == expected['lt'], option
@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import model_cache
+from conftest import ROUTE_WORKBOOK, WH_WORKBOOK
+from model_cache import cache_path, file_digest, load_model
+
+
+def _model_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.model'))
+
+
+def test_round_trip(cache_dir):
+    builds = []
+
+    def build():
+        builds.append(1)
+        return {'numbers': bytearray(b'\x01' * 64), 'name': 'routes'}
+
+    first = load_model(ROUTE_WORKBOOK, 'routes', build)
+    second = load_model(ROUTE_WORKBOOK, 'routes', build)
+    assert len(builds) == 1
+    assert second['name'] == first['name'] and bytes(second['numbers']) == bytes(first['numbers'])
+    assert _model_files(cache_dir) == [os.path.basename(cache_path('routes', file_digest(ROUTE_WORKBOOK)))]
+
+
+def test_handler_round_trip(cache_dir):
+    from excel_handler import ExcelHandler
+
+    built = ExcelHandler(ROUTE_WORKBOOK)
+    cached = ExcelHandler(ROUTE_WORKBOOK)
+    assert len(_model_files(cache_dir)) == 1
+    selection = [{'node': 'E', 'location': 'WADG -> WAHL', 'inputs': {}}]
+    assert cached.calculate(selection) == built.calculate(selection)
+    for name in built.wb.sheetnames:
+        assert bytes(cached.wb[name].numbers) == bytes(built.wb[name].numbers)
+
+
+def test_superseded_entries_are_deleted(cache_dir, tmp_path, monkeypatch):
+    path = str(tmp_path / 'book.xlsx')
+    shutil.copy(ROUTE_WORKBOOK, path)
+    other = str(tmp_path / 'other.xlsx')
+    shutil.copy(WH_WORKBOOK, other)
+    load_model(path, 'routes', dict)
+    load_model(other, 'routes', dict)
+
+    # The file is replaced in place
+    shutil.copy(WH_WORKBOOK, path)
+    load_model(path, 'routes', dict)
+    assert _model_files(cache_dir) == [os.path.basename(cache_path('routes', file_digest(WH_WORKBOOK)))]
+
+    # A new engine version
+    monkeypatch.setattr(model_cache, 'ENGINE_VERSION', model_cache.ENGINE_VERSION + 1)
+    load_model(path, 'routes', dict)
+    load_model(other, 'routes', dict)
+    assert _model_files(cache_dir) == [os.path.basename(cache_path('routes', file_digest(WH_WORKBOOK)))]
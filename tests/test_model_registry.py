@@ -0,0 +1,44 @@
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_DIR, ROUTE_WORKBOOK
+from model_registry import ModelRegistry, UnknownWorkbook
+
+
+class BrokenHandler:
+    """A factory that fails the way a handler bug would, in any process."""
+
+    def __init__(self, file_path, base=None):
+        raise RuntimeError("broken handler")
+
+
+def test_failed_build_is_logged_and_reported(tmp_path, caplog):
+    registry = ModelRegistry('broken', BrokenHandler, str(tmp_path / 'store'))
+    upload = tmp_path / 'upload.xlsx'
+    upload.write_bytes(open(ROUTE_WORKBOOK, 'rb').read())
+
+    with caplog.at_level(logging.ERROR, logger='model_registry'):
+        workbook_id, loaded = registry.store(str(upload))
+        with pytest.raises(UnknownWorkbook):
+            registry.get(workbook_id)
+    assert not loaded
+    status = registry.status(workbook_id)
+    assert status["status"] == "failed" and "broken handler" in status["error"]
+    assert any(workbook_id in record.getMessage() for record in caplog.records)
+
+    # Other workers read the failure from the manifest
+    other = ModelRegistry('broken', BrokenHandler, str(tmp_path / 'store'))
+    assert other.status(workbook_id)["status"] == "failed"
+
+
+def test_builder_process_does_not_load_builtin_workbooks(tmp_path):
+    # What the spawned builder does with app.py under `python app.py`
+    env = dict(os.environ, UPLOAD_FOLDER=str(tmp_path / 'uploads'), PYTHONPATH=REPO_DIR)
+    code = f"import runpy; runpy.run_path({os.path.join(REPO_DIR, 'app.py')!r}, run_name='__mp_main__')"
+    subprocess.run([sys.executable, '-c', code], env=env, cwd=str(tmp_path), check=True, timeout=60)
+    for kind in ('routes', 'wh'):
+        assert not os.path.exists(tmp_path / 'uploads' / 'models' / kind / 'manifest.json')
@@ -0,0 +1,71 @@
+import os
+
+import openpyxl
+
+import model_cache
+from conftest import ROUTE_WORKBOOK
+from excel_handler import ExcelHandler
+
+SELECTION = [{'node': 'E', 'location': 'WADG -> WAHL', 'inputs': {}}]
+
+
+def _save(path, **vendor_cells):
+    # From a fresh load each time: saving one openpyxl book twice does not
+    # give the same sheet xml
+    wb = openpyxl.load_workbook(ROUTE_WORKBOOK)
+    for coordinate, value in vendor_cells.items():
+        wb['VENDOR-WAHL'][coordinate] = value
+    wb.save(path)
+    return str(path)
+
+
+def _node_results(handler, sheet_name):
+    results = []
+    for node, options in sorted(handler.get_route_options().items()):
+        if options['sheet'] != sheet_name:
+            continue
+        for location in options['locations']:
+            results.append(handler.calculate([{'node': node, 'location': location, 'inputs': {}}]))
+    return results
+
+
+def test_reload_rebuilds_only_changed_sheets(tmp_path, cache_dir, monkeypatch):
+    base_path = _save(tmp_path / 'base.xlsx')
+    edited_path = _save(tmp_path / 'edited.xlsx', F3=6.4)
+
+    base = ExcelHandler(base_path)
+    cached = base.calculate(SELECTION)
+    edited = ExcelHandler(edited_path, base=base_path)
+    assert sorted(edited.wb.reused) == ['WAHL-Customer', 'WAHL-DGWA']
+    assert edited.wb['VENDOR-WAHL'].value(3, 6) == 6.4
+
+    # Results cached for the unchanged sheets carry over
+    edited.carry_over(base)
+    assert edited.result_cache.stats()['size'] >= 1
+    assert edited.calculate(SELECTION) == cached
+
+    # Same prices as a build from scratch
+    monkeypatch.setattr(model_cache, 'CACHE_DIR', str(tmp_path / 'scratch_cache'))
+    scratch = ExcelHandler(edited_path)
+    assert scratch.wb.reused == []
+    for sheet_name in ExcelHandler.ROUTE_SHEETS:
+        assert _node_results(edited, sheet_name) == _node_results(scratch, sheet_name)
+
+
+def test_reload_in_place_reuses_unchanged_sheets(tmp_path, cache_dir):
+    from model_registry import ModelRegistry
+
+    path = _save(tmp_path / 'builtin.xlsx')
+    registry = ModelRegistry('routes', ExcelHandler, str(tmp_path / 'store'))
+    first_id, _ = registry.register(path, pinned=True, default=True)
+
+    # The built-in workbook edited where it is and loaded again, built in
+    # the builder process like /api/load-builtin does
+    _save(path, F3=6.4)
+    second_id, _ = registry.register(path, pinned=True, default=True, wait=False)
+    assert second_id != first_id
+    edited = registry.get(second_id).handler
+    assert sorted(edited.wb.reused) == ['WAHL-Customer', 'WAHL-DGWA']
+    assert edited.wb['VENDOR-WAHL'].value(3, 6) == 6.4
+    # Only the model of the new content is kept
+    assert len([name for name in os.listdir(cache_dir) if name.endswith('.model')]) == 1
@@ -0,0 +1,32 @@
+import copy
+
+import pytest
+
+from conftest import ROUTE_WORKBOOK, WH_WORKBOOK
+from excel_handler import ExcelHandler
+from wh_excel_handler import WHExcelHandler
+
+
+def _first_selection(handler):
+    node, options = sorted(handler.get_route_options().items())[0]
+    return [{'node': node, 'location': options['locations'][0], 'inputs': {}}]
+
+
+@pytest.mark.parametrize('factory, path', [(ExcelHandler, ROUTE_WORKBOOK), (WHExcelHandler, WH_WORKBOOK)])
+def test_changing_a_result_does_not_change_the_cache(factory, path):
+    handler = factory(path)
+    selection = _first_selection(handler)
+    first = handler.calculate(selection)
+    original = copy.deepcopy(first)
+    assert first['node_results']
+
+    for result in (first, handler.calculate(selection)):
+        result['total_cost'] = -1
+        result['node_results'][0]['cost'] = -1
+        breakdown = result['node_results'][0].get('breakdown')
+        if isinstance(breakdown, dict):
+            breakdown['changed'] = -1
+        result['node_results'].append({'node': 'changed'})
+
+    assert handler.calculate(selection) == original
+    assert handler.result_cache.stats()['hits'] == 2
@@ -0,0 +1,72 @@
+import time
+
+import openpyxl
+import pytest
+
+from conftest import ROUTE_WORKBOOK, WH_WORKBOOK
+from excel_handler import ExcelHandler
+from formula_compiler import MAX_RANGE_CELLS, largest_range
+from wh_excel_handler import WHExcelHandler
+from workbook_loader import InvalidWorkbook, check_workbook
+
+
+def _variant(tmp_path, **cells):
+    """The route workbook with some VENDOR-WAHL cells overwritten."""
+    wb = openpyxl.load_workbook(ROUTE_WORKBOOK)
+    ws = wb['VENDOR-WAHL']
+    for coordinate, value in cells.items():
+        ws[coordinate] = value
+    path = tmp_path / 'variant.xlsx'
+    wb.save(path)
+    return str(path)
+
+
+def test_builtin_workbooks_pass():
+    assert check_workbook(ROUTE_WORKBOOK, ExcelHandler.REQUIRED_HEADERS) == []
+    assert check_workbook(WH_WORKBOOK, WHExcelHandler.REQUIRED_HEADERS) == []
+
+
+def test_unsupported_formulas_in_read_cells_only_warn(tmp_path):
+    path = _variant(tmp_path, N5='=IF(F3>1,1,2)', O5='=VLOOKUP(F3,A:B,2,FALSE)', P5='=ROUND(F3,1)')
+    warnings = check_workbook(path, ExcelHandler.REQUIRED_HEADERS)
+    assert len(warnings) == 3
+    assert all('counts as 0' in w for w in warnings)
+
+
+def test_cells_the_engine_never_reads_are_not_checked(tmp_path):
+    # Above the header row, and in a column without a title
+    path = _variant(tmp_path, A1='=IF(1,2,3)', Z6='=VLOOKUP(A1,A:B,2)', Z7='=SUM(A1:Z100000)')
+    assert check_workbook(path, ExcelHandler.REQUIRED_HEADERS) == []
+
+
+def test_oversized_range_is_rejected_before_compiling(tmp_path):
+    path = _variant(tmp_path, N5='=SUM(A1:Z100000)')
+    start = time.perf_counter()
+    with pytest.raises(InvalidWorkbook) as e:
+        check_workbook(path, ExcelHandler.REQUIRED_HEADERS)
+    assert time.perf_counter() - start < 1
+    assert any('VENDOR-WAHL' in p and str(MAX_RANGE_CELLS) in p for p in e.value.problems)
+
+
+def test_missing_sheet_and_header_are_reported(tmp_path):
+    wb = openpyxl.load_workbook(ROUTE_WORKBOOK)
+    del wb['WAHL-DGWA']
+    wb['VENDOR-WAHL']['K2'] = 'Not the map'
+    path = tmp_path / 'broken.xlsx'
+    wb.save(path)
+    with pytest.raises(InvalidWorkbook) as e:
+        check_workbook(str(path), ExcelHandler.REQUIRED_HEADERS)
+    problems = ' '.join(e.value.problems)
+    assert 'WAHL-DGWA' in problems and 'VENDOR-WAHL' in problems
+
+
+def test_non_xlsx_is_rejected(tmp_path):
+    path = tmp_path / 'notes.xlsx'
+    path.write_text('not a workbook')
+    with pytest.raises(InvalidWorkbook):
+        check_workbook(str(path), ExcelHandler.REQUIRED_HEADERS)
+
+
+def test_largest_range():
+    assert largest_range('=SUM(A1:B2)+SUM($C$1:$C$10)') == 10
+    assert largest_range('=A1+B2') == 0
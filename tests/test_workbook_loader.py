@@ -0,0 +1,42 @@
+import openpyxl
+from openpyxl.styles import Font
+
+from conftest import ROUTE_WORKBOOK, WH_WORKBOOK
+from workbook_loader import load_workbook_data
+
+
+def _assert_matches_openpyxl(path):
+    book = load_workbook_data(path)
+    values = openpyxl.load_workbook(path, data_only=True)
+    formulas = openpyxl.load_workbook(path)
+    assert book.sheetnames == values.sheetnames
+    for name in book.sheetnames:
+        sheet, ws, fs = book[name], values[name], formulas[name]
+        for row in ws.iter_rows():
+            for cell in row:
+                assert sheet.value(cell.row, cell.column) == cell.value, (name, cell.coordinate)
+                text = fs.cell(cell.row, cell.column).value
+                if isinstance(text, str) and text.startswith('='):
+                    assert sheet.formula(cell.row, cell.column) == text, (name, cell.coordinate)
+
+
+def test_route_workbook_matches_openpyxl():
+    _assert_matches_openpyxl(ROUTE_WORKBOOK)
+
+
+def test_wh_workbook_matches_openpyxl():
+    _assert_matches_openpyxl(WH_WORKBOOK)
+
+
+def test_only_filled_cells_size_the_grid(tmp_path):
+    wb = openpyxl.load_workbook(ROUTE_WORKBOOK)
+    wb['VENDOR-WAHL'].cell(200000, 40).font = Font(bold=True)
+    wb['VENDOR-WAHL'].merge_cells('AA5000:AB5001')
+    path = tmp_path / 'stray.xlsx'
+    wb.save(path)
+
+    sheet = load_workbook_data(str(path))['VENDOR-WAHL']
+    original = load_workbook_data(ROUTE_WORKBOOK)['VENDOR-WAHL']
+    assert (sheet.max_row, sheet.max_column) == (original.max_row, original.max_column)
+    assert len(sheet.kinds) == original.max_row * original.max_column
+    assert sheet.value(200000, 40) is None
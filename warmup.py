@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+
+class Warmup:
+    """Loads the built-in workbooks into their registries.
+
+    run() returns once they are loaded, which is what a plain import of
+    the app does; processes forked after that inherit the loaded models
+    and are ready as well. start() only registers them, so the registries
+    build them in the background while the app already answers requests;
+    it does so once per process, so every forked gunicorn worker warms up
+    on its own. status() is the /healthz/ready report.
+    """
+
+    def __init__(self, workbooks):
+        self.workbooks = workbooks  # (registry, xlsx path)
+        self.ids = {}  # registry kind -> workbook id
+        self.started = None
+        self.ready_after = None
+        self.pid = None
+        self.preloaded = False  # run() finished, so forks share the models
+        self.lock = threading.Lock()
+
+    def run(self):
+        with self.lock:
+            self.pid = os.getpid()
+            self._register(wait=True)
+            self.ready_after = time.monotonic() - self.started
+            self.preloaded = True
+
+    def start(self):
+        if self._owned():
+            return
+        with self.lock:
+            if self._owned():
+                return
+            self.pid = os.getpid()
+            self.ids = {}
+            self.ready_after = None
+            self._register(wait=False)
+
+    def _register(self, wait):
+        self.started = time.monotonic()
+        for registry, path in self.workbooks:
+            workbook_id, _ = registry.register(path, pinned=True, default=True, wait=wait)
+            self.ids[registry.kind] = workbook_id
+
+    def _owned(self):
+        # The ids belong to this process, or were loaded before it forked
+        return self.preloaded or self.pid == os.getpid()
+
+    def status(self):
+        owned = self._owned()
+        models = {}
+        for registry, path in self.workbooks:
+            workbook_id = self.ids.get(registry.kind) if owned else None
+            models[registry.kind] = {
+                "workbook_id": workbook_id,
+                "file": os.path.basename(path),
+                "status": registry.load_state(workbook_id) if workbook_id else "queued",
+            }
+        loaded = sum(1 for model in models.values() if model["status"] == "ready")
+        ready = loaded == len(models)
+        elapsed = None
+        if self.started is not None and owned:
+            if ready and self.ready_after is None:
+                self.ready_after = time.monotonic() - self.started
+            elapsed = self.ready_after if ready else time.monotonic() - self.started
+        return {
+            "ready": ready,
+            "loaded": loaded,
+            "total": len(models),
+            "elapsed_seconds": elapsed,
+            "models": models,
+        }
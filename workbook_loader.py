@@ -0,0 +1,562 @@
+import hashlib
+import pickle
+import posixpath
+import sys
+import zipfile
+from array import array
+import xml.etree.ElementTree as ET
+
+from formula_compiler import MAX_RANGE_CELLS, FormulaError, column_index, compile_formula, largest_range, ref_name
+
+# openpyxl is only imported by the functions that parse an xlsx, so a
+# process that gets its models from the model cache never loads it
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+_COLUMNS = {}
+
+
+def _split_coordinate(coordinate):
+    # 'AB12' -> (12, 28); faster than openpyxl's regex for every cell
+    i = 0
+    while not coordinate[i].isdigit():
+        i += 1
+    letters = coordinate[:i]
+    col = _COLUMNS.get(letters)
+    if col is None:
+        col = _COLUMNS[letters] = column_index(letters)
+    return int(coordinate[i:]), col
+
+
+# Cell kinds of the compact value grid
+EMPTY, INT, FLOAT, STRING, OTHER = range(5)
+
+# Integers are kept in the float buffer only while they convert back exactly
+MAX_EXACT_INT = 2 ** 53
+
+
+class SheetData:
+    """Compact snapshot of the cached values, formulas and row 1 fills of a sheet.
+
+    Replaces the pair of openpyxl worksheets (data_only=True / False) the
+    handlers used to keep: value() is what the data_only workbook returned,
+    formula() the '=...' text of formula cells (None for plain cells).
+
+    Values live in a dense row-major grid of two flat buffers instead of one
+    Python object per cell: `kinds` (array 'B') tells how to read `numbers`
+    (array 'd'), which holds the number itself or the index of an interned
+    string in `strings`. Booleans and dates go to the small `others` table,
+    formulas to the `formulas` side table.
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.kinds = array('B')
+        self.numbers = array('d')
+        self.strings = []
+        self.others = {}
+        self.formulas = {}
+        self.fills = {}
+        self.max_row = 1
+        self.max_column = 1
+        # Digest of what the sheet was read from and the shared strings it
+        # can refer to (see load_workbook_data)
+        self.source = None
+        self.string_count = 0
+
+    def value(self, row, col):
+        if row < 1 or col < 1 or row > self.max_row or col > self.max_column:
+            return None
+        i = (row - 1) * self.max_column + col - 1
+        kind = self.kinds[i]
+        if kind == EMPTY:
+            return None
+        if kind == STRING:
+            return self.strings[int(self.numbers[i])]
+        if kind == INT:
+            return int(self.numbers[i])
+        if kind == FLOAT:
+            return self.numbers[i]
+        return self.others[i]
+
+    def formula(self, row, col):
+        return self.formulas.get((row, col))
+
+    # Pickled (see model_cache) with the two grid buffers out of band, so a
+    # memory mapped cache file backs them directly as read-only memoryviews
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['kinds'] = pickle.PickleBuffer(self.kinds)
+        state['numbers'] = pickle.PickleBuffer(self.numbers)
+        return state
+
+    def __setstate__(self, state):
+        state['kinds'] = memoryview(state['kinds']).cast('B')
+        state['numbers'] = memoryview(state['numbers']).cast('B').cast('d')
+        self.__dict__.update(state)
+
+    def fill_rgb(self, row, col):
+        return self.fills.get((row, col))
+
+
+class WorkbookData:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.sheetnames = []
+        self.sheets = {}
+        self.reused = []  # sheets taken over from an earlier version of the file
+
+    def __getitem__(self, name):
+        return self.sheets[name]
+
+    def __contains__(self, name):
+        return name in self.sheets
+
+
+def load_workbook_data(file_path, sheets=None, fill_rows=(1,), reuse=None):
+    """Read an xlsx once, streaming each sheet, into a WorkbookData.
+
+    Only sheets named in `sheets` are parsed (all when None) and fill
+    colours are only kept for `fill_rows`.
+
+    Every sheet keeps a digest of its source: its zip member, the styles
+    and the shared strings it can refer to. With `reuse`, the WorkbookData
+    of an earlier version of the file, a sheet whose source digest has not
+    changed is taken over from it instead of parsed again and listed in
+    `book.reused`; checking costs a hash of the sheet's xml.
+    """
+    book = WorkbookData(file_path)
+    with zipfile.ZipFile(file_path) as zf:
+        names = set(zf.namelist())
+        shared_strings = _read_shared_strings(zf) if 'xl/sharedStrings.xml' in names else []
+        sources = _SheetSources(zf, shared_strings, fill_rows)
+        styles = None
+        for title, member in _sheet_members(zf):
+            book.sheetnames.append(title)
+            if sheets is not None and title not in sheets:
+                continue
+            if member not in names:
+                continue
+            old = reuse.sheets.get(title) if reuse is not None else None
+            if old is not None and old.source == sources.digest(member, old.string_count):
+                book.sheets[title] = old
+                book.reused.append(title)
+                continue
+            if styles is None:
+                styles = _read_styles(zf) if 'xl/styles.xml' in names else ([], [])
+            with zf.open(member) as fh:
+                reader = _HashingReader(fh)
+                sheet = _read_sheet(reader, title, shared_strings, styles, fill_rows)
+            sheet.string_count = sources.string_count(sheet)
+            sheet.source = sources.digest(member, sheet.string_count, reader.hash.digest())
+            book.sheets[title] = sheet
+    book.sheetnames = [name for name in book.sheetnames if name in book.sheets]
+    return book
+
+
+class _SheetSources:
+    """Source digests of the sheets of an open xlsx.
+
+    A sheet's values depend on its own xml, the styles (fills and date
+    formats) and the shared strings it refers to by position. Saving
+    usually only appends to the shared strings table, so a sheet is tied
+    to the table up to the last string it uses rather than to all of it.
+    """
+
+    def __init__(self, zf, shared_strings, fill_rows):
+        self.zf = zf
+        self.shared_strings = shared_strings
+        styles = zf.read('xl/styles.xml') if 'xl/styles.xml' in zf.namelist() else b''
+        self.common = hashlib.sha256(styles + repr(tuple(fill_rows)).encode()).digest()
+        self.positions = None
+        self.prefixes = {}  # string count -> digest of the table up to it
+
+    def string_count(self, sheet):
+        """Shared strings up to the last one `sheet` can refer to."""
+        if self.positions is None:
+            # Last position of each string: an upper bound if the table repeats one
+            self.positions = {s: i for i, s in enumerate(self.shared_strings)}
+        return max((self.positions.get(s, -1) for s in sheet.strings), default=-1) + 1
+
+    def digest(self, member, string_count, member_digest=None):
+        if member_digest is None:
+            h = hashlib.sha256()
+            with self.zf.open(member) as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    h.update(chunk)
+            member_digest = h.digest()
+        return hashlib.sha256(member_digest + self.common + self._strings_digest(string_count)).digest()
+
+    def _strings_digest(self, count):
+        digest = self.prefixes.get(count)
+        if digest is None:
+            h = hashlib.sha256()
+            # NUL cannot occur in xml text, so it separates the strings
+            for s in self.shared_strings[:count]:
+                h.update(s.encode('utf-8', 'surrogatepass') + b'\0')
+            digest = self.prefixes[count] = h.digest()
+        return digest
+
+
+class _HashingReader:
+    """Passes reads through, hashing the bytes, so a sheet is hashed while parsed."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        self.hash.update(data)
+        return data
+
+
+# The handlers look for their header row among the first rows of a sheet
+HEADER_ROWS = 5
+# Formula problems (and warnings) listed per sheet before the rest are only counted
+MAX_FORMULA_PROBLEMS = 5
+
+
+class InvalidWorkbook(ValueError):
+    """An xlsx without the sheets, headers or formulas a handler needs."""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problems))
+        self.problems = problems
+
+
+def check_workbook(file_path, required, check_rows=100):
+    """Check that an xlsx has what a handler needs before it is loaded.
+
+    `required` maps each sheet that must be there to the header titles that
+    must share one of its first HEADER_ROWS rows. Only those rows and the
+    formulas of the first `check_rows` rows are read (plus the shared
+    strings up to the last one the headers use), so a wrong file of any
+    size is turned away in milliseconds. Raises InvalidWorkbook listing
+    every problem found.
+
+    Formulas are only looked at where the handlers read them: below the
+    header row, in columns with a title. A range there over
+    MAX_RANGE_CELLS is a problem (checked on the text, before compiling);
+    a formula the engine does not support counts as 0 when priced, as it
+    always has, and is returned as a warning.
+    """
+    try:
+        zf = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile:
+        raise InvalidWorkbook(["Not an .xlsx file"])
+    with zf:
+        try:
+            members = dict(_sheet_members(zf))
+        except (KeyError, ET.ParseError):
+            raise InvalidWorkbook(["Not an Excel workbook"])
+        names = set(zf.namelist())
+        problems = []
+        scanned = {}
+        for title in required:
+            member = members.get(title)
+            if member not in names:
+                problems.append(f"Missing sheet '{title}'")
+                continue
+            try:
+                with zf.open(member) as fh:
+                    scanned[title] = _scan_sheet_start(fh, check_rows)
+            except (ET.ParseError, zipfile.BadZipFile, ValueError) as e:
+                problems.append(f"Cannot read sheet '{title}': {e}")
+
+        string_ids = [value for header, _ in scanned.values() for cells in header.values()
+                      for value in cells.values() if isinstance(value, int)]
+        shared_strings = []
+        if string_ids and 'xl/sharedStrings.xml' in names:
+            shared_strings = _read_shared_strings(zf, limit=max(string_ids) + 1)
+
+    warnings = []
+    for title, (header, formulas) in scanned.items():
+        titles = required[title]
+        header_row = None
+        for row in sorted(header):
+            cells = {col: value if isinstance(value, str) else _shared_string(shared_strings, value)
+                     for col, value in header[row].items()}
+            if all(t in cells.values() for t in titles):
+                header_row = row
+                break
+        if header_row is None:
+            problems.append(f"Sheet '{title}' has no header row with {', '.join(titles)} "
+                            f"in its first {HEADER_ROWS} rows")
+            continue
+
+        too_large, unsupported = [], []
+        for row, col, text in formulas:
+            if row <= header_row or not cells.get(col):
+                continue
+            where = f"'{title}'!{ref_name(row, col)} '{text}'"
+            if largest_range(text) > MAX_RANGE_CELLS:
+                too_large.append(f"Formula at {where} uses a range of more than {MAX_RANGE_CELLS} cells")
+                continue
+            try:
+                compile_formula(text, row)
+            except FormulaError as e:
+                unsupported.append(f"Formula at {where} is not supported and counts as 0: {e}")
+        problems.extend(_first_few(too_large, title))
+        warnings.extend(_first_few(unsupported, title))
+    if problems:
+        raise InvalidWorkbook(problems)
+    return warnings
+
+
+def _first_few(messages, title):
+    if len(messages) <= MAX_FORMULA_PROBLEMS:
+        return messages
+    return messages[:MAX_FORMULA_PROBLEMS] + [f"... and {len(messages) - MAX_FORMULA_PROBLEMS} more in '{title}'"]
+
+
+def _scan_sheet_start(fh, check_rows):
+    """({row: {col: header text or shared string index}} of the first
+    HEADER_ROWS rows, [(row, col, formula)] of the first `check_rows` rows)
+    of a sheet.
+
+    Only the first cell of a shared formula carries its text; the others
+    are translations of it and parse whenever it does.
+    """
+    header = {}
+    formulas = []
+    cell_tag, row_tag, f_tag, v_tag = NS + 'c', NS + 'row', NS + 'f', NS + 'v'
+    for _, elem in ET.iterparse(fh):
+        if elem.tag == row_tag:
+            elem.clear()
+        if elem.tag != cell_tag:
+            continue
+        row, col = _split_coordinate(elem.get('r'))
+        if row > check_rows:
+            break
+        f = elem.find(f_tag)
+        if f is not None and f.text:
+            formulas.append((row, col, '=' + f.text))
+        if row <= HEADER_ROWS:
+            data_type = elem.get('t')
+            v = elem.find(v_tag)
+            inline = elem.find(NS + 'is')
+            if data_type == 's' and v is not None:
+                header.setdefault(row, {})[col] = int(v.text)
+            elif data_type == 'inlineStr' and inline is not None:
+                header.setdefault(row, {})[col] = _text_of(inline)
+            elif data_type == 'str' and v is not None and v.text:
+                header.setdefault(row, {})[col] = v.text
+        elem.clear()
+    return header, formulas
+
+
+def _shared_string(shared_strings, index):
+    return shared_strings[index] if index < len(shared_strings) else None
+
+
+def _sheet_members(zf):
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    for rel in rels.iter(PKG_REL_NS + 'Relationship'):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join('xl', target))
+        targets[rel.get('Id')] = target
+
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    members = []
+    for sheet in workbook.iter(NS + 'sheet'):
+        rel_id = sheet.get(REL_NS + 'id')
+        if rel_id in targets:
+            members.append((sheet.get('name'), targets[rel_id]))
+    return members
+
+
+def _read_shared_strings(zf, limit=None):
+    """The shared strings table, or its first `limit` strings."""
+    strings = []
+    with zf.open('xl/sharedStrings.xml') as fh:
+        for _, elem in ET.iterparse(fh):
+            if elem.tag == NS + 'si':
+                strings.append(_text_of(elem))
+                elem.clear()
+                if limit is not None and len(strings) >= limit:
+                    break
+    return strings
+
+
+def _text_of(elem):
+    # Plain <t> or rich text runs <r><t>; phonetic runs (<rPh>) are skipped
+    parts = []
+    for child in elem:
+        if child.tag == NS + 't':
+            parts.append(child.text or '')
+        elif child.tag == NS + 'r':
+            for t in child.iter(NS + 't'):
+                parts.append(t.text or '')
+    return ''.join(parts)
+
+
+def _read_styles(zf):
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+    root = ET.fromstring(zf.read('xl/styles.xml'))
+
+    fill_rgbs = []
+    fills = root.find(NS + 'fills')
+    if fills is not None:
+        for fill in fills.iter(NS + 'fill'):
+            fg = fill.find(f'{NS}patternFill/{NS}fgColor')
+            fill_rgbs.append(fg.get('rgb') if fg is not None else None)
+
+    custom_formats = {}
+    num_fmts = root.find(NS + 'numFmts')
+    if num_fmts is not None:
+        for fmt in num_fmts.iter(NS + 'numFmt'):
+            custom_formats[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+
+    xfs = []
+    cell_xfs = root.find(NS + 'cellXfs')
+    if cell_xfs is not None:
+        for xf in cell_xfs.iter(NS + 'xf'):
+            fill_id = int(xf.get('fillId', 0))
+            fmt_id = int(xf.get('numFmtId', 0))
+            fmt = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+            xfs.append((fill_rgbs[fill_id] if fill_id < len(fill_rgbs) else None,
+                        bool(fmt) and is_date_format(fmt)))
+    return xfs
+
+
+class _GridBuilder:
+    """Collects streamed cells as compact (row, col, kind, number) columns."""
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.rows = array('L')
+        self.cols = array('L')
+        self.kinds = array('B')
+        self.numbers = array('d')
+        self.others = []
+        self.string_ids = {}
+
+    def add(self, row, col, value):
+        if isinstance(value, str):
+            idx = self.string_ids.get(value)
+            if idx is None:
+                idx = self.string_ids[value] = len(self.sheet.strings)
+                self.sheet.strings.append(sys.intern(value))
+            kind, number = STRING, idx
+        elif isinstance(value, float):
+            kind, number = FLOAT, value
+        elif isinstance(value, int) and not isinstance(value, bool) and abs(value) <= MAX_EXACT_INT:
+            kind, number = INT, value
+        else:
+            kind, number = OTHER, len(self.others)
+            self.others.append(value)
+        self.rows.append(row)
+        self.cols.append(col)
+        self.kinds.append(kind)
+        self.numbers.append(number)
+
+    def build(self, max_row, max_col):
+        sheet = self.sheet
+        size = max_row * max_col
+        kinds = array('B', bytes(size))
+        numbers = array('d', bytes(8 * size))
+        for row, col, kind, number in zip(self.rows, self.cols, self.kinds, self.numbers):
+            i = (row - 1) * max_col + col - 1
+            kinds[i] = kind
+            if kind == OTHER:
+                sheet.others[i] = self.others[int(number)]
+            else:
+                numbers[i] = number
+        sheet.kinds = kinds
+        sheet.numbers = numbers
+        sheet.max_row = max_row
+        sheet.max_column = max_col
+        return sheet
+
+
+def _read_sheet(fh, title, shared_strings, xfs, fill_rows):
+    sheet = SheetData(title)
+    grid = _GridBuilder(sheet)
+    shared_formulas = {}
+    max_row = max_col = 1
+
+    # The grid only spans cells holding a value or formula: an empty cell
+    # that is merely formatted (or a merge range) far down or to the right
+    # would otherwise blow the dense grid up to that corner
+    cell_tag, row_tag, f_tag = NS + 'c', NS + 'row', NS + 'f'
+    for _, elem in ET.iterparse(fh):
+        tag = elem.tag
+        if tag == cell_tag:
+            row, col = _split_coordinate(elem.get('r'))
+
+            style = xfs[int(elem.get('s', 0))] if xfs else (None, False)
+            if row in fill_rows and style[0]:
+                sheet.fills[(row, col)] = style[0]
+
+            f = elem.find(f_tag)
+            if f is not None:
+                formula = _formula_text(f, elem.get('r'), shared_formulas)
+                if formula:
+                    sheet.formulas[(row, col)] = sys.intern(formula)
+                    max_row = max(max_row, row)
+                    max_col = max(max_col, col)
+
+            value = _cell_value(elem, shared_strings, style[1])
+            if value is not None:
+                grid.add(row, col, value)
+                max_row = max(max_row, row)
+                max_col = max(max_col, col)
+            elem.clear()
+        elif tag == row_tag:
+            elem.clear()
+
+    return grid.build(max_row, max_col)
+
+
+def _formula_text(f, coordinate, shared_formulas):
+    text = f.text
+    if f.get('t') == 'shared':
+        si = f.get('si')
+        if text:
+            shared_formulas[si] = (coordinate, '=' + text)
+        elif si in shared_formulas:
+            from openpyxl.formula.translate import Translator
+            origin, master = shared_formulas[si]
+            return Translator(master, origin=origin).translate_formula(coordinate)
+    return '=' + text if text else None
+
+
+def _cell_value(elem, shared_strings, is_date):
+    data_type = elem.get('t', 'n')
+    if data_type == 'inlineStr':
+        inline = elem.find(NS + 'is')
+        return _text_of(inline) if inline is not None else None
+
+    v = elem.find(NS + 'v')
+    if v is None or v.text is None:
+        return None
+    text = v.text
+
+    if data_type == 's':
+        return shared_strings[int(text)]
+    if data_type == 'b':
+        return bool(int(text))
+    if data_type in ('str', 'e'):
+        return text
+    if data_type == 'd':
+        from openpyxl.utils.datetime import from_ISO8601
+        return from_ISO8601(text)
+
+    if '.' in text or 'E' in text or 'e' in text:
+        number = float(text)
+    else:
+        number = int(text)
+    if is_date:
+        from openpyxl.utils.datetime import from_excel
+        try:
+            return from_excel(number)
+        except (ValueError, OverflowError):
+            return number
+    return number